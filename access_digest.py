@@ -0,0 +1,123 @@
+"""Digest emails for new voter access requests.
+
+Without it, every access request emails every admin, so a roll-call link
+that goes viral turns 5,000 requests into 50,000 queued emails. With
+ACCESS_REQUEST_DIGEST_SECONDS > 0, request_access() only records the
+pending elector. Once per window a background thread claims pending
+requests that have not been reported yet (notified_at IS NULL) with
+chunked compare-and-set UPDATEs (WHERE id IN (...) AND still unreported,
+then reading back the ids stamped with this claim's time), so several workers never report the same request
+twice and a big backlog costs a handful of statements, not one per row. It then queues a single digest, encoded once and shared by
+all admins (outbox.enqueue_shared), in the same transaction as the claims:
+if queueing fails, the requests are reported in the next window.
+
+Requests approved or rejected before the window closes are no longer
+pending and are left out. With the window set to 0, request_access() sends
+one email per request as before.
+"""
+import threading
+from flask import render_template
+from sqlalchemy import select, update
+from models import db, Admin, Election, Elector
+from utils import get_ist_now
+
+CLAIM_LIMIT = 5000
+CLAIM_CHUNK = 500
+LIST_LIMIT = 50
+
+
+class AccessRequestDigest:
+    def __init__(self, window_seconds=300):
+        self.window_seconds = window_seconds
+        self.app = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.window_seconds > 0
+
+    def init_app(self, app):
+        self.app = app
+        self.window_seconds = app.config.get('ACCESS_REQUEST_DIGEST_SECONDS', self.window_seconds)
+        if self.enabled and app.config.get('OUTBOX_AUTOSTART', True) and not app.testing:
+            self.start()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='access-digest', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.window_seconds):
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"Access request digest error: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+    def claim(self, now):
+        """Marks up to CLAIM_LIMIT unreported pending requests as notified. Returns the ids this worker won."""
+        candidates = [elector_id for (elector_id,) in db.session.query(Elector.id)
+                      .filter(Elector.status == 'pending', Elector.notified_at.is_(None))
+                      .order_by(Elector.id).limit(CLAIM_LIMIT)]
+        won = []
+        for i in range(0, len(candidates), CLAIM_CHUNK):
+            chunk = candidates[i:i + CLAIM_CHUNK]
+            # One set-based compare-and-set per chunk, then read back the rows stamped with this claim's time.
+            # (RETURNING would save the read, but needs SQLite 3.35+.)
+            db.session.execute(
+                update(Elector)
+                .where(Elector.id.in_(chunk), Elector.status == 'pending', Elector.notified_at.is_(None))
+                .values(notified_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            won += db.session.execute(
+                select(Elector.id).where(Elector.id.in_(chunk), Elector.notified_at == now).order_by(Elector.id)
+            ).scalars().all()
+        return won
+
+    def run_once(self, now=None):
+        """Claims unreported requests and queues one digest to all admins. Returns the number of requests reported."""
+        from outbox import enqueue_shared
+
+        now = now or get_ist_now()
+        claimed = self.claim(now)
+        if not claimed:
+            db.session.commit()
+            return 0
+
+        sections = {}
+        for i in range(0, len(claimed), 500):
+            rows = db.session.query(Elector.election_id, Elector.name, Elector.email, Elector.phone, Election.title)\
+                .join(Election, Election.id == Elector.election_id)\
+                .filter(Elector.id.in_(claimed[i:i + 500])).order_by(Elector.election_id, Elector.id)
+            for row in rows:
+                section = sections.setdefault(row.election_id, {'title': row.title, 'count': 0, 'requests': []})
+                section['count'] += 1
+                if len(section['requests']) < LIST_LIMIT:
+                    section['requests'].append(row)
+
+        recipients = [email for (email,) in db.session.query(Admin.email) if email]
+        if not recipients:
+            db.session.commit()
+            return len(claimed)
+        html = render_template('email/access_request_digest.html', sections=list(sections.values()),
+                               total=len(claimed), list_limit=LIST_LIMIT)
+        subject = f"{len(claimed)} new access request{'s' if len(claimed) != 1 else ''} pending approval"
+        enqueue_shared(recipients, subject, html, True)
+        # The claims and the queued emails commit together.
+        db.session.commit()
+        print(f"Access request digest: reported {len(claimed)} requests to {len(recipients)} admins")
+        return len(claimed)
+
+
+digest = AccessRequestDigest()
@@ -22,6 +22,11 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    hops = app.config.get('TRUSTED_PROXY_HOPS', 0)
+    if hops:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
     db.init_app(app)
     login_manager.init_app(app)
     
@@ -34,23 +39,14 @@ def create_app(config_class=Config):
         from utils import get_ist_now
         return {'now': get_ist_now}
 
-    @app.before_request
-    def check_election_expiry():
-        from models import Election
-        from utils import get_ist_now
-        
-        expired_elections = Election.query.filter(
-            Election.status == 'active', 
-            Election.end_time <= get_ist_now()
-        ).all()
-        
-        if expired_elections:
-            for election in expired_elections:
-                election.status = 'completed'
-            db.session.commit()
-
+    from lifecycle import scheduler
+    scheduler.init_app(app)
 
+    from roll_index import roll_index
+    roll_index.init_app(app)
 
+    from realtime import feed
+    feed.init_app(app)
 
     @app.errorhandler(404)
     def page_not_found(e):
@@ -66,6 +62,10 @@ def create_app(config_class=Config):
 
     with app.app_context():
         db.create_all()
+        from migrations import upgrade_schema
+        upgrade_schema()
+        from importer import expire_stale_jobs
+        expire_stale_jobs(app.config.get('IMPORT_JOB_TIMEOUT_SECONDS', 900))
         if not Admin.query.filter_by(username='admin').first():
             hashed_password = generate_password_hash('admin', method='pbkdf2:sha256')
             default_admin = Admin(
@@ -124,8 +124,19 @@ def create_app(config_class=Config):
                 praveen.is_super_admin = False
                 db.session.commit()
 
+    from outbox import dispatcher, priority_dispatcher
+    dispatcher.init_app(app)
+    priority_dispatcher.init_app(app)
+
+    from access_digest import digest
+    digest.init_app(app)
+
     return app
 
 if __name__ == '__main__':
     app = create_app()
-    app.run(debug=True)
+    from realtime import feed
+    if feed.enabled:
+        feed.socketio.run(app, debug=True)
+    else:
+        app.run(debug=True)
@@ -1,22 +1,24 @@
 from app import create_app
 from models import db, Elector
+from purge import delete_electors_matching
 
 app = create_app()
 
 with app.app_context():
     print("Scanning for rejected electors...")
-    rejected = Elector.query.filter_by(status='rejected').all()
-    
-    if not rejected:
+    counts = db.session.query(Elector.election_id, Elector.has_voted, db.func.count(Elector.id))\
+        .filter(Elector.status == 'rejected').group_by(Elector.election_id, Elector.has_voted).all()
+
+    if not counts:
         print("No rejected electors found.")
     else:
-        print(f"Found {len(rejected)} rejected electors.")
-        for elector in rejected:
-            if elector.has_voted:
-                print(f"SKIPPING: {elector.name} (has_voted=True) - Status is rejected but has voted? Manual check required.")
+        print(f"Found {sum(count for _, _, count in counts)} rejected electors.")
+        for election_id, has_voted, count in counts:
+            if has_voted:
+                print(f"SKIPPING: {count} rejected electors in election {election_id} have voted - Manual check required.")
             else:
-                print(f"Deleting: {elector.name}")
-                db.session.delete(elector)
-        
+                deleted = delete_electors_matching(election_id, Elector.status == 'rejected', Elector.has_voted.isnot(True))
+                print(f"Deleting: {deleted} rejected electors from election {election_id}")
+
         db.session.commit()
         print("Cleanup complete.")
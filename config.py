@@ -28,3 +28,71 @@ class Config:
         }
 
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+
+    # Upper bound (seconds) between lifecycle schedule refreshes, so edits made by other workers are picked up
+    LIFECYCLE_RESYNC_SECONDS = int(os.environ.get('LIFECYCLE_RESYNC_SECONDS', 300))
+
+    # Email outbox: dispatcher poll interval, retry policy and lease for rows left 'sending' by a dead worker
+    OUTBOX_AUTOSTART = os.environ.get('OUTBOX_AUTOSTART', '1') == '1'
+    OUTBOX_POLL_SECONDS = int(os.environ.get('OUTBOX_POLL_SECONDS', 5))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 6))
+    OUTBOX_BACKOFF_SECONDS = int(os.environ.get('OUTBOX_BACKOFF_SECONDS', 30))
+    OUTBOX_MAX_BACKOFF_SECONDS = int(os.environ.get('OUTBOX_MAX_BACKOFF_SECONDS', 3600))
+    OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', 300))
+    # Days finished (sent/dead) outbox rows are kept, without their content, before being deleted (minimum 1)
+    OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
+    # Messages per Gmail batch HTTP request (API maximum is 100; Google recommends staying at or below 50)
+    GMAIL_BATCH_SIZE = int(os.environ.get('GMAIL_BATCH_SIZE', 50))
+    # Sends per minute, and the share of the daily quota, that bulk mail never uses: kept for OTPs and other priority mail
+    OUTBOX_PRIORITY_RESERVE = int(os.environ.get('OUTBOX_PRIORITY_RESERVE', 5))
+    OUTBOX_PRIORITY_DAILY_SHARE = float(os.environ.get('OUTBOX_PRIORITY_DAILY_SHARE', 0.2))
+
+    # OTP storage: 'sqlite' shares codes between all workers on this host, 'memory' is per-process
+    OTP_STORE = os.environ.get('OTP_STORE', 'sqlite')
+    OTP_STORE_PATH = os.environ.get('OTP_STORE_PATH') or os.path.join(basedir, 'otp_store.db')
+    OTP_TTL_SECONDS = 600
+    OTP_MAX_ATTEMPTS = int(os.environ.get('OTP_MAX_ATTEMPTS', 5))
+    OTP_MAX_ENTRIES = 10000
+
+    # Reverse proxies in front of the app whose X-Forwarded-For/-Proto headers are trusted (0 = app is reached directly).
+    # Behind a proxy, set this so rate limits key on the client's address rather than the proxy's.
+    TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+
+    # Sliding-window limits for public login endpoints: {rule: (requests, window seconds)}
+    RATE_LIMIT_ENABLED = True
+    RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'sqlite')
+    RATE_LIMIT_STORE_PATH = os.environ.get('RATE_LIMIT_STORE_PATH') or os.path.join(basedir, 'rate_limit.db')
+    RATE_LIMITS = {
+        'otp_per_email': (3, 600),
+        'otp_per_ip': (20, 600),
+        'check_phone_per_ip': (30, 60),
+        'secret_login_per_ip': (10, 300),
+        'secret_login_per_identifier': (10, 900),
+    }
+
+    # Phone login: how long a verified Firebase ID token is reused before being verified again
+    FIREBASE_TOKEN_CACHE_SECONDS = int(os.environ.get('FIREBASE_TOKEN_CACHE_SECONDS', 300))
+    FIREBASE_TOKEN_CACHE_SIZE = 1000
+
+    # Queued/running CSV imports with no progress for this long are marked failed (their worker was restarted)
+    IMPORT_JOB_TIMEOUT_SECONDS = int(os.environ.get('IMPORT_JOB_TIMEOUT_SECONDS', 900))
+
+    # Seconds before a worker rebuilds its in-memory voter-roll index from the database
+    ROLL_INDEX_TTL_SECONDS = int(os.environ.get('ROLL_INDEX_TTL_SECONDS', 120))
+
+    # Live turnout pushes to admin consoles (Flask-SocketIO). Deltas are coalesced and broadcast at most once
+    # per REALTIME_PUSH_INTERVAL seconds per election; multi-worker deployments need a shared message queue.
+    # Off by default: open consoles hold connections, so it needs an async worker, e.g. REALTIME_ENABLED=1
+    # SOCKETIO_ASYNC_MODE=eventlet with gunicorn -k eventlet -w 1 'app:create_app()' (a sync worker would be
+    # tied up by every open console). `python app.py` serves it directly for development.
+    REALTIME_ENABLED = os.environ.get('REALTIME_ENABLED', '0') == '1'
+    REALTIME_PUSH_INTERVAL = float(os.environ.get('REALTIME_PUSH_INTERVAL', 2))
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE')
+
+    # Release report email: rolls larger than this are sent as a CSV attachment instead of inline tables
+    RELEASE_REPORT_INLINE_ROWS = int(os.environ.get('RELEASE_REPORT_INLINE_ROWS', 500))
+
+    # New voter access requests are reported to admins in one digest email per window (seconds); 0 sends one
+    # email per request
+    ACCESS_REQUEST_DIGEST_SECONDS = int(os.environ.get('ACCESS_REQUEST_DIGEST_SECONDS', 300))
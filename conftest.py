@@ -0,0 +1,93 @@
+"""Shared pytest fixtures.
+
+`app` is a fresh application on an in-memory database with its app context
+pushed for the whole test; `make_app(**settings)` builds one with extra
+config on top of TestConfig (a module can override `app` with it).
+`running_election` adds a running election with one approved candidate and
+one elector, `cast` posts a ballot the way a voter's session would, and
+`login` signs a test client in as an admin who may manage everything.
+"""
+from datetime import timedelta
+import pytest
+from flask import g
+from app import create_app
+from config import Config
+from models import db, Admin, Election, Candidate, Elector
+from utils import get_ist_now
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    OTP_STORE = 'memory'
+    RATE_LIMIT_STORE = 'memory'
+
+
+@pytest.fixture
+def make_app():
+    contexts = []
+
+    def make(**settings):
+        config = type('Config', (TestConfig,), settings)
+        app = create_app(config)
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
+        return app
+
+    yield make
+    for context in reversed(contexts):
+        db.session.remove()
+        context.pop()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def running_election(app):
+    """(election, candidate, elector): voting is open for another hour; the elector's code is 123456."""
+    now = get_ist_now()
+    election = Election(
+        title='Ballot Test',
+        nomination_start=now - timedelta(hours=3),
+        nomination_end=now - timedelta(hours=2),
+        start_time=now - timedelta(hours=1),
+        end_time=now + timedelta(hours=1),
+        status='active'
+    )
+    db.session.add(election)
+    db.session.commit()
+    candidate = Candidate(election_id=election.id, name='Alice', status='approved')
+    elector = Elector(election_id=election.id, name='Voter', email='voter@example.com', secret_code='123456')
+    db.session.add_all([candidate, elector])
+    db.session.commit()
+    return election, candidate, elector
+
+
+@pytest.fixture
+def cast():
+    def cast(client, election_id, elector_id, candidate_id):
+        with client.session_transaction() as sess:
+            sess['voter_elector_id'] = elector_id
+            sess['voter_election_id'] = election_id
+        return client.post(f'/vote/{election_id}/ballot', data={'candidate_id': candidate_id})
+    return cast
+
+
+@pytest.fixture
+def login():
+    def login(client, username='javabool'):
+        admin = Admin.query.filter_by(username=username).first()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(admin.id)
+        # The app context outlives requests in tests; drop any user Flask-Login cached for an earlier one.
+        g.pop('_login_user', None)
+    return login
@@ -0,0 +1,111 @@
+"""Adaptive throttling for outbound email.
+
+Both send budgets are read from the outbox table, not kept in memory, so
+they hold across restarts and across every worker: the rolling 24h budget
+counts rows sent in the last day, the per-minute budget counts rows sent in
+the last 60 seconds plus rows currently being sent. There is no daily cap
+unless one is configured (per_day). Concurrency, i.e. how many Gmail requests the dispatcher runs at
+once, follows AIMD: it grows by one after a full round of fast successful
+requests, shrinks by one when requests are slower than the target latency,
+and halves with a cool-down pause whenever Gmail answers 429 / rate limit
+exceeded. Latency is measured per message, so a batch request of 100
+messages is judged by the same target as a single send. The configured
+thread limit is only the ceiling. Bulk mail acquires with two reserves that
+it can never use: a few sends per minute and a share of the daily quota
+(when there is one), both left for the outbox's priority lane (OTPs).
+"""
+import threading
+import time
+
+THROTTLE_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', 'dailyLimitExceeded')
+
+DEFAULT_PER_MINUTE = 60
+DEFAULT_PER_DAY = None  # unlimited
+# Seconds per message (a batch request's latency divided by its size)
+DEFAULT_TARGET_LATENCY = 5.0
+COOLDOWN_SECONDS = 30
+MAX_COOLDOWN_SECONDS = 300
+
+
+def is_throttle_error(error):
+    """True if a Gmail API error means we are sending too fast or are out of quota."""
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status == 429:
+        return True
+    return any(reason in str(error) for reason in THROTTLE_REASONS)
+
+
+class AdaptiveLimiter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.configure()
+        self.throttle_events = 0
+        self.avg_latency = None
+
+    def configure(self, max_concurrency=5, per_minute=DEFAULT_PER_MINUTE, per_day=DEFAULT_PER_DAY,
+                  target_latency=DEFAULT_TARGET_LATENCY):
+        with self._lock:
+            self.max_concurrency = max(1, int(max_concurrency))
+            self.per_minute = max(1, int(per_minute))
+            self.per_day = max(1, int(per_day)) if per_day else None
+            self.target_latency = float(target_latency)
+            self.concurrency = min(getattr(self, 'concurrency', 1), self.max_concurrency)
+            self._successes = 0
+            self._cooldown_until = 0.0
+            self._consecutive_throttles = 0
+
+    def acquire(self, wanted, sent_today, sent_last_minute, reserve=0, daily_reserve=0):
+        """Returns how many messages may be sent now (0 while cooling down or out of budget).
+
+        sent_today and sent_last_minute come from the shared outbox table. reserve (per minute) and
+        daily_reserve (per day) are left untouched, for higher-priority mail.
+        """
+        with self._lock:
+            if time.monotonic() < self._cooldown_until:
+                return 0
+            today = wanted if self.per_day is None else \
+                self.per_day - sent_today - min(daily_reserve, self.per_day - 1)
+            this_minute = self.per_minute - sent_last_minute - min(reserve, self.per_minute - 1)
+            return max(0, min(wanted, today, this_minute))
+
+    def record(self, latency, throttled, messages=1):
+        """Feeds back the outcome of one Gmail request (a single send, or a batch of `messages`)."""
+        latency = latency / max(1, messages)
+        with self._lock:
+            self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+            if throttled:
+                self.throttle_events += 1
+                self._consecutive_throttles += 1
+                self.concurrency = max(1, self.concurrency // 2)
+                self._successes = 0
+                pause = min(MAX_COOLDOWN_SECONDS, COOLDOWN_SECONDS * 2 ** (self._consecutive_throttles - 1))
+                self._cooldown_until = time.monotonic() + pause
+                print(f"Email throttled by Gmail: concurrency -> {self.concurrency}, pausing {pause}s")
+                return
+            self._consecutive_throttles = 0
+            if latency > self.target_latency:
+                self.concurrency = max(1, self.concurrency - 1)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.concurrency:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    self._successes = 0
+
+    def snapshot(self, sent_today=None, sent_last_minute=None):
+        with self._lock:
+            cooldown = max(0, int(self._cooldown_until - time.monotonic()))
+            return {
+                'concurrency': self.concurrency,
+                'max_concurrency': self.max_concurrency,
+                'per_minute': self.per_minute,
+                'per_day': self.per_day,
+                'sent_today': sent_today,
+                'sent_last_minute': sent_last_minute,
+                'throttle_events': self.throttle_events,
+                'cooldown_seconds': cooldown,
+                'avg_latency': round(self.avg_latency, 2) if self.avg_latency is not None else None,
+            }
+
+
+limiter = AdaptiveLimiter()
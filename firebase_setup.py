@@ -1,9 +1,39 @@
 import firebase_admin
 from firebase_admin import credentials, auth
+import hashlib
 import os
 import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+# firebase_admin fetches Google's signing certificates through a cachecontrol session that honours
+# Cache-Control max-age. We warm that same session at startup and, shortly before the cached copy goes
+# stale, fetch it again with "Cache-Control: no-cache" so the cache is revalidated rather than served
+# back to us, and no login request has to wait for the certificate download. This reaches into private
+# firebase_admin attributes, so it only runs on the SDK major versions it was written against; on any
+# other release, or if the attributes moved, prefetching is skipped (and logged) and the SDK simply
+# fetches the certificates on demand as before. One refresh chain runs per process, however many apps
+# the factory creates.
+CERT_REFRESH_MARGIN = 60
+CERT_RETRY_SECONDS = 60
+CERT_PREFETCH_SDK_MAJORS = ('6', '7')
+
+_refresh_started = False
+_refresh_lock = threading.Lock()
+
+_verified_tokens = OrderedDict()
+_verified_lock = threading.Lock()
+_token_cache_seconds = 300
+_token_cache_size = 1000
+
 
 def initialize_firebase(app):
+    global _token_cache_seconds, _token_cache_size
+    _token_cache_seconds = app.config.get('FIREBASE_TOKEN_CACHE_SECONDS', _token_cache_seconds)
+    _token_cache_size = app.config.get('FIREBASE_TOKEN_CACHE_SIZE', _token_cache_size)
 
     cred_json = os.environ.get('FIREBASE_CREDENTIALS_JSON')
     cred = None
@@ -35,3 +65,101 @@ def initialize_firebase(app):
         pass
     except Exception as e:
         print(f"Error initializing Firebase: {e}")
+        return
+
+    if app.config.get('FIREBASE_PREWARM_CERTS', True) and not app.testing:
+        start_cert_refresh()
+
+
+def start_cert_refresh():
+    """Starts the certificate refresh chain, once per process. Returns True if this call started it."""
+    global _refresh_started
+    with _refresh_lock:
+        if _refresh_started:
+            return False
+        _refresh_started = True
+    threading.Thread(target=_refresh_certs, name='firebase-certs', daemon=True).start()
+    return True
+
+
+def _cert_fetcher():
+    """Returns (request, cert_url) for the SDK's cached certificate session, or None if it can't be reached."""
+    version = getattr(firebase_admin, '__version__', '')
+    if version.split('.')[0] not in CERT_PREFETCH_SDK_MAJORS:
+        print(f"WARNING: firebase_admin {version or '(unknown version)'} is not supported by the certificate "
+              f"prefetch; certificates are fetched on demand.")
+        return None
+    try:
+        from firebase_admin import _token_gen
+        request = auth._get_client(None)._token_verifier.request
+        return request, _token_gen.ID_TOKEN_CERT_URI
+    except (ImportError, AttributeError) as e:
+        print(f"WARNING: firebase_admin internals changed ({e}); certificate prefetch disabled.")
+        return None
+
+
+def _refresh_certs():
+    """Fetches the ID-token certificates into the SDK's HTTP cache and schedules the next refresh."""
+    delay = CERT_RETRY_SECONDS
+    try:
+        fetcher = _cert_fetcher()
+        if fetcher is None:
+            return
+        request, cert_url = fetcher
+        # no-cache makes cachecontrol skip its (still fresh) copy, fetch a new one and store it.
+        response = request(cert_url, method='GET', headers={'Cache-Control': 'no-cache'})
+        if response.status == 200:
+            fresh_for = _freshness(response.headers)
+            if fresh_for:
+                delay = max(fresh_for - CERT_REFRESH_MARGIN, CERT_RETRY_SECONDS)
+        else:
+            print(f"Firebase certificate prefetch returned HTTP {response.status}")
+    except Exception as e:
+        print(f"Firebase certificate prefetch failed: {e}")
+
+    timer = threading.Timer(delay, _refresh_certs)
+    timer.daemon = True
+    timer.start()
+
+
+def _max_age(cache_control):
+    match = re.search(r'max-age=(\d+)', cache_control)
+    return int(match.group(1)) if match else None
+
+
+def _freshness(headers, now=None):
+    """Seconds the response stays fresh: max-age minus its age (the Age header or time since Date)."""
+    max_age = _max_age(headers.get('cache-control', ''))
+    if max_age is None:
+        return None
+    age = 0
+    if headers.get('age', '').isdigit():
+        age = int(headers['age'])
+    if headers.get('date'):
+        try:
+            sent = parsedate_to_datetime(headers['date']).timestamp()
+            age = max(age, (now or time.time()) - sent)
+        except (TypeError, ValueError):
+            pass
+    return max(int(max_age - age), 0)
+
+
+def verify_id_token(id_token):
+    """auth.verify_id_token with a short TTL cache, so re-submitted logins don't verify the same token again."""
+    key = hashlib.sha256(id_token.encode()).hexdigest()
+    now = time.time()
+    with _verified_lock:
+        entry = _verified_tokens.get(key)
+        if entry and entry[0] > now:
+            return dict(entry[1])
+        _verified_tokens.pop(key, None)
+
+    claims = auth.verify_id_token(id_token)
+
+    expires_at = min(now + _token_cache_seconds, claims.get('exp', now))
+    if expires_at > now:
+        with _verified_lock:
+            _verified_tokens[key] = (expires_at, dict(claims))
+            while len(_verified_tokens) > _token_cache_size:
+                _verified_tokens.popitem(last=False)
+    return claims
@@ -0,0 +1,287 @@
+"""Streaming CSV import of electors.
+
+The upload is decoded and parsed line by line, duplicates are checked against
+in-memory sets of the election's existing phones/emails (and rows already seen
+in the file), and accepted rows are written with executemany in bounded
+batches, so import time grows linearly and memory does not depend on file size.
+
+Imports started from the admin console run as background jobs: the upload is
+spooled to a temp file, an ImportJob row records progress after every batch
+and the admin page polls it (and can request cancellation) over JSON. A running
+job records progress after every batch, and each progress save also touches
+the jobs still queued in the same process (BOOT_ID), so queued jobs waiting
+behind long imports stay alive too. Jobs that stop reporting for
+IMPORT_JOB_TIMEOUT_SECONDS (their worker died) are marked failed at startup
+and whenever they are looked at. A job only starts if it is still queued,
+so one that was already failed or cancelled never comes back.
+"""
+import codecs
+import csv
+import json
+import os
+import tempfile
+import uuid
+from collections import Counter
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, Elector, ImportJob
+from secret_codes import CONFLICT_RETRIES, CodeAllocator, taken_codes
+from utils import get_ist_now
+
+BATCH_SIZE = 1000
+# Identifies this process's import executor; queued jobs carry it so their heartbeat can be kept here.
+BOOT_ID = uuid.uuid4().hex
+
+# Column positions used when the file has no recognisable header
+DEFAULT_COLUMNS = {'phone': 0, 'email': 1, 'name': 2}
+
+import_executor = ThreadPoolExecutor(max_workers=2)
+
+
+class ImportCancelled(Exception):
+    pass
+
+
+class ImportStats:
+    def __init__(self):
+        self.parsed = 0
+        self.inserted = 0
+        self.reasons = Counter()
+
+    @property
+    def skipped(self):
+        return sum(self.reasons.values())
+
+    def skip(self, reason):
+        self.reasons[reason] += 1
+
+
+def detect_columns(first_row):
+    """Returns (columns, has_header) for the first CSV row."""
+    columns = {}
+    for i, col in enumerate(h.lower().strip() for h in first_row):
+        if 'phone' in col or 'mobile' in col:
+            columns.setdefault('phone', i)
+        elif 'email' in col:
+            columns.setdefault('email', i)
+        elif 'name' in col:
+            columns.setdefault('name', i)
+    if columns:
+        return columns, True
+    return dict(DEFAULT_COLUMNS), False
+
+
+def _cell(row, idx):
+    if idx is None or idx >= len(row):
+        return None
+    return row[idx].strip() or None
+
+
+def load_existing_contacts(election_id):
+    """Returns (phones, emails) sets already on the election's roll."""
+    phones, emails = set(), set()
+    query = db.session.query(Elector.phone, Elector.email)\
+        .filter(Elector.election_id == election_id)\
+        .execution_options(yield_per=5000)
+    for phone, email in query:
+        if phone:
+            phones.add(phone)
+        if email:
+            emails.add(email)
+    return phones, emails
+
+
+def import_electors_csv(election_id, binary_stream, batch_size=BATCH_SIZE, on_progress=None):
+    """Imports electors from a CSV byte stream. Returns ImportStats, or None if the file is empty.
+
+    on_progress(stats) is called after every batch_size parsed rows and may raise ImportCancelled.
+    """
+    lines = codecs.iterdecode(binary_stream, 'utf-8-sig')
+    reader = csv.reader(lines)
+
+    first_row = next(reader, None)
+    if first_row is None:
+        return None
+
+    columns, has_header = detect_columns(first_row)
+    phones, emails = load_existing_contacts(election_id)
+    codes = CodeAllocator.for_election(election_id)
+    stats = ImportStats()
+    batch = []
+
+    def flush():
+        if batch:
+            _insert_batch(election_id, batch, codes)
+            stats.inserted += len(batch)
+            batch.clear()
+
+    rows = reader if has_header else _prepend(first_row, reader)
+    for row in rows:
+        stats.parsed += 1
+        phone = _cell(row, columns.get('phone'))
+        email = _cell(row, columns.get('email'))
+        name = _cell(row, columns.get('name'))
+
+        if not name or not (phone or email):
+            stats.skip('missing data')
+            continue
+        if (phone and phone in phones) or (email and email in emails):
+            stats.skip('duplicate')
+            continue
+
+        if phone:
+            phones.add(phone)
+        if email:
+            emails.add(email)
+        batch.append({
+            'election_id': election_id,
+            'phone': phone,
+            'email': email,
+            'name': name,
+            'secret_code': codes.next(),
+            'status': 'approved',
+            'has_voted': False,
+        })
+        if len(batch) >= batch_size:
+            flush()
+        if on_progress and stats.parsed % batch_size == 0:
+            flush()
+            on_progress(stats)
+
+    flush()
+    return stats
+
+
+def _insert_batch(election_id, batch, codes):
+    """Inserts and commits one batch. Rows whose code an elector added meanwhile (manual add, access
+    request) are given new ones and the batch is retried."""
+    for attempt in range(CONFLICT_RETRIES):
+        try:
+            db.session.execute(insert(Elector), batch)
+            db.session.commit()
+            return
+        except IntegrityError:
+            db.session.rollback()
+            taken = taken_codes(election_id, [row['secret_code'] for row in batch])
+            if attempt == CONFLICT_RETRIES - 1 or not taken:
+                raise
+            for row in batch:
+                if row['secret_code'] in taken:
+                    row['secret_code'] = codes.next()
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def start_import_job(app, election_id, file_storage):
+    """Spools the upload to disk and queues it for a background import. Returns the ImportJob."""
+    fd, path = tempfile.mkstemp(prefix='votely_import_', suffix='.csv')
+    with os.fdopen(fd, 'wb') as tmp:
+        file_storage.save(tmp)
+
+    job = ImportJob(id=uuid.uuid4().hex, election_id=election_id, filename=file_storage.filename, owner=BOOT_ID)
+    db.session.add(job)
+    db.session.commit()
+
+    import_executor.submit(_run_import_job, app, job.id, path)
+    return job
+
+
+def _run_import_job(app, job_id, path):
+    with app.app_context():
+        # Compare-and-set: a job failed or cancelled while it waited in the queue must not start.
+        started = db.session.execute(
+            update(ImportJob).where(ImportJob.id == job_id, ImportJob.status == 'queued')
+            .values(status='running', updated_at=get_ist_now())
+        ).rowcount
+        db.session.commit()
+        if not started:
+            db.session.remove()
+            _remove_spool(path)
+            return
+
+        job = db.session.get(ImportJob, job_id)
+        try:
+            def on_progress(stats):
+                _save_progress(job, stats)
+                _touch_queued(job.updated_at)
+                db.session.commit()
+                cancelled = db.session.execute(
+                    select(ImportJob.cancel_requested).where(ImportJob.id == job_id)
+                ).scalar()
+                if cancelled:
+                    raise ImportCancelled()
+
+            with open(path, 'rb') as f:
+                stats = import_electors_csv(job.election_id, f, on_progress=on_progress)
+
+            if stats is None:
+                job.status = 'failed'
+                job.error = 'Empty file'
+            else:
+                _save_progress(job, stats)
+                job.status = 'completed'
+        except ImportCancelled:
+            job.status = 'cancelled'
+        except Exception as e:
+            print(f"Import job {job_id} failed: {e}")
+            db.session.rollback()
+            job = db.session.get(ImportJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.updated_at = get_ist_now()
+            db.session.commit()
+            from roll_index import roll_index
+            roll_index.invalidate(job.election_id)
+            db.session.remove()
+            _remove_spool(path)
+
+
+def _remove_spool(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _touch_queued(now):
+    """Heartbeat for the jobs waiting in this process's executor."""
+    db.session.execute(
+        update(ImportJob).where(ImportJob.owner == BOOT_ID, ImportJob.status == 'queued').values(updated_at=now)
+    )
+
+
+def expire_stale_jobs(timeout_seconds, election_id=None, now=None):
+    """Marks queued/running jobs with no progress for timeout_seconds as failed. Returns how many.
+
+    The executor lives in process memory, so a job that was queued or running when its worker was
+    restarted would otherwise stay unfinished forever and the manage page would poll it indefinitely.
+    Running jobs record progress after every batch and refresh the jobs queued behind them in the same
+    process, so only jobs whose process is gone go this long without an update.
+    """
+    now = now or get_ist_now()
+    stmt = update(ImportJob)\
+        .where(ImportJob.status.in_(('queued', 'running')),
+               ImportJob.updated_at < now - timedelta(seconds=timeout_seconds))\
+        .values(status='failed', updated_at=now,
+                error='The import stopped without finishing (the server was restarted or the job was lost). '
+                      'Rows imported before it stopped were kept; upload the file again to add the rest.')
+    if election_id is not None:
+        stmt = stmt.where(ImportJob.election_id == election_id)
+    expired = db.session.execute(stmt).rowcount
+    db.session.commit()
+    if expired:
+        print(f"Marked {expired} stalled import job(s) as failed")
+    return expired
+
+
+def _save_progress(job, stats):
+    job.rows_parsed = stats.parsed
+    job.rows_inserted = stats.inserted
+    job.skip_reasons = json.dumps(dict(stats.reasons))
+    job.updated_at = get_ist_now()
@@ -0,0 +1,72 @@
+import threading
+from datetime import timedelta
+from sqlalchemy import func
+from utils import get_ist_now
+
+
+class LifecycleScheduler:
+    """Applies time-based election transitions only when one is due.
+
+    The only transition stored in the database is `active -> completed` when
+    voting ends. Nomination open/close and voting start need no stored
+    change: the public routes compare the election's own timestamps with the
+    current time. The earliest end_time among active elections is kept in
+    memory, so ordinary requests only compare two datetimes; the database is
+    read again only when that time (or the resync interval) has passed.
+    """
+
+    def __init__(self, resync_seconds=300):
+        self.resync_seconds = resync_seconds
+        self.next_due = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.resync_seconds = app.config.get('LIFECYCLE_RESYNC_SECONDS', self.resync_seconds)
+        app.before_request(self.check_due)
+
+    def invalidate(self):
+        """Forces the schedule to be recomputed on the next request (call after editing election times/status)."""
+        self.next_due = None
+
+    def check_due(self):
+        now = get_ist_now()
+        if self.next_due is not None and now < self.next_due:
+            return
+        # Only one thread per worker runs the transitions; the others carry on.
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self.run_due(now)
+        except Exception as e:
+            print(f"Lifecycle scheduler error: {e}")
+            from models import db
+            db.session.rollback()
+        finally:
+            self._lock.release()
+
+    def run_due(self, now=None):
+        """Completes active elections whose voting has ended and schedules the next check. Returns their ids."""
+        from models import db, Election
+
+        now = now or get_ist_now()
+        ended = Election.query.filter(Election.status == 'active', Election.end_time <= now).all()
+        for election in ended:
+            election.status = 'completed'
+        if ended:
+            db.session.commit()
+
+        self.next_due = self._next_boundary(now)
+        return [election.id for election in ended]
+
+    def _next_boundary(self, now):
+        from models import db, Election
+
+        nearest = db.session.query(func.min(Election.end_time))\
+            .filter(Election.status == 'active', Election.end_time > now).scalar()
+        resync_at = now + timedelta(seconds=self.resync_seconds) if self.resync_seconds else None
+        if nearest:
+            return min(nearest, resync_at) if resync_at else nearest
+        return resync_at or now + timedelta(days=1)
+
+
+scheduler = LifecycleScheduler()
@@ -0,0 +1,194 @@
+"""Schema upgrades for existing databases (e.g. an older election.db).
+
+db.create_all() only creates missing tables; it never adds columns, indexes
+or constraints to tables that already exist. upgrade_schema() fills that gap,
+is safe to run repeatedly and runs automatically from create_app().
+It can also be run by hand: python migrations.py
+"""
+from sqlalchemy import inspect, text
+
+# Indexes replaced by a wider or unique one in models.py: {table: {old index: index that covers it}}. The old index is
+# dropped once its replacement exists, so writes don't keep maintaining both.
+SUPERSEDED_INDEXES = {
+    'elector': {'ix_elector_election_status': 'ix_elector_election_status_voted',
+                'ix_elector_election_code': 'uq_elector_election_code'},
+}
+
+
+def upgrade_schema():
+    """Adds missing nullable columns and indexes declared in models.py and backfills vote tallies."""
+    from models import db
+
+    inspector = inspect(db.engine)
+    created = _add_missing_columns(inspector)
+    if created:
+        inspector = inspect(db.engine)
+    if 'elector.notified_at' in created:
+        _mark_requests_notified()
+
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = _index_names(inspector, table.name)
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created.append(index.name)
+
+    if _ensure_unique_votes(inspector):
+        created.append('uq_vote_election_elector')
+    if _ensure_unique_codes(inspector):
+        created.append('uq_elector_election_code')
+
+    dropped = _drop_superseded_indexes(inspect(db.engine))
+
+    _backfill_tallies()
+    _backfill_snapshots()
+
+    if dropped:
+        print(f"Schema upgraded: dropped superseded {', '.join(dropped)}")
+    if created:
+        if db.engine.dialect.name == 'sqlite':
+            # Refresh planner statistics so the new indexes are picked up immediately.
+            with db.engine.begin() as conn:
+                conn.execute(text('ANALYZE'))
+        print(f"Schema upgraded: created {', '.join(created)}")
+    return created
+
+
+def _add_missing_columns(inspector):
+    """Adds nullable columns declared in models.py to existing tables that lack them. Returns their names."""
+    from models import db
+
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable:
+                print(f"WARNING: {table.name}.{column.name} is missing and NOT NULL; it must be added by hand.")
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                if column.default is not None and column.default.is_scalar:
+                    # Existing rows get the model's default, as new rows will.
+                    conn.execute(table.update().values({column.name: column.default.arg}))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def _index_names(inspector, table):
+    """Names of the table's indexes. SQLAlchemy does not reflect expression indexes (lower(email)) on SQLite,
+    so there they are read from sqlite_master."""
+    from models import db
+
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            return set(conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table"),
+                                    {'table': table}).scalars())
+    return {i['name'] for i in inspector.get_indexes(table)}
+
+
+def _drop_superseded_indexes(inspector):
+    """Drops old indexes whose replacement (SUPERSEDED_INDEXES) now exists. Returns the dropped names."""
+    from models import db
+
+    dropped = []
+    for table, replaced in SUPERSEDED_INDEXES.items():
+        if not inspector.has_table(table):
+            continue
+        existing = _index_names(inspector, table)
+        for old, new in replaced.items():
+            if old in existing and new in existing:
+                with db.engine.begin() as conn:
+                    conn.execute(text(f'DROP INDEX {old}'))
+                dropped.append(old)
+    return dropped
+
+
+def _mark_requests_notified():
+    """Electors that predate access-request digests were already announced one email each; don't report them again."""
+    from models import db, Elector
+    from utils import get_ist_now
+
+    Elector.query.filter(Elector.notified_at.is_(None)).update({'notified_at': get_ist_now()}, synchronize_session=False)
+    db.session.commit()
+
+
+def _ensure_unique_votes(inspector):
+    """Adds the one-vote-per-elector unique index to legacy vote tables, unless duplicates already exist."""
+    from models import db, vote_uniqueness_enforced
+
+    if not inspector.has_table('vote') or vote_uniqueness_enforced():
+        return False
+
+    with db.engine.begin() as conn:
+        duplicates = conn.execute(text(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM vote GROUP BY election_id, elector_id HAVING COUNT(*) > 1)"
+        )).scalar()
+        if duplicates:
+            print(f"WARNING: {duplicates} electors have duplicate votes; resolve them at result release "
+                  "before uq_vote_election_elector can be created.")
+            return False
+        conn.execute(text("CREATE UNIQUE INDEX uq_vote_election_elector ON vote (election_id, elector_id)"))
+    return True
+
+
+def _ensure_unique_codes(inspector):
+    """Adds the unique (election_id, secret_code) index to legacy elector tables, unless codes are already shared."""
+    from models import db, code_uniqueness_enforced
+
+    if not inspector.has_table('elector') or code_uniqueness_enforced():
+        return False
+
+    with db.engine.begin() as conn:
+        duplicates = conn.execute(text(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM elector GROUP BY election_id, secret_code HAVING COUNT(*) > 1)"
+        )).scalar()
+        if duplicates:
+            print(f"WARNING: {duplicates} secret codes are shared by several electors of an election; regenerate "
+                  "those elections' codes before uq_elector_election_code can be created.")
+            return False
+        conn.execute(text("CREATE UNIQUE INDEX uq_elector_election_code ON elector (election_id, secret_code)"))
+    return True
+
+
+def _backfill_tallies():
+    """Builds the vote counters once for databases that predate the tally tables."""
+    from models import db, Vote, ElectionTally
+
+    if ElectionTally.query.first() is None and db.session.query(Vote.id).first() is not None:
+        from tally import reconcile
+        reconcile()
+        print("Vote tallies rebuilt from existing votes.")
+
+
+def _backfill_snapshots():
+    """Freezes result snapshots for elections released before snapshots existed, so no request has to."""
+    from models import db, Election, ResultSnapshot
+    from utils import get_ist_now
+    import snapshots
+
+    released = Election.query\
+        .filter(Election.show_results.is_(True), Election.end_time <= get_ist_now(),
+                ~db.session.query(ResultSnapshot.election_id)
+                .filter(ResultSnapshot.election_id == Election.id).exists())\
+        .all()
+    for election in released:
+        snapshots.freeze(election)
+    if released:
+        db.session.commit()
+        print(f"Result snapshots frozen for {len(released)} released elections.")
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        if not upgrade_schema():
+            print("Schema is up to date.")
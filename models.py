@@ -72,6 +72,11 @@ class Candidate(db.Model):
     status = db.Column(db.String(20), default='pending')
     votes = db.relationship('Vote', backref='candidate', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('ix_candidate_election_status', 'election_id', 'status'),
+        db.Index('ix_candidate_election_email', 'election_id', 'email'),
+    )
+
 class Elector(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     election_id = db.Column(db.Integer, db.ForeignKey('election.id'), nullable=False)
@@ -83,10 +88,18 @@ class Elector(db.Model):
     status = db.Column(db.String(20), default='approved')
     has_voted = db.Column(db.Boolean, default=False)
     custom_success_msg = db.Column(db.Text, nullable=True)
+    # When admins were told about this access request (NULL: not yet reported in a digest)
+    notified_at = db.Column(db.DateTime, nullable=True)
     
     __table_args__ = (
         db.UniqueConstraint('election_id', 'phone', name='uq_election_phone'),
         db.UniqueConstraint('election_id', 'email', name='uq_election_email'),
+        db.UniqueConstraint('election_id', 'secret_code', name='uq_elector_election_code'),
+        db.Index('ix_elector_election_status_voted', 'election_id', 'status', 'has_voted'),
+        db.Index('ix_elector_election_voted', 'election_id', 'has_voted'),
+        db.Index('ix_elector_status_notified', 'status', 'notified_at'),
+        # Email logins match case-insensitively (roll_index); this lets those lookups use an index.
+        db.Index('ix_elector_election_email_lower', 'election_id', db.text('lower(email)')),
     )
 
 class Vote(db.Model):
@@ -96,6 +109,13 @@ class Vote(db.Model):
     elector_id = db.Column(db.Integer, db.ForeignKey('elector.id'), nullable=True)
     timestamp = db.Column(db.DateTime, default=get_ist_now)
 
+    __table_args__ = (
+        db.UniqueConstraint('election_id', 'elector_id', name='uq_vote_election_elector'),
+        db.Index('ix_vote_election_candidate', 'election_id', 'candidate_id'),
+        db.Index('ix_vote_candidate', 'candidate_id'),
+        db.Index('ix_vote_elector', 'elector_id'),
+    )
+
 class RevoteLink(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     election_id = db.Column(db.Integer, db.ForeignKey('election.id'), nullable=False)
@@ -106,3 +126,123 @@ class RevoteLink(db.Model):
 
     election = db.relationship('Election', backref=db.backref('revote_links', lazy=True, cascade="all, delete-orphan"))
     elector = db.relationship('Elector', backref=db.backref('revote_links', lazy=True))
+
+    __table_args__ = (
+        db.Index('ix_revote_link_election_used', 'election_id', 'is_used'),
+        db.Index('ix_revote_link_elector', 'elector_id'),
+    )
+
+class CandidateTally(db.Model):
+    candidate_id = db.Column(db.Integer, db.ForeignKey('candidate.id'), primary_key=True)
+    election_id = db.Column(db.Integer, db.ForeignKey('election.id'), nullable=False, index=True)
+    votes = db.Column(db.Integer, nullable=False, default=0)
+
+    candidate = db.relationship('Candidate', backref=db.backref('tally', uselist=False, lazy=True, cascade="all, delete-orphan"))
+
+class ElectionTally(db.Model):
+    election_id = db.Column(db.Integer, db.ForeignKey('election.id'), primary_key=True)
+    votes_cast = db.Column(db.Integer, nullable=False, default=0)
+
+    election = db.relationship('Election', backref=db.backref('tally', uselist=False, lazy=True, cascade="all, delete-orphan"))
+
+class ResultSnapshot(db.Model):
+    election_id = db.Column(db.Integer, db.ForeignKey('election.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    etag = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=get_ist_now)
+
+    election = db.relationship('Election', backref=db.backref('result_snapshot', uselist=False, lazy=True, cascade="all, delete-orphan"))
+
+class ImportJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    election_id = db.Column(db.Integer, db.ForeignKey('election.id'), nullable=False, index=True)
+    filename = db.Column(db.String(200), nullable=True)
+    status = db.Column(db.String(20), default='queued')
+    rows_parsed = db.Column(db.Integer, default=0)
+    rows_inserted = db.Column(db.Integer, default=0)
+    skip_reasons = db.Column(db.Text, default='{}')
+    error = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    # importer.BOOT_ID of the process whose executor holds the job
+    owner = db.Column(db.String(32), nullable=True)
+    created_at = db.Column(db.DateTime, default=get_ist_now)
+    updated_at = db.Column(db.DateTime, default=get_ist_now)
+
+    election = db.relationship('Election', backref=db.backref('import_jobs', lazy=True, cascade="all, delete-orphan"))
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed', 'cancelled')
+
+    def to_dict(self):
+        import json
+        reasons = json.loads(self.skip_reasons or '{}')
+        return {
+            'id': self.id,
+            'election_id': self.election_id,
+            'filename': self.filename,
+            'status': self.status,
+            'rows_parsed': self.rows_parsed,
+            'rows_inserted': self.rows_inserted,
+            'rows_skipped': sum(reasons.values()),
+            'skip_reasons': reasons,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'finished': self.is_finished,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+class OutboxEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(200), unique=True, nullable=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(300), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    is_html = db.Column(db.Boolean, default=False)
+    status = db.Column(db.String(20), default='pending') # pending, sending, sent, dead
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=get_ist_now)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=get_ist_now)
+    sent_at = db.Column(db.DateTime, nullable=True)
+    # Set for multi-recipient sends: the message is then taken from the payload and body is left empty.
+    payload_id = db.Column(db.Integer, db.ForeignKey('outbox_payload.id'), nullable=True, index=True)
+    # 1 for OTPs and other time-critical mail, sent by the priority lane ahead of bulk mail
+    priority = db.Column(db.Integer, nullable=True, default=0)
+
+    payload = db.relationship('OutboxPayload', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        db.Index('ix_outbox_priority_status_next_attempt', 'priority', 'status', 'next_attempt_at'),
+        db.Index('ix_outbox_status_sent_at', 'status', 'sent_at'),
+    )
+
+class OutboxPayload(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    message = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=get_ist_now)
+
+def vote_uniqueness_enforced():
+    """Returns True if the database enforces one vote per elector (legacy databases may lack the constraint)."""
+    from sqlalchemy import inspect
+    inspector = inspect(db.engine)
+    names = {c['name'] for c in inspector.get_unique_constraints('vote')}
+    names |= {i['name'] for i in inspector.get_indexes('vote') if i.get('unique')}
+    return 'uq_vote_election_elector' in names
+
+
+def code_uniqueness_enforced():
+    """Returns True if the database enforces unique secret codes per election (legacy databases may lack it)."""
+    import warnings
+    from sqlalchemy import inspect
+    from sqlalchemy.exc import SAWarning
+    inspector = inspect(db.engine)
+    with warnings.catch_warnings():
+        # SQLite reflection skips the lower(email) expression index with a warning; it isn't unique anyway.
+        warnings.simplefilter('ignore', SAWarning)
+        names = {c['name'] for c in inspector.get_unique_constraints('elector')}
+        names |= {i['name'] for i in inspector.get_indexes('elector') if i.get('unique')}
+    return 'uq_elector_election_code' in names
@@ -0,0 +1,211 @@
+"""Server-side OTP storage.
+
+OTPs used to live in the signed session cookie, one key per purpose (and one
+per email address tried at voter login), which grew the cookie and tied
+verification to the browser/worker that issued the code. They are now kept
+server-side, keyed by an identity string:
+
+- admin flows: "session:<sid>:<purpose>", where <sid> is a random id stored
+  in the session (utils.store_otp_in_session / verify_otp_in_session);
+- voter email login: "elector:<election_id>:<email>".
+
+Only a hash of the code is stored. Every wrong guess increments a
+per-identity counter; after OTP_MAX_ATTEMPTS the code is discarded.
+
+Backends (OTP_STORE): 'memory' is a bounded, TTL-evicting dict for a single
+process; 'sqlite' is a small SQLite file (OTP_STORE_PATH) shared by all
+workers on the host.
+"""
+import hashlib
+import hmac
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 600
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def _hash(identity, code):
+    return hashlib.sha256(f"{identity}:{code}".encode()).hexdigest()
+
+
+class MemoryOTPStore:
+    """Per-process store. Entries expire after their TTL and the oldest are dropped beyond max_entries."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Entries are kept in insertion order, so expired ones collect at the front.
+        while self._data:
+            key, record = next(iter(self._data.items()))
+            if record['expires_at'] > now and len(self._data) <= self.max_entries:
+                break
+            self._data.popitem(last=False)
+
+    def put(self, key, record):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = dict(record)
+            self._evict(time.time())
+
+    def get(self, key):
+        with self._lock:
+            record = self._data.get(key)
+            if record is None or record['expires_at'] <= time.time():
+                return None
+            return dict(record)
+
+    def add_attempt(self, key):
+        with self._lock:
+            record = self._data.get(key)
+            if record is None:
+                return 0
+            record['attempts'] += 1
+            return record['attempts']
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteOTPStore:
+    """Store shared by every worker process on the host through one SQLite file."""
+
+    SWEEP_EVERY = 200
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._puts = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS otp (key TEXT PRIMARY KEY, code_hash TEXT NOT NULL, "
+            "issued_at REAL NOT NULL, expires_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_otp_expires_at ON otp (expires_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, key, record):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO otp (key, code_hash, issued_at, expires_at, attempts) VALUES (?, ?, ?, ?, ?)",
+            (key, record['code_hash'], record['issued_at'], record['expires_at'], record['attempts'])
+        )
+        self._puts += 1
+        if self._puts % self.SWEEP_EVERY == 0:
+            conn.execute("DELETE FROM otp WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT code_hash, issued_at, expires_at, attempts FROM otp WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return {'code_hash': row[0], 'issued_at': row[1], 'expires_at': row[2], 'attempts': row[3]}
+
+    def add_attempt(self, key):
+        conn = self._conn()
+        conn.execute("UPDATE otp SET attempts = attempts + 1 WHERE key = ?", (key,))
+        row = conn.execute("SELECT attempts FROM otp WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM otp WHERE key = ?", (key,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _settings():
+    try:
+        from flask import current_app
+        config = current_app.config
+    except RuntimeError:
+        config = {}
+    return {
+        'backend': config.get('OTP_STORE', 'memory'),
+        'path': config.get('OTP_STORE_PATH', 'otp_store.db'),
+        'max_entries': config.get('OTP_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+        'max_attempts': config.get('OTP_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+        'ttl': config.get('OTP_TTL_SECONDS', DEFAULT_TTL),
+    }
+
+
+def get_store(settings=None):
+    settings = settings or _settings()
+    key = (settings['backend'], settings['path'] if settings['backend'] == 'sqlite' else None)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            if settings['backend'] == 'sqlite':
+                store = SQLiteOTPStore(settings['path'])
+            else:
+                store = MemoryOTPStore(settings['max_entries'])
+            _stores[key] = store
+        return store
+
+
+def issue(identity, code, issued_at=None):
+    """Stores code for identity, replacing any earlier code and resetting its attempt counter."""
+    settings = _settings()
+    issued_at = issued_at if issued_at is not None else time.time()
+    get_store(settings).put(identity, {
+        'code_hash': _hash(identity, str(code).strip()),
+        'issued_at': issued_at,
+        'expires_at': issued_at + settings['ttl'],
+        'attempts': 0,
+    })
+
+
+def is_pending(identity):
+    return get_store().get(identity) is not None
+
+
+def discard(identity):
+    get_store().delete(identity)
+
+
+def verify(identity, code, max_age=DEFAULT_TTL):
+    """Checks code for identity. Returns (bool, message); a correct code is consumed."""
+    settings = _settings()
+    store = get_store(settings)
+    record = store.get(identity)
+    if record is None:
+        return False, "OTP not found or expired."
+
+    if time.time() - record['issued_at'] > max_age:
+        store.delete(identity)
+        return False, "OTP has expired."
+
+    if record['attempts'] >= settings['max_attempts']:
+        store.delete(identity)
+        return False, "Too many incorrect attempts. Please request a new OTP."
+
+    if code is not None and hmac.compare_digest(record['code_hash'], _hash(identity, str(code).strip())):
+        store.delete(identity)
+        return True, "Success"
+
+    attempts = store.add_attempt(identity)
+    if attempts >= settings['max_attempts']:
+        store.delete(identity)
+        return False, "Too many incorrect attempts. Please request a new OTP."
+    return False, "Invalid OTP."
+
+
+def elector_identity(election_id, email):
+    return f"elector:{election_id}:{email.strip().lower()}"
@@ -0,0 +1,426 @@
+"""Durable email outbox.
+
+send_email_async() writes an OutboxEmail row instead of handing the message
+to a thread pool, so queued mail survives restarts and deploys. A dispatcher
+thread per process claims due rows with a compare-and-set UPDATE (so several
+workers can drain the same table without double-sending) and delivers them
+through utils.email_executor. How many rows are claimed, and how many
+batches run at once, is decided by email_limiter (per-minute/per-day
+budgets and adaptive concurrency), never more batches than
+utils.email_workers threads. Claimed rows go out in Gmail batch HTTP
+requests of up to GMAIL_BATCH_SIZE messages, each message keeping its own
+success/failure.
+
+enqueue_shared() sends one message to many recipients: it is MIME-encoded
+once into an OutboxPayload (attachments included) and each recipient's row
+only references it, so a large report to every admin is neither rebuilt
+nor stored once per recipient.
+
+OTPs and other time-critical mail are queued with PRIORITY_HIGH and drained
+by a second dispatcher (priority_dispatcher) that sends from its own thread
+instead of the shared executor. The normal lane leaves
+OUTBOX_PRIORITY_RESERVE sends per minute and OUTBOX_PRIORITY_DAILY_SHARE of
+the daily quota (if one is configured) unused, so a large bulk backlog can neither delay an OTP nor
+use up the day's sends before it. Both budgets are counted from this table,
+so they are shared by every worker.
+
+Failed sends are retried with exponential backoff; after OUTBOX_MAX_ATTEMPTS
+the row is dead-lettered ('dead'). Rows stuck in 'sending' longer than
+OUTBOX_LEASE_SECONDS (worker killed mid-send) are put back in the queue.
+
+Rows are queued in the caller's transaction; nothing here commits on the
+caller's behalf, and neither do the utils.send_* helpers. Once a row is
+sent or dead its body is cleared and payloads no row references any more
+are deleted, so OTPs, generated passwords and roll exports do not outlive
+delivery; finished rows themselves (recipient, subject, status, error) are
+deleted after OUTBOX_RETENTION_DAYS by an hourly sweep.
+"""
+import os
+import threading
+import time
+from datetime import timedelta
+from sqlalchemy import and_, delete, event, exists, func, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import db, OutboxEmail, OutboxPayload
+from email_limiter import limiter, is_throttle_error
+from utils import get_ist_now, GMAIL_BATCH_LIMIT
+
+
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 1
+SWEEP_INTERVAL = 3600
+
+
+def _wake_after_commit(priority):
+    """Wakes the lane's dispatcher once the caller commits the queued rows."""
+    db.session.info.setdefault('outbox_wake', set()).add(priority > PRIORITY_NORMAL)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_dispatchers(session):
+    for is_priority in session.info.pop('outbox_wake', ()):
+        (priority_dispatcher if is_priority else dispatcher).wake()
+
+
+def enqueue(to_email, subject, body, is_html=False, key=None, payload=None, priority=PRIORITY_NORMAL):
+    """Adds an email to the outbox in the current transaction. Returns the OutboxEmail row.
+
+    Nothing is committed: the row is sent once the caller commits (and is dropped if it rolls back).
+    priority=PRIORITY_HIGH (OTPs) sends the email through the priority lane, ahead of any bulk backlog.
+
+    If key is given and a message with the same idempotency key was already queued,
+    that row is returned and nothing new is sent.
+    """
+    if key:
+        existing = OutboxEmail.query.filter_by(idempotency_key=key).first()
+        if existing:
+            return existing
+
+    row = OutboxEmail(idempotency_key=key, to_email=to_email, subject=subject, body=body, is_html=is_html,
+                      payload=payload, priority=priority)
+    try:
+        with db.session.begin_nested():
+            db.session.add(row)
+    except IntegrityError:
+        # Same key queued concurrently by another request.
+        return OutboxEmail.query.filter_by(idempotency_key=key).first()
+    _wake_after_commit(priority)
+    return row
+
+
+def enqueue_many(messages):
+    """Adds several emails to the outbox in the current transaction (the caller commits).
+
+    Returns the rows (existing rows for already-used keys).
+    """
+    keys = [m['key'] for m in messages if m.get('key')]
+    existing = {}
+    for i in range(0, len(keys), 500):
+        for row in OutboxEmail.query.filter(OutboxEmail.idempotency_key.in_(keys[i:i + 500])):
+            existing[row.idempotency_key] = row
+
+    rows = []
+    try:
+        with db.session.begin_nested():
+            for m in messages:
+                key = m.get('key')
+                if key and key in existing:
+                    rows.append(existing[key])
+                    continue
+                row = OutboxEmail(idempotency_key=key, to_email=m['to_email'], subject=m['subject'],
+                                  body=m['body'], is_html=bool(m.get('is_html')), payload=m.get('payload'))
+                db.session.add(row)
+                if key:
+                    existing[key] = row
+                rows.append(row)
+    except IntegrityError:
+        # A key was queued concurrently; fall back to one-by-one so the rest still go out.
+        return [enqueue(m['to_email'], m['subject'], m['body'], is_html=bool(m.get('is_html')), key=m.get('key'),
+                        payload=m.get('payload'))
+                for m in messages]
+    _wake_after_commit(PRIORITY_NORMAL)
+    return rows
+
+
+def enqueue_shared(recipients, subject, body, is_html, attachments=(), key=None):
+    """Queues one message to many recipients in the current transaction (the caller commits). Returns the rows.
+
+    The message is MIME-encoded once, here, and stored in a single OutboxPayload that every recipient's
+    row points at. attachments: [(filename, content_type, bytes)]. key, if given, is suffixed with each
+    recipient's address.
+    """
+    import utils
+    payload = OutboxPayload(message=utils.encode_message(subject, body, is_html, attachments))
+    return enqueue_many([{'to_email': to_email, 'subject': subject, 'body': '', 'is_html': is_html,
+                          'payload': payload, 'key': f"{key}:{to_email}" if key else None}
+                         for to_email in recipients])
+
+
+def redact(rows):
+    """Drops the content of finished (sent/dead) rows: OTPs, generated passwords and reports must not
+    outlive delivery. Payloads no longer referenced by any row are deleted. The caller commits."""
+    payload_ids = {row.payload_id for row in rows if row.payload_id}
+    for row in rows:
+        row.body = ''
+        row.payload_id = None
+    db.session.flush()
+    drop_orphan_payloads(payload_ids)
+
+
+def drop_orphan_payloads(payload_ids=None):
+    """Deletes payloads (all, or the given ones) that no outbox row references any more. Returns how many."""
+    query = OutboxPayload.query.filter(~exists().where(OutboxEmail.payload_id == OutboxPayload.id))
+    if payload_ids is not None:
+        if not payload_ids:
+            return 0
+        query = query.filter(OutboxPayload.id.in_(payload_ids))
+    return query.delete(synchronize_session=False)
+
+
+def sweep(retention_days, now=None):
+    """Redacts any finished row still holding content and deletes finished rows older than retention_days.
+
+    Sent rows younger than a day are always kept: they are the daily send budget. Returns the number deleted.
+    """
+    now = now or get_ist_now()
+    finished = OutboxEmail.status.in_(('sent', 'dead'))
+    db.session.execute(
+        update(OutboxEmail)
+        .where(finished, or_(OutboxEmail.body != '', OutboxEmail.payload_id.isnot(None)))
+        .values(body='', payload_id=None)
+    )
+    cutoff = now - timedelta(days=max(retention_days, 1))
+    deleted = db.session.execute(
+        delete(OutboxEmail)
+        .where(finished, func.coalesce(OutboxEmail.sent_at, OutboxEmail.created_at) < cutoff)
+    ).rowcount
+    drop_orphan_payloads()
+    db.session.commit()
+    if deleted:
+        print(f"Outbox: deleted {deleted} finished emails older than {retention_days} days")
+    return deleted
+
+
+def payload_messages(payload_ids):
+    """Returns {payload_id: encoded message} for the given payloads, in one query."""
+    if not payload_ids:
+        return {}
+    return dict(db.session.query(OutboxPayload.id, OutboxPayload.message)
+                .filter(OutboxPayload.id.in_(payload_ids)))
+
+
+def backoff_delay(attempts, base, cap):
+    """Seconds to wait before the next try after `attempts` failed sends."""
+    return min(cap, base * 2 ** max(attempts - 1, 0))
+
+
+class OutboxDispatcher:
+    """Drains one lane of the outbox: normal mail, or (priority=True) OTPs and other time-critical mail."""
+
+    def __init__(self, priority=False):
+        self.priority = priority
+        self.reserve = 0
+        self.daily_share = 0.0
+        self.app = None
+        self.poll_seconds = 5
+        self.max_attempts = 6
+        self.backoff_seconds = 30
+        self.max_backoff_seconds = 3600
+        self.lease_seconds = 300
+        self.batch_size = 50
+        self.retention_days = 7
+        self._last_sweep = 0.0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.poll_seconds = app.config.get('OUTBOX_POLL_SECONDS', self.poll_seconds)
+        self.max_attempts = app.config.get('OUTBOX_MAX_ATTEMPTS', self.max_attempts)
+        self.backoff_seconds = app.config.get('OUTBOX_BACKOFF_SECONDS', self.backoff_seconds)
+        self.max_backoff_seconds = app.config.get('OUTBOX_MAX_BACKOFF_SECONDS', self.max_backoff_seconds)
+        self.lease_seconds = app.config.get('OUTBOX_LEASE_SECONDS', self.lease_seconds)
+        self.batch_size = min(app.config.get('GMAIL_BATCH_SIZE', self.batch_size), GMAIL_BATCH_LIMIT)
+        self.retention_days = app.config.get('OUTBOX_RETENTION_DAYS', self.retention_days)
+        if not self.priority:
+            self.reserve = app.config.get('OUTBOX_PRIORITY_RESERVE', self.reserve)
+            self.daily_share = app.config.get('OUTBOX_PRIORITY_DAILY_SHARE', self.daily_share)
+        if app.config.get('OUTBOX_AUTOSTART', True) and not app.testing:
+            self.start()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        name = 'outbox-priority' if self.priority else 'outbox-dispatcher'
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            claimed = 0
+            with self.app.app_context():
+                try:
+                    claimed = self.dispatch_once()
+                    # The normal lane also runs the retention sweep, at most once per SWEEP_INTERVAL.
+                    if not self.priority and time.monotonic() - self._last_sweep > SWEEP_INTERVAL:
+                        self._last_sweep = time.monotonic()
+                        sweep(self.retention_days)
+                except Exception as e:
+                    print(f"Outbox dispatcher error: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if not claimed:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def dispatch_once(self):
+        """Claims due messages of this lane, sends them in Gmail batches and waits. Returns the number claimed.
+
+        The normal lane runs its batches on the email executor and leaves `reserve` sends per minute and
+        `daily_share` of the daily quota unused; the priority lane sends from its own thread, so it never queues behind bulk batches.
+        """
+        import utils
+
+        now = get_ist_now()
+        self.reclaim_stale(now)
+
+        executor = utils.email_executor
+        sent_today, sent_last_minute = sent_in_last_day(now), sent_in_last_minute(now)
+        if self.priority:
+            allowed = limiter.acquire(self.batch_size, sent_today, sent_last_minute)
+            lane = OutboxEmail.priority > PRIORITY_NORMAL
+        else:
+            # Never run more batches at once than the executor has threads, whatever the limiter allows.
+            concurrency = min(limiter.concurrency, max(utils.email_workers, 1))
+            daily_reserve = int(limiter.per_day * self.daily_share) if limiter.per_day else 0
+            allowed = limiter.acquire(concurrency * self.batch_size, sent_today, sent_last_minute,
+                                      reserve=self.reserve, daily_reserve=daily_reserve)
+            lane = or_(OutboxEmail.priority == PRIORITY_NORMAL, OutboxEmail.priority.is_(None))
+        if not allowed:
+            return 0
+        due_ids = [row_id for (row_id,) in db.session.query(OutboxEmail.id)
+                   .filter(lane, OutboxEmail.status == 'pending', OutboxEmail.next_attempt_at <= now)
+                   .order_by(OutboxEmail.next_attempt_at, OutboxEmail.id)
+                   .limit(allowed)]
+
+        claimed = []
+        for row_id in due_ids:
+            won = db.session.execute(
+                update(OutboxEmail)
+                .where(OutboxEmail.id == row_id, OutboxEmail.status == 'pending')
+                .values(status='sending', locked_at=now, attempts=OutboxEmail.attempts + 1)
+            ).rowcount
+            if won:
+                claimed.append(row_id)
+        db.session.commit()
+
+        if claimed:
+            token_path = os.path.join(self.app.root_path, 'token.json')
+            batches = [claimed[i:i + self.batch_size] for i in range(0, len(claimed), self.batch_size)]
+            if self.priority:
+                for batch in batches:
+                    self._deliver(batch, token_path)
+            else:
+                futures = [executor.submit(self._deliver, batch, token_path) for batch in batches]
+                for future in futures:
+                    future.result()
+        return len(claimed)
+
+    def reclaim_stale(self, now=None):
+        now = now or get_ist_now()
+        cutoff = now - timedelta(seconds=self.lease_seconds)
+        reclaimed = db.session.execute(
+            update(OutboxEmail)
+            .where(OutboxEmail.status == 'sending', OutboxEmail.locked_at < cutoff)
+            .values(status='pending', locked_at=None)
+        ).rowcount
+        db.session.commit()
+        if reclaimed:
+            print(f"Outbox: re-queued {reclaimed} emails left in 'sending'")
+        return reclaimed
+
+    def _deliver(self, row_ids, token_path):
+        """Sends the claimed rows (one Gmail batch request when there are several) and records each outcome."""
+        import utils
+
+        with self.app.app_context():
+            try:
+                rows = OutboxEmail.query.filter(OutboxEmail.id.in_(row_ids)).all()
+                started = time.monotonic()
+                try:
+                    # Rows of a shared send reuse the payload's encoding; only the To header differs.
+                    shared = payload_messages({row.payload_id for row in rows if row.payload_id})
+                    messages = [(row.id, row.to_email, shared[row.payload_id] if row.payload_id
+                                 else utils.encode_message(row.subject, row.body, row.is_html))
+                                for row in rows]
+                    if len(messages) == 1:
+                        ref, to_email, encoded = messages[0]
+                        utils.deliver_email(to_email, encoded, token_path)
+                        errors = {ref: None}
+                    else:
+                        errors = utils.deliver_email_batch(messages, token_path)
+                except Exception as e:
+                    errors = {row.id: e for row in rows}
+                limiter.record(time.monotonic() - started, messages=len(rows),
+                               throttled=any(e is not None and is_throttle_error(e) for e in errors.values()))
+
+                failed = 0
+                for row in rows:
+                    error = errors.get(row.id)
+                    if error is None:
+                        row.status = 'sent'
+                        row.sent_at = get_ist_now()
+                        row.locked_at = None
+                        row.last_error = None
+                    else:
+                        failed += 1
+                        self._record_failure(row, error)
+                redact([row for row in rows if row.status in ('sent', 'dead')])
+                db.session.commit()
+                print(f"Outbox: sent {len(rows) - failed}/{len(rows)} emails")
+            finally:
+                db.session.remove()
+
+    def _record_failure(self, row, error):
+        row.last_error = str(error)
+        row.locked_at = None
+        if is_throttle_error(error):
+            # Being throttled is not the message's fault; don't spend its retry budget on it.
+            row.attempts = max(row.attempts - 1, 0)
+        if row.attempts >= self.max_attempts:
+            row.status = 'dead'
+            print(f"ERROR: Giving up on email to {row.to_email} after {row.attempts} attempts: {error}")
+        else:
+            delay = backoff_delay(row.attempts, self.backoff_seconds, self.max_backoff_seconds)
+            row.status = 'pending'
+            row.next_attempt_at = get_ist_now() + timedelta(seconds=delay)
+            print(f"ERROR: Failed sending email to {row.to_email} (attempt {row.attempts}, retry in {delay}s): {error}")
+
+
+dispatcher = OutboxDispatcher()
+priority_dispatcher = OutboxDispatcher(priority=True)
+
+
+def sent_in_last_day(now=None):
+    now = now or get_ist_now()
+    return db.session.query(func.count(OutboxEmail.id))\
+        .filter(OutboxEmail.status == 'sent', OutboxEmail.sent_at >= now - timedelta(days=1)).scalar()
+
+
+def sent_in_last_minute(now=None):
+    """Rows sent in the last 60 seconds plus rows being sent right now, by any worker."""
+    now = now or get_ist_now()
+    return db.session.query(func.count(OutboxEmail.id))\
+        .filter(or_(OutboxEmail.status == 'sending',
+                    and_(OutboxEmail.status == 'sent', OutboxEmail.sent_at >= now - timedelta(minutes=1)))).scalar()
+
+
+def outbox_stats():
+    """Returns backlog and throughput figures for the admin console."""
+    now = get_ist_now()
+    counts = dict(db.session.query(OutboxEmail.status, func.count(OutboxEmail.id))
+                  .group_by(OutboxEmail.status).all())
+    oldest_pending = db.session.query(func.min(OutboxEmail.created_at))\
+        .filter(OutboxEmail.status.in_(('pending', 'sending'))).scalar()
+    sent_last_hour = db.session.query(func.count(OutboxEmail.id))\
+        .filter(OutboxEmail.status == 'sent', OutboxEmail.sent_at >= now - timedelta(hours=1)).scalar()
+    return {
+        'pending': counts.get('pending', 0),
+        'sending': counts.get('sending', 0),
+        'sent': counts.get('sent', 0),
+        'dead': counts.get('dead', 0),
+        'sent_last_hour': sent_last_hour,
+        'oldest_pending_minutes': int((now - oldest_pending).total_seconds() // 60) if oldest_pending else None,
+        'limiter': limiter.snapshot(sent_in_last_day(now), sent_in_last_minute(now)),
+    }
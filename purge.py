@@ -0,0 +1,58 @@
+"""Set-based deletion of electors and elections.
+
+Electors are removed with a few DELETE ... WHERE ... IN statements (votes via
+tally.delete_votes so the counters stay right, then revote links, then the
+electors) instead of loading each row and deleting it through the ORM.
+Explicit id lists are processed in chunks of DELETE_CHUNK to stay under the
+database's bound-parameter limit; status-based purges use a subquery and
+touch no Python objects at all.
+
+None of these commit; callers commit and then update the roll index.
+"""
+from sqlalchemy import delete, select
+from models import db, Election, Candidate, Elector, Vote, RevoteLink, CandidateTally, ElectionTally, ImportJob, ResultSnapshot
+
+DELETE_CHUNK = 500
+
+
+def _delete_scope(election_id, id_filter, vote_scope):
+    from tally import delete_votes
+    delete_votes(election_id, vote_scope)
+    db.session.execute(delete(RevoteLink).where(RevoteLink.election_id == election_id, id_filter(RevoteLink.elector_id)),
+                       execution_options={'synchronize_session': False})
+    return db.session.execute(delete(Elector).where(Elector.election_id == election_id, id_filter(Elector.id)),
+                              execution_options={'synchronize_session': False}).rowcount
+
+
+def delete_electors(election_id, elector_ids):
+    """Deletes the given electors of one election with their votes and revote links. Returns the number deleted."""
+    ids = sorted({int(i) for i in elector_ids})
+    deleted = 0
+    for start in range(0, len(ids), DELETE_CHUNK):
+        chunk = ids[start:start + DELETE_CHUNK]
+        deleted += _delete_scope(election_id, lambda column: column.in_(chunk), chunk)
+    return deleted
+
+
+def delete_electors_matching(election_id, *criteria):
+    """Deletes every elector of the election matching criteria (e.g. Elector.status == 'rejected'). Returns the count."""
+    ids = select(Elector.id).where(Elector.election_id == election_id, *criteria)
+    return _delete_scope(election_id, lambda column: column.in_(ids), ids)
+
+
+def purge_election(election_id):
+    """Deletes an election and everything that belongs to it, child tables first."""
+    candidate_ids = select(Candidate.id).where(Candidate.election_id == election_id)
+    statements = [
+        delete(Vote).where(Vote.election_id == election_id),
+        delete(CandidateTally).where(CandidateTally.candidate_id.in_(candidate_ids)),
+        delete(ElectionTally).where(ElectionTally.election_id == election_id),
+        delete(RevoteLink).where(RevoteLink.election_id == election_id),
+        delete(Elector).where(Elector.election_id == election_id),
+        delete(Candidate).where(Candidate.election_id == election_id),
+        delete(ImportJob).where(ImportJob.election_id == election_id),
+        delete(ResultSnapshot).where(ResultSnapshot.election_id == election_id),
+        delete(Election).where(Election.id == election_id),
+    ]
+    for statement in statements:
+        db.session.execute(statement, execution_options={'synchronize_session': False})
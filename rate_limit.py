@@ -0,0 +1,182 @@
+"""Sliding-window rate limiting for public endpoints.
+
+Each rule allows `limit` requests per `window` seconds for a key (client IP,
+email address, ...). Counts are kept per fixed window and the previous
+window's count is weighted by how much of it still overlaps the sliding
+window, which gives a smooth limit with two counters per key.
+
+Rules are configured in RATE_LIMITS ({name: (limit, window_seconds)}).
+RATE_LIMIT_STORE picks the backend: 'memory' (per process) or 'sqlite'
+(RATE_LIMIT_STORE_PATH, shared by all workers on the host). Blocked requests
+get a 429 with a Retry-After header and are not counted.
+"""
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, make_response, request
+
+DEFAULT_RULES = {
+    'otp_per_email': (3, 600),
+    'otp_per_ip': (20, 600),
+    'check_phone_per_ip': (30, 60),
+    'secret_login_per_ip': (10, 300),
+    'secret_login_per_identifier': (10, 900),
+}
+
+
+class MemoryWindowStore:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, key, window_start, window):
+        entry = self._data.get(key)
+        if entry is None:
+            return [window_start, 0, 0]
+        start, current, previous = entry
+        if start == window_start:
+            return entry
+        if start == window_start - window:
+            return [window_start, 0, current]
+        return [window_start, 0, 0]
+
+    def counts(self, key, window_start, window):
+        """Returns (previous window count, current window count)."""
+        with self._lock:
+            _, current, previous = self._entry(key, window_start, window)
+            return previous, current
+
+    def incr(self, key, window_start, window):
+        with self._lock:
+            entry = self._entry(key, window_start, window)
+            entry[1] += 1
+            self._data.pop(key, None)
+            self._data[key] = entry
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+
+
+class SQLiteWindowStore:
+    SWEEP_EVERY = 500
+    MAX_WINDOW = 86400
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS rate_window (key TEXT NOT NULL, window_start INTEGER NOT NULL, "
+            "count INTEGER NOT NULL, PRIMARY KEY (key, window_start))"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def counts(self, key, window_start, window):
+        rows = dict(self._conn().execute(
+            "SELECT window_start, count FROM rate_window WHERE key = ? AND window_start IN (?, ?)",
+            (key, window_start, window_start - window)
+        ).fetchall())
+        return rows.get(window_start - window, 0), rows.get(window_start, 0)
+
+    def incr(self, key, window_start, window):
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO rate_window (key, window_start, count) VALUES (?, ?, 1) "
+            "ON CONFLICT (key, window_start) DO UPDATE SET count = count + 1",
+            (key, window_start)
+        )
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            conn.execute("DELETE FROM rate_window WHERE window_start < ?", (int(time.time()) - 2 * self.MAX_WINDOW,))
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store():
+    backend = current_app.config.get('RATE_LIMIT_STORE', 'memory')
+    path = current_app.config.get('RATE_LIMIT_STORE_PATH', 'rate_limit.db')
+    key = (backend, path if backend == 'sqlite' else None)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = SQLiteWindowStore(path) if backend == 'sqlite' else MemoryWindowStore()
+            _stores[key] = store
+        return store
+
+
+def _rule(name):
+    rules = current_app.config.get('RATE_LIMITS') or {}
+    return rules.get(name, DEFAULT_RULES[name])
+
+
+def check(name, key, now=None):
+    """Returns (allowed, retry_after_seconds) for one more request under rule `name` without counting it."""
+    limit, window = _rule(name)
+    now = now if now is not None else time.time()
+    window_start = int(now // window * window)
+    elapsed = now - window_start
+    previous, current = get_store().counts(f"{name}:{key}", window_start, window)
+
+    weight = (window - elapsed) / window
+    if previous * weight + current + 1 <= limit:
+        return True, 0
+    if current + 1 > limit or not previous:
+        return False, max(1, math.ceil(window - elapsed))
+    # Wait until enough of the previous window has slid out.
+    wait = window - elapsed - (limit - current - 1) * window / previous
+    return False, max(1, math.ceil(wait))
+
+
+def hit(name, key, now=None):
+    limit, window = _rule(name)
+    now = now if now is not None else time.time()
+    get_store().incr(f"{name}:{key}", int(now // window * window), window)
+
+
+def client_ip():
+    """The client's address. Behind TRUSTED_PROXY_HOPS proxies, ProxyFix has already replaced remote_addr
+    with the forwarded address, so every client is not keyed as the proxy."""
+    return request.remote_addr or 'unknown'
+
+
+def _too_many_json(retry_after, **view_args):
+    return {'success': False, 'message': f'Too many requests. Please try again in {retry_after} seconds.'}
+
+
+def rate_limited(*rules, methods=('POST',), on_limited=_too_many_json):
+    """Applies rules [(rule_name, key_func(**view_args))] to a view; a key_func returning None skips that rule.
+
+    on_limited(retry_after, **view_args) builds the 429 body (JSON message by default).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method not in methods or not current_app.config.get('RATE_LIMIT_ENABLED', True):
+                return view(*args, **kwargs)
+
+            now = time.time()
+            keyed = [(name, key) for name, key in ((name, key_func(**kwargs)) for name, key_func in rules) if key]
+            blocked = [retry for allowed, retry in (check(name, key, now) for name, key in keyed) if not allowed]
+            if blocked:
+                retry_after = max(blocked)
+                response = make_response(on_limited(retry_after, **kwargs), 429)
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+
+            for name, key in keyed:
+                hit(name, key, now)
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
@@ -0,0 +1,157 @@
+"""Live turnout updates for admin consoles over Socket.IO.
+
+Admins watching manage_election join one room per election. Routes call
+feed.publish(election_id, voted=1, ...) after committing; deltas are summed
+per election and flushed at most once every REALTIME_PUSH_INTERVAL seconds,
+so a burst of votes becomes a single 'turnout' broadcast per room however
+many consoles are watching. A newly joined console gets a full snapshot from
+stats.election_stats() and applies deltas on top of it; bulk operations call
+resync() to have the next flush send a fresh snapshot instead.
+
+Only admins who may manage elections or electors can join a room, and only
+for an election that exists; malformed watch requests are ignored.
+
+The feed is off unless REALTIME_ENABLED is set, because it needs a server
+that holds WebSocket connections open (see config.py). With several workers,
+set SOCKETIO_MESSAGE_QUEUE (e.g. redis://) so a broadcast from any worker
+reaches clients connected to the others. Without Flask-SocketIO installed,
+or with REALTIME_ENABLED off, publish() is a no-op and the page simply shows
+the figures from its last load.
+"""
+import threading
+from collections import Counter, defaultdict
+
+DEFAULT_INTERVAL = 2.0
+
+
+def room_for(election_id):
+    return f"election:{election_id}"
+
+
+def may_watch(user):
+    """True if the user may see live turnout: a logged-in admin who has finished the forced password change
+    and may manage elections or electors."""
+    return bool(user.is_authenticated and not user.is_force_change_password
+                and (user.can_manage_elections or user.can_manage_electors))
+
+
+def watched_election(user, data):
+    """Returns the id of the existing election a watch_election payload asks for, or None if the payload is
+    malformed, the election does not exist or the user may not watch it."""
+    from models import db, Election
+
+    if not may_watch(user) or not isinstance(data, dict):
+        return None
+    try:
+        election_id = int(data.get('election_id'))
+    except (TypeError, ValueError):
+        return None
+    if election_id <= 0 or db.session.get(Election, election_id) is None:
+        return None
+    return election_id
+
+
+class TurnoutFeed:
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.socketio = None
+        self.app = None
+        self._pending = defaultdict(Counter)
+        self._resync = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.socketio is not None
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('REALTIME_PUSH_INTERVAL', self.interval)
+        if not app.config.get('REALTIME_ENABLED', False):
+            return
+        try:
+            from flask_socketio import SocketIO
+        except ImportError:
+            print("WARNING: Flask-SocketIO is not installed; live turnout updates are disabled.")
+            return
+
+        self.socketio = SocketIO(app, message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+                                 async_mode=app.config.get('SOCKETIO_ASYNC_MODE'))
+        self._register_handlers(app)
+        if not app.testing:
+            self.socketio.start_background_task(self._run)
+
+    def _register_handlers(self, app):
+        from flask_login import current_user
+        from flask_socketio import emit, join_room, leave_room
+
+        @self.socketio.on('connect')
+        def connect(auth=None):
+            # The Flask-Login session cookie comes with the handshake.
+            return may_watch(current_user)
+
+        @self.socketio.on('watch_election')
+        def watch_election(data):
+            from stats import election_stats
+            election_id = watched_election(current_user, data)
+            if election_id is None:
+                return
+            stats = election_stats([election_id]).get(election_id)
+            if stats is None:
+                return
+            join_room(room_for(election_id))
+            emit('turnout_snapshot', dict(stats, election_id=election_id))
+
+        @self.socketio.on('unwatch_election')
+        def unwatch_election(data):
+            try:
+                leave_room(room_for(int(data['election_id'])))
+            except (KeyError, TypeError, ValueError):
+                pass
+
+    def publish(self, election_id, **deltas):
+        """Queues counter changes (voted=1, pending_requests=-1, ...) for the next broadcast."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._pending[election_id].update(deltas)
+
+    def resync(self, election_id):
+        """Makes the next broadcast a full snapshot, for bulk changes that are not worth expressing as deltas."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._resync.add(election_id)
+
+    def flush(self):
+        """Sends one 'turnout' event per election with changes since the last flush. Returns the number sent."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+            resync, self._resync = self._resync, set()
+        sent = 0
+        if resync:
+            from stats import election_stats
+            for election_id, stats in election_stats(sorted(resync)).items():
+                self.socketio.emit('turnout_snapshot', dict(stats, election_id=election_id), to=room_for(election_id))
+                sent += 1
+        for election_id, deltas in pending.items():
+            if election_id in resync:
+                continue
+            deltas = {key: value for key, value in deltas.items() if value}
+            if not deltas:
+                continue
+            self.socketio.emit('turnout', {'election_id': election_id, 'deltas': deltas}, to=room_for(election_id))
+            sent += 1
+        return sent
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception as e:
+                print(f"Realtime flush error: {e}")
+
+
+feed = TurnoutFeed()
@@ -0,0 +1,17 @@
+from app import create_app
+from tally import reconcile
+
+app = create_app()
+
+with app.app_context():
+    print("Rebuilding vote tallies from the vote table...")
+    drift = reconcile()
+
+    if not drift:
+        print("No drift found. Tallies match recorded votes.")
+    else:
+        print(f"Corrected {len(drift)} counters:")
+        for entry in drift:
+            target = f"candidate {entry['candidate_id']}" if entry['candidate_id'] is not None else "election total"
+            print(f"  Election {entry['election_id']}, {target}: stored {entry['stored']}, actual {entry['actual']}")
+        print("Reconcile complete.")
@@ -0,0 +1,80 @@
+"""Results report emailed to every admin when results are released.
+
+The body is rendered from templates/email/release_report.html. The rank
+list comes from tally.ranked_results() (one aggregate query over the
+counters) and the roll figures from stats.election_stats(). Electors are
+read in keyset chunks of REPORT_CHUNK rows, so memory does not grow with the
+roll. Rolls up to RELEASE_REPORT_INLINE_ROWS are listed inline; larger ones
+go out as a CSV attachment, since a table of tens of thousands of rows is
+slow to render and too big for mail clients to show.
+"""
+import csv
+import io
+from flask import current_app, render_template
+from models import db, Elector
+
+REPORT_CHUNK = 2000
+DEFAULT_INLINE_ROWS = 500
+
+
+def iter_electors(election_id, voted, chunk_size=REPORT_CHUNK):
+    """Yields (id, name, email, phone) rows of voted (or not voted) electors, in id order."""
+    condition = Elector.has_voted.is_(True) if voted else Elector.has_voted.isnot(True)
+    last_id = 0
+    while True:
+        rows = db.session.query(Elector.id, Elector.name, Elector.email, Elector.phone)\
+            .filter(Elector.election_id == election_id, condition, Elector.id > last_id)\
+            .order_by(Elector.id).limit(chunk_size).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def elector_csv(election_id, show_phone):
+    """Returns the roll as UTF-8 CSV bytes (with BOM, so spreadsheet apps detect the encoding)."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['Name', 'Email'] + (['Phone'] if show_phone else []) + ['Voted'])
+    for voted in (True, False):
+        for e in iter_electors(election_id, voted):
+            writer.writerow([e.name, e.email or ''] + ([e.phone or ''] if show_phone else []) + ['Yes' if voted else 'No'])
+    return out.getvalue().encode('utf-8-sig')
+
+
+def build(election):
+    """Returns (html, attachments) for the election's release report."""
+    from stats import election_stats
+    from tally import ranked_results
+
+    results = [{'rank': rank, 'name': candidate.name, 'votes': votes}
+               for candidate, votes, rank in ranked_results(election.id, statuses=None)]
+    counts = election_stats([election.id]).get(election.id, {})
+    total = counts.get('electors', 0)
+    voted = counts.get('voted', 0)
+    show_phone = bool(election.allow_phone_voting)
+    inline = total <= current_app.config.get('RELEASE_REPORT_INLINE_ROWS', DEFAULT_INLINE_ROWS)
+
+    attachments = []
+    if not inline:
+        filename = f"election_{election.id}_electors.csv"
+        attachments.append((filename, 'text/csv', elector_csv(election.id, show_phone)))
+
+    html = render_template('email/release_report.html', election=election, results=results,
+                           show_phone=show_phone, total_electors=total,
+                           voted_count=voted, not_voted_count=total - voted,
+                           voted=iter_electors(election.id, True) if inline else None,
+                           not_voted=iter_electors(election.id, False) if inline else None,
+                           attachment_name=attachments[0][0] if attachments else None)
+    return html, attachments
+
+
+def send(election):
+    """Queues the report to every admin, encoded once for all of them. Returns the queued outbox rows."""
+    from models import Admin
+    from utils import send_shared_email
+
+    html, attachments = build(election)
+    recipients = [email for (email,) in db.session.query(Admin.email)]
+    return send_shared_email(recipients, f"Official Results: {election.title}", html, is_html=True,
+                             attachments=attachments)
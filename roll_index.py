@@ -0,0 +1,258 @@
+"""In-memory voter-roll index for the public login endpoints.
+
+For each election being voted on, electors are held in two hash maps keyed
+by normalized phone and email, mapping to a compact RollEntry
+(id, status, has_voted, hash of name + secret code). check_phone,
+send_login_otp, vote_login and secret_vote_login answer from it instead of
+querying Elector on every attempt; wrong secret codes never reach the
+database.
+
+Routes that change electors call refresh()/remove()/mark_voted() after
+committing, and bulk operations call invalidate(). Each process keeps its
+own index, so changes made by other workers are picked up by rebuilding
+after ROLL_INDEX_TTL_SECONDS. Rebuilds run in the background, one election
+at a time and without holding the index lock: lookups keep being answered
+from the previous roll (or, before the first build, from the database)
+and changes made meanwhile are replayed onto the new one. Misses and
+negative answers (pending, already voted) are confirmed with a single
+indexed query, and so is every successful login (confirm(), and
+match_secret() for secret codes), so a code reset or a removal made on
+another worker takes effect at once. Only check_phone/send_otp answer
+"eligible voter" purely from memory.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from models import db, Elector
+
+RollEntry = namedtuple('RollEntry', 'id status has_voted secret_hash')
+ElectorRow = namedtuple('ElectorRow', 'id phone email name secret_code status has_voted')
+
+DEFAULT_TTL = 120
+MAX_ELECTIONS = 16
+
+
+def normalize_phone(phone):
+    return phone.strip() if phone else None
+
+
+def normalize_email(email):
+    return email.strip().lower() if email else None
+
+
+def secret_hash(name, code):
+    return hashlib.sha256(f"{name}\0{code}".encode()).hexdigest()
+
+
+def _elector_columns():
+    return db.session.query(Elector.id, Elector.phone, Elector.email, Elector.name, Elector.secret_code,
+                            Elector.status, Elector.has_voted)
+
+
+class _ElectionRoll:
+    def __init__(self, election_id):
+        self.election_id = election_id
+        self.by_phone = {}
+        self.by_email = {}
+        self.keys_by_id = {}
+        self.built_at = None
+        self.building = False
+        self.changes = []  # (method, args) applied while a build was running, replayed onto its result
+
+    def read(self):
+        """Reads the whole roll from the database. Returns (by_phone, by_email, keys_by_id); called without locks."""
+        by_phone, by_email, keys_by_id = {}, {}, {}
+        query = _elector_columns().filter(Elector.election_id == self.election_id)\
+            .execution_options(yield_per=5000)
+        for row in query:
+            self._put(by_phone, by_email, keys_by_id, row)
+        return by_phone, by_email, keys_by_id
+
+    @staticmethod
+    def _put(by_phone, by_email, keys_by_id, row):
+        entry = RollEntry(row.id, row.status, bool(row.has_voted), secret_hash(row.name, row.secret_code))
+        phone, email = normalize_phone(row.phone), normalize_email(row.email)
+        if phone:
+            by_phone[phone] = entry
+        if email:
+            by_email[email] = entry
+        keys_by_id[row.id] = (phone, email)
+
+    def upsert(self, row):
+        self.discard(row.id)
+        self._put(self.by_phone, self.by_email, self.keys_by_id, row)
+
+    def set_voted(self, elector_id, voted):
+        phone, email = self.keys_by_id.get(elector_id, (None, None))
+        for index, key in ((self.by_phone, phone), (self.by_email, email)):
+            entry = index.get(key)
+            if entry and entry.id == elector_id:
+                index[key] = entry._replace(has_voted=voted)
+
+    def discard(self, elector_id):
+        phone, email = self.keys_by_id.pop(elector_id, (None, None))
+        for index, key in ((self.by_phone, phone), (self.by_email, email)):
+            entry = index.get(key)
+            if entry and entry.id == elector_id:
+                del index[key]
+
+
+class RollIndex:
+    def __init__(self, ttl=DEFAULT_TTL, max_elections=MAX_ELECTIONS):
+        self.ttl = ttl
+        self.max_elections = max_elections
+        self.background = True
+        self.app = None
+        self._rolls = OrderedDict()
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.app = app
+        self.ttl = app.config.get('ROLL_INDEX_TTL_SECONDS', self.ttl)
+        # Tests build inline so lookups are deterministic.
+        self.background = not app.testing
+
+    def _roll(self, election_id):
+        with self._lock:
+            roll = self._rolls.get(election_id)
+            if roll is None:
+                roll = self._rolls[election_id] = _ElectionRoll(election_id)
+            self._rolls.move_to_end(election_id)
+            while len(self._rolls) > self.max_elections:
+                self._rolls.popitem(last=False)
+            due = not roll.building and (roll.built_at is None or time.monotonic() - roll.built_at > self.ttl)
+            if due:
+                roll.building = True
+                roll.changes = []
+        if due:
+            if self.background and self.app is not None:
+                threading.Thread(target=self._build_in_background, args=(roll,),
+                                 name=f'roll-index-{election_id}', daemon=True).start()
+            else:
+                self._build(roll)
+        return roll
+
+    def _build_in_background(self, roll):
+        with self.app.app_context():
+            try:
+                self._build(roll)
+            finally:
+                db.session.remove()
+
+    def _build(self, roll):
+        """Reads the roll outside the lock, then swaps it in and replays the changes made meanwhile."""
+        try:
+            by_phone, by_email, keys_by_id = roll.read()
+        except Exception as e:
+            print(f"Roll index build failed for election {roll.election_id}: {e}")
+            with self._lock:
+                roll.building = False
+            return
+        with self._lock:
+            roll.by_phone, roll.by_email, roll.keys_by_id = by_phone, by_email, keys_by_id
+            for method, args in roll.changes:
+                method(*args)
+            roll.changes = []
+            roll.built_at = time.monotonic()
+            roll.building = False
+
+    def _change(self, roll, method, *args):
+        """Applies a change to the roll (caller holds the lock), and again after a running build finishes."""
+        method(*args)
+        if roll.building:
+            roll.changes.append((method, args))
+
+    def _fallback(self, roll, kind, value, stale=None):
+        """Reads one elector from the database and re-indexes it.
+
+        Used on a miss (the elector may have been added by another worker) and before giving a negative
+        answer from a cached entry (pending/voted/deleted may have changed elsewhere).
+        """
+        # Emails match case-insensitively, like the in-memory keys; ix_elector_election_email_lower serves this.
+        column = Elector.phone if kind == 'phone' else db.func.lower(Elector.email)
+        row = _elector_columns().filter(Elector.election_id == roll.election_id, column == value).first()
+        with self._lock:
+            if row is None:
+                if stale is not None:
+                    self._change(roll, roll.discard, stale.id)
+                return None
+            self._change(roll, roll.upsert, row)
+        return (roll.by_phone if kind == 'phone' else roll.by_email).get(value)
+
+    def _lookup(self, election_id, kind, value):
+        roll = self._roll(election_id)
+        entry = (roll.by_phone if kind == 'phone' else roll.by_email).get(value)
+        if entry is not None and entry.status == 'approved' and not entry.has_voted:
+            return entry
+        return self._fallback(roll, kind, value, stale=entry)
+
+    def by_phone(self, election_id, phone):
+        phone = normalize_phone(phone)
+        return self._lookup(election_id, 'phone', phone) if phone else None
+
+    def by_email(self, election_id, email):
+        email = normalize_email(email)
+        return self._lookup(election_id, 'email', email) if email else None
+
+    def match_secret(self, election_id, identifier, name, code):
+        """Returns the entry whose phone or email is identifier and whose name and secret code match.
+
+        Wrong codes are rejected from memory; a match is confirmed against the database, so a code that was
+        reset or regenerated on another worker is not accepted.
+        """
+        entry = self.by_email(election_id, identifier) if '@' in (identifier or '') else self.by_phone(election_id, identifier)
+        if entry and entry.secret_hash == secret_hash(name, code):
+            entry = self.confirm(election_id, entry)
+            if entry and entry.secret_hash == secret_hash(name, code):
+                return entry
+        return None
+
+    def confirm(self, election_id, entry):
+        """Re-reads a positive answer's elector by primary key and re-indexes it. Returns the fresh entry, or None
+        if the elector no longer exists. Call before letting someone in on the strength of an index hit."""
+        if entry is None:
+            return None
+        row = _elector_columns().filter(Elector.id == entry.id, Elector.election_id == election_id).first()
+        with self._lock:
+            roll = self._rolls.get(election_id)
+            if row is None:
+                if roll is not None:
+                    self._change(roll, roll.discard, entry.id)
+                return None
+            if roll is not None:
+                self._change(roll, roll.upsert, row)
+        return RollEntry(row.id, row.status, bool(row.has_voted), secret_hash(row.name, row.secret_code))
+
+    def refresh(self, elector):
+        """Re-indexes one elector after a committed add/edit/approve/code change."""
+        # A plain copy: the change may be replayed after this request's session is gone.
+        row = ElectorRow(*(getattr(elector, field) for field in ElectorRow._fields))
+        with self._lock:
+            roll = self._rolls.get(elector.election_id)
+            if roll is not None:
+                self._change(roll, roll.upsert, row)
+
+    def remove(self, election_id, elector_ids):
+        with self._lock:
+            roll = self._rolls.get(election_id)
+            if roll is not None:
+                for elector_id in elector_ids:
+                    self._change(roll, roll.discard, int(elector_id))
+
+    def mark_voted(self, election_id, elector_id, voted=True):
+        with self._lock:
+            roll = self._rolls.get(election_id)
+            if roll is not None:
+                self._change(roll, roll.set_voted, elector_id, voted)
+
+    def invalidate(self, election_id=None):
+        """Drops the index for one election (or all); it is rebuilt on the next lookup."""
+        with self._lock:
+            if election_id is None:
+                self._rolls.clear()
+            else:
+                self._rolls.pop(election_id, None)
+
+
+roll_index = RollIndex()
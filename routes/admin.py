@@ -1,12 +1,15 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, session, make_response
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, Response, stream_with_context, current_app
 import io
 import csv
 from flask_login import login_user, logout_user, login_required, current_user
 from models import db, Admin, Election, Candidate, Elector
 from forms import ElectionForm, ChangePasswordForm, AddAdminForm, EditAdminForm, NewPasswordForm, ForgotPasswordForm, EditElectorForm
 from datetime import datetime, timedelta
-from utils import send_otp, send_password_email, store_otp_in_session, verify_otp_in_session, get_ist_now
+from utils import send_otp, send_password_email, store_otp_in_session, verify_otp_in_session, otp_pending_in_session, clear_otp_in_session, get_ist_now
 from werkzeug.security import generate_password_hash, check_password_hash
+from lifecycle import scheduler
+from roll_index import roll_index
+from realtime import feed
 import random
 import string
 
@@ -21,6 +24,77 @@ def restrict_access_if_force_change():
             flash('You must change your password before proceeding.', 'warning')
             return redirect(url_for('admin.change_password'))
 
+EXPORT_ID_CHUNK = 500
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+def _selected_ids(field):
+    """Parses the checkbox IDs posted in field. Returns None when the whole list was selected server-side."""
+    if request.form.get('select_all'):
+        return None
+    ids = []
+    for value in request.form.getlist(field):
+        try:
+            ids.append(int(value))
+        except ValueError:
+            pass
+    return ids
+
+def _iter_selected(query, id_column, ids):
+    """Yields query rows restricted to ids (chunked IN lists), streaming from the database with yield_per."""
+    if ids is None:
+        yield from query.order_by(id_column).yield_per(1000)
+        return
+    for i in range(0, len(ids), EXPORT_ID_CHUNK):
+        chunk = ids[i:i + EXPORT_ID_CHUNK]
+        yield from query.filter(id_column.in_(chunk)).order_by(id_column).yield_per(1000)
+
+def _csv_response(filename, header, rows):
+    """Streams rows as a CSV download, flushing in ~64KB chunks so memory stays flat."""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= EXPORT_FLUSH_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+
+    output = Response(stream_with_context(generate()), mimetype='text/csv')
+    output.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return output
+
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+
+def _page_args():
+    """Reads the after/limit/q/status query args used by the table APIs."""
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', API_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+    q = (request.args.get('q') or '').strip()
+    status = (request.args.get('status') or '').strip() or None
+    return after, limit, q, status
+
+def _search(q, *columns):
+    return db.or_(*[column.contains(q, autoescape=True) for column in columns])
+
+def _keyset_page(query, id_column, after, limit, serialize):
+    """Returns one page of query ordered by id_column, starting after the given id.
+
+    The total is only counted for the first page so scrolling through a large roll stays cheap.
+    """
+    page = {}
+    if not after:
+        page['total'] = query.order_by(None).count()
+    rows = query.filter(id_column > after).order_by(id_column).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    page['items'] = [serialize(row) for row in rows]
+    page['next_after'] = rows[-1].id if has_more else None
+    return page
+
 @admin_bp.route('/election/create', methods=['GET', 'POST'])
 @login_required
 def create_election():
@@ -60,6 +134,7 @@ def create_election():
                  db.session.add(nota)
                  db.session.commit()
 
+             scheduler.invalidate()
              flash('Election created successfully!', 'success')
              return redirect(url_for('admin.dashboard'))
     return render_template('admin/election_form.html', form=form, title='Create Election')
@@ -70,10 +145,109 @@ def manage_election(election_id):
     election = Election.query.get_or_404(election_id)
     
 
-    total_electors = Elector.query.filter_by(election_id=election_id, status='approved').count()
-    votes_casted = Elector.query.filter_by(election_id=election_id, has_voted=True).count()
+    from stats import election_stats
+    stats = election_stats([election_id]).get(election_id)
+    total_electors = stats['approved']
+    votes_casted = stats['voted']
+
+    from models import ImportJob
+    from importer import expire_stale_jobs
+    expire_stale_jobs(current_app.config['IMPORT_JOB_TIMEOUT_SECONDS'], election_id=election_id)
+    import_job = ImportJob.query.filter(ImportJob.election_id == election_id, ImportJob.status.in_(['queued', 'running']))\
+        .order_by(ImportJob.created_at.desc()).first()
     
-    return render_template('admin/manage_election.html', election=election, total_electors=total_electors, votes_casted=votes_casted)
+    return render_template('admin/manage_election.html', election=election, total_electors=total_electors, votes_casted=votes_casted,
+                           import_job=import_job, stats=stats, realtime=feed.enabled)
+
+@admin_bp.route('/election/<int:election_id>/api/electors')
+@login_required
+def api_electors(election_id):
+    election = Election.query.get_or_404(election_id)
+    after, limit, q, status = _page_args()
+
+    query = Elector.query.filter(Elector.election_id == election.id)
+    if status:
+        query = query.filter(Elector.status == status)
+    voted = request.args.get('voted')
+    if voted in ('0', '1'):
+        query = query.filter(Elector.has_voted == (voted == '1'))
+    if q:
+        query = query.filter(_search(q, Elector.name, Elector.email, Elector.phone))
+
+    def serialize(elector):
+        item = {
+            'id': elector.id,
+            'name': elector.name,
+            'email': elector.email,
+            'phone': elector.phone,
+            'status': elector.status,
+            'has_voted': bool(elector.has_voted),
+        }
+        if elector.status == 'pending':
+            item['approve_url'] = url_for('admin.approve_elector_request', elector_id=elector.id)
+            item['reject_url'] = url_for('admin.reject_elector_request', elector_id=elector.id)
+        else:
+            item['edit_url'] = url_for('admin.edit_elector', elector_id=elector.id)
+            item['delete_url'] = url_for('admin.delete_elector', elector_id=elector.id)
+            item['reset_vote_url'] = url_for('admin.reset_vote', elector_id=elector.id)
+        return item
+
+    return _keyset_page(query, Elector.id, after, limit, serialize)
+
+@admin_bp.route('/election/<int:election_id>/api/candidates')
+@login_required
+def api_candidates(election_id):
+    election = Election.query.get_or_404(election_id)
+    after, limit, q, status = _page_args()
+
+    query = Candidate.query.filter(Candidate.election_id == election.id)
+    if status:
+        query = query.filter(Candidate.status == status)
+    else:
+        query = query.filter(Candidate.status != 'nota')
+    if q:
+        query = query.filter(_search(q, Candidate.name, Candidate.email))
+
+    def serialize(candidate):
+        return {
+            'id': candidate.id,
+            'name': candidate.name,
+            'email': candidate.email,
+            'age': candidate.age,
+            'status': candidate.status,
+            'photo_url': url_for('static', filename=candidate.photo_path) if candidate.photo_path else None,
+            'approve_url': url_for('admin.approve_candidate', candidate_id=candidate.id),
+            'reject_url': url_for('admin.reject_candidate', candidate_id=candidate.id),
+        }
+
+    return _keyset_page(query, Candidate.id, after, limit, serialize)
+
+@admin_bp.route('/election/<int:election_id>/api/revote_links')
+@login_required
+def api_revote_links(election_id):
+    from models import RevoteLink
+    election = Election.query.get_or_404(election_id)
+    after, limit, q, status = _page_args()
+
+    query = db.session.query(RevoteLink.id, RevoteLink.is_used, RevoteLink.created_at, Elector.name, Elector.email, Elector.phone)\
+        .join(Elector, Elector.id == RevoteLink.elector_id)\
+        .filter(RevoteLink.election_id == election.id)
+    if status in ('used', 'pending'):
+        query = query.filter(RevoteLink.is_used == (status == 'used'))
+    if q:
+        query = query.filter(_search(q, Elector.name, Elector.email, Elector.phone))
+
+    def serialize(row):
+        return {
+            'id': row.id,
+            'name': row.name,
+            'email': row.email,
+            'phone': row.phone,
+            'is_used': bool(row.is_used),
+            'created_at': row.created_at.strftime('%Y-%m-%d %H:%M') if row.created_at else None,
+        }
+
+    return _keyset_page(query, RevoteLink.id, after, limit, serialize)
 
 @admin_bp.route('/election/<int:election_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -113,6 +287,7 @@ def edit_election(election_id):
                  nota = Candidate(election_id=election.id, name="None of the Above", email="nota@system", status='nota')
                  db.session.add(nota)
              elif not election.allow_nota and nota_candidate:
+                 # Its votes go with it (cascade); counters are rebuilt after the commit below.
                  db.session.delete(nota_candidate)
              
 
@@ -136,9 +311,16 @@ def edit_election(election_id):
 
              if election.show_results:
                  election.show_results = False
+                 import snapshots, static_export
+                 snapshots.discard(election.id)
+                 static_export.remove(election.id)
                  flash('Election results have been unpublished due to modifications.', 'warning')
              
              db.session.commit()
+             scheduler.invalidate()
+             if not election.allow_nota and nota_candidate:
+                 from tally import reconcile
+                 reconcile(election.id)
              flash('Election updated successfully.', 'success')
              return redirect(url_for('admin.manage_election', election_id=election.id))
              
@@ -152,12 +334,17 @@ def approve_candidate(candidate_id):
     candidate = Candidate.query.get_or_404(candidate_id)
     candidate.status = 'approved'
     db.session.commit()
+    if candidate.election.show_results:
+        # The released details page lists the approved candidates.
+        import static_export
+        static_export.reexport(candidate.election)
     
 
     if candidate.email:
         subject = f"Nomination Approved: {candidate.election.title}"
         body = f"Dear {candidate.name},\n\nCongratulations! Your nomination for '{candidate.election.title}' has been approved. You are now an official candidate.\n\nGood luck!"
-        send_notification_email(candidate.email, subject, body)
+        send_notification_email(candidate.email, subject, body, is_html=False)
+        db.session.commit()
         
     flash(f'{candidate.name} approved. Notification sent.', 'success')
     return redirect(url_for('admin.manage_election', election_id=candidate.election_id))
@@ -169,12 +356,17 @@ def reject_candidate(candidate_id):
     candidate = Candidate.query.get_or_404(candidate_id)
     candidate.status = 'rejected'
     db.session.commit()
+    if candidate.election.show_results:
+        # The released details page lists the approved candidates.
+        import static_export
+        static_export.reexport(candidate.election)
     
 
     if candidate.email:
         subject = f"Nomination Update: {candidate.election.title}"
         body = f"Dear {candidate.name},\n\nWe regret to inform you that your nomination for '{candidate.election.title}' has been rejected or withdrawn.\n\nIf you have questions, please contact the administration."
-        send_notification_email(candidate.email, subject, body)
+        send_notification_email(candidate.email, subject, body, is_html=False)
+        db.session.commit()
         
     flash(f'{candidate.name} rejected. Notification sent.', 'success')
     return redirect(url_for('admin.manage_election', election_id=candidate.election_id))
@@ -201,10 +393,11 @@ def add_elector(election_id):
         elif email and Elector.query.filter_by(election_id=election_id, email=email).first():
             flash('Elector with this email already exists.', 'error')
         else:
-            secret_code = str(random.randint(100000, 999999))
-            elector = Elector(election_id=election_id, phone=phone, email=email, name=name, secret_code=secret_code)
-            db.session.add(elector)
+            from secret_codes import assign_code
+            elector = Elector(election_id=election_id, phone=phone, email=email, name=name)
+            assign_code(elector)
             db.session.commit()
+            roll_index.refresh(elector)
             flash('Elector added.', 'success')
     else:
         flash('Name is required.', 'error')
@@ -224,106 +417,40 @@ def import_electors(election_id):
         flash('No selected file', 'error')
         return redirect(url_for('admin.manage_election', election_id=election_id))
     if file:
-        import csv
-        import io
-        import random
-        
-        def width_safe(row, idx):
-            return idx < len(row) and row[idx].strip()
-
-        stream = io.StringIO(file.stream.read().decode("utf-8-sig"), newline=None)
-        csv_input = csv.reader(stream)
-        count = 0
-        skipped = 0
-        
-        # Determine if header exists and map columns
-        rows = list(csv_input)
-        if not rows:
-            flash('Empty file', 'error')
-            return redirect(url_for('admin.manage_election', election_id=election_id))
-            
-        header = [h.lower().strip() for h in rows[0]]
-        
-        # Default indices
-        phone_idx = 0
-        email_idx = 1
-        name_idx = 2
-        
-        has_header = False
-        
-
-        try:
-            # Find indices if headers exist
-            p_idx = -1
-            e_idx = -1
-            n_idx = -1
-            
-            for i, col in enumerate(header):
-                if 'phone' in col or 'mobile' in col:
-                    p_idx = i
-                elif 'email' in col:
-                    e_idx = i
-                elif 'name' in col:
-                    n_idx = i
-            
-
-                name_idx = n_idx
-                has_header = True
-                if p_idx != -1: phone_idx = p_idx
-                if e_idx != -1: email_idx = e_idx
-                
-
-        except:
-            pass
-            
-        start_index = 1 if has_header else 0
-        # Fallback check
-        if not has_header and len(rows[0]) >= 3:
-             if 'phone' in header[0] or 'email' in header[1] or 'name' in header[2]:
-                 start_index = 1
-
-        for row in rows[start_index:]:
-            # Ensure row is long enough for the max index we need
-            max_idx = max(phone_idx, email_idx, name_idx)
-            if len(row) > max_idx:
-                phone = row[phone_idx].strip() if width_safe(row, phone_idx) else None
-                email = row[email_idx].strip() if width_safe(row, email_idx) else None
-                name = row[name_idx].strip() if width_safe(row, name_idx) else None
-                
+        from flask import current_app
+        from importer import start_import_job
 
-                if has_header:
-                     if p_idx == -1: phone = None
-                     else: phone = row[p_idx].strip() if width_safe(row, p_idx) else None
-                     
-                     if e_idx == -1: email = None 
-                     else: email = row[e_idx].strip() if width_safe(row, e_idx) else None
-                
-                if (phone or email) and name:
-                    # Check duplicate
-                    dup = False
-                    if phone and Elector.query.filter_by(election_id=election_id, phone=phone).first():
-                        dup = True
-                    if email and Elector.query.filter_by(election_id=election_id, email=email).first():
-                        dup = True
-                        
-                    if not dup:
-                        secret_code = str(random.randint(100000, 999999))
-                        db.session.add(Elector(election_id=election_id, phone=phone, email=email, name=name, secret_code=secret_code))
-                        count += 1
-                    else:
-                        skipped += 1
-                else:
-                    skipped += 1
-            else:
-                skipped += 1
-        db.session.commit()
-        if skipped > 0:
-             flash(f'Imported {count} electors. Skipped {skipped} rows (duplicates or missing data).', 'warning')
-        else:
-            flash(f'Imported {count} electors.', 'success')
+        # Large rolls take minutes to import, so the work runs in the background and the page polls progress.
+        job = start_import_job(current_app._get_current_object(), election_id, file)
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return {'job_id': job.id, 'status_url': url_for('admin.import_job_status', job_id=job.id)}, 202
+        flash('Import started. Progress is shown below.', 'info')
         
     return redirect(url_for('admin.manage_election', election_id=election_id))
 
+@admin_bp.route('/import_jobs/<job_id>')
+@login_required
+def import_job_status(job_id):
+    from models import ImportJob
+    from importer import expire_stale_jobs
+    job = ImportJob.query.get_or_404(job_id)
+    if not job.is_finished and expire_stale_jobs(current_app.config['IMPORT_JOB_TIMEOUT_SECONDS'],
+                                                 election_id=job.election_id):
+        db.session.refresh(job)
+    return job.to_dict()
+
+@admin_bp.route('/import_jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_import_job(job_id):
+    from models import ImportJob
+    if not current_user.can_manage_electors:
+        return {'error': 'Access denied.'}, 403
+    job = ImportJob.query.get_or_404(job_id)
+    if not job.is_finished:
+        job.cancel_requested = True
+        db.session.commit()
+    return job.to_dict()
+
 @admin_bp.route('/election/<int:election_id>/publish', methods=['POST'])
 @login_required
 def publish_election(election_id):
@@ -334,6 +461,7 @@ def publish_election(election_id):
     if election.status == 'draft':
         election.status = 'active'
         db.session.commit()
+        scheduler.invalidate()
         flash('Election published! It is now visible to the public.', 'success')
     return redirect(url_for('admin.manage_election', election_id=election_id))
 
@@ -348,6 +476,7 @@ def end_election(election_id):
         election.status = 'completed'
         election.end_time = get_ist_now()
         db.session.commit()
+        scheduler.invalidate()
         flash('Election marked as completed.', 'success')
     return redirect(url_for('admin.manage_election', election_id=election_id))
 
@@ -369,6 +498,7 @@ def start_nominations_now(election_id):
         election.nomination_start = now
         election.nomination_end = now + timedelta(minutes=minutes)
         db.session.commit()
+        scheduler.invalidate()
         flash(f'Nominations started immediately for {minutes} minutes.', 'success')
         
 
@@ -389,6 +519,7 @@ def end_nominations_now(election_id):
     if election.nomination_start <= now and election.nomination_end > now:
         election.nomination_end = now
         db.session.commit()
+        scheduler.invalidate()
         flash('Nominations ended immediately.', 'success')
     return redirect(url_for('admin.manage_election', election_id=election_id))
 
@@ -410,6 +541,7 @@ def start_voting_now(election_id):
         if election.status == 'draft':
             election.status = 'active'
         db.session.commit()
+        scheduler.invalidate()
         flash(f'Voting started immediately for {minutes} minutes.', 'success')
     else:
         flash('Cannot start voting. Ensure nominations have ended.', 'warning')
@@ -425,6 +557,9 @@ def toggle_election_visibility(election_id):
     election = Election.query.get_or_404(election_id)
     election.is_hidden = not election.is_hidden
     db.session.commit()
+    if election.show_results:
+        import static_export
+        static_export.reexport(election)
     status = "hidden from public" if election.is_hidden else "now visible to public"
     flash(f'Election is {status}.', 'success')
     return redirect(url_for('admin.manage_election', election_id=election_id))
@@ -444,6 +579,7 @@ def delete_election(election_id):
     store_otp_in_session('delete_election_otp', otp)
     
     send_otp(current_user.email, otp, purpose=f"Deletion of '{election.title}'")
+    db.session.commit()
     flash(f'OTP sent to {current_user.email} to confirm deletion.', 'info')
     return redirect(url_for('admin.verify_delete_election_otp'))
 
@@ -462,8 +598,13 @@ def verify_delete_election_otp():
             election = Election.query.get(election_id)
             
             if election:
-                db.session.delete(election)
+                from purge import purge_election
+                import static_export
+                purge_election(election.id)
                 db.session.commit()
+                static_export.remove(election_id)
+                scheduler.invalidate()
+                roll_index.invalidate(election_id)
                 flash('Election deleted successfully.', 'success')
             else:
                  flash('Election not found (already deleted?).', 'error')
@@ -513,6 +654,7 @@ def edit_elector(elector_id):
         elector.phone = phone
         elector.email = email
         db.session.commit()
+        roll_index.refresh(elector)
         flash('Elector updated successfully.', 'success')
         return redirect(url_for('admin.manage_election', election_id=elector.election_id))
             
@@ -521,19 +663,20 @@ def edit_elector(elector_id):
 @admin_bp.route('/elector/<int:elector_id>/delete', methods=['POST'])
 @login_required
 def delete_elector(elector_id):
-    from models import Vote
+    from purge import delete_electors
     elector = Elector.query.get_or_404(elector_id)
     if elector.election.status == 'completed':
         flash('Cannot delete electors from a completed election.', 'error')
         return redirect(url_for('admin.manage_election', election_id=elector.election_id))
         
     election_id = elector.election_id
-    
+    elector_id = elector.id
+    removed = {'electors': -1, 'approved': -int(elector.status == 'approved'), 'voted': -int(bool(elector.has_voted))}
 
-    Vote.query.filter_by(elector_id=elector.id).delete()
-        
-    db.session.delete(elector)
+    delete_electors(election_id, [elector_id])
     db.session.commit()
+    roll_index.remove(election_id, [elector_id])
+    feed.publish(election_id, **removed)
     flash('Elector removed.', 'success')
     return redirect(url_for('admin.manage_election', election_id=election_id))
 
@@ -549,25 +692,28 @@ def delete_electors_bulk(election_id):
     if election.status == 'completed':
         flash('Cannot delete electors from a completed election.', 'error')
         return redirect(url_for('admin.manage_election', election_id=election_id))
-        
-    elector_ids = request.form.getlist('elector_ids')
+
+    from purge import delete_electors, delete_electors_matching
+
+    # "Delete all" mode for pending requests / rejected electors, done with one set-based pass.
+    status = request.form.get('status')
+    if status in ('pending', 'rejected'):
+        deleted_count = delete_electors_matching(election_id, Elector.status == status)
+        db.session.commit()
+        roll_index.invalidate(election_id)
+        feed.resync(election_id)
+        flash(f'{deleted_count} {status} electors deleted.', 'success')
+        return redirect(url_for('admin.manage_election', election_id=election_id))
+
+    elector_ids = _selected_ids('elector_ids')
     if not elector_ids:
         flash('No electors selected.', 'warning')
         return redirect(url_for('admin.manage_election', election_id=election_id))
-        
-    from models import Vote
-    deleted_count = 0
-    
 
-
-    valid_electors = Elector.query.filter(Elector.election_id == election_id, Elector.id.in_(elector_ids)).all()
-    
-    for elector in valid_electors:
-        Vote.query.filter_by(elector_id=elector.id).delete()
-        db.session.delete(elector)
-        deleted_count += 1
-        
+    deleted_count = delete_electors(election_id, elector_ids)
     db.session.commit()
+    roll_index.remove(election_id, elector_ids)
+    feed.resync(election_id)
     flash(f'{deleted_count} electors deleted.', 'success')
     return redirect(url_for('admin.manage_election', election_id=election_id))
 
@@ -592,10 +738,10 @@ def get_secret_code(election_id):
             
     if elector:
         if action == 'reset':
-            import random
-            new_code = str(random.randint(100000, 999999))
-            elector.secret_code = new_code
+            from secret_codes import assign_code
+            assign_code(elector)
             db.session.commit()
+            roll_index.refresh(elector)
             flash(f'Secret Code RESET successfully. New Code for {elector.name}: {elector.secret_code}', 'success')
         else:
             flash(f'Secret Code for {elector.name}: {elector.secret_code}', 'success')
@@ -628,6 +774,7 @@ def reset_vote(elector_id):
     store_otp_in_session('reset_vote_otp', otp)
     
     send_otp(current_user.email, otp, purpose="Vote Reset")
+    db.session.commit()
     flash(f'OTP sent to {current_user.email} to confirm vote reset.', 'info')
     return redirect(url_for('admin.verify_reset_vote_otp'))
 
@@ -639,18 +786,18 @@ def verify_reset_vote_otp():
         
     if request.method == 'POST':
         otp = request.form.get('otp')
-        if otp == session.get('reset_vote_otp'):
-            from models import Vote
+        is_valid, msg = verify_otp_in_session('reset_vote_otp', otp)
+        if is_valid:
+            from tally import delete_votes
             elector_id = session.get('reset_vote_elector_id')
             elector = Elector.query.get(elector_id)
             
             if elector and elector.has_voted:
 
-                vote = Vote.query.filter_by(elector_id=elector.id, election_id=elector.election_id).first()
-                if vote:
-                    db.session.delete(vote)
+                if delete_votes(elector.election_id, [elector.id]):
                     elector.has_voted = False
                     db.session.commit()
+                    roll_index.mark_voted(elector.election_id, elector.id, False)
                     if elector.election.allow_phone_voting:
                         display_identity = f"{elector.phone or 'N/A'}"
                         if elector.email:
@@ -662,11 +809,11 @@ def verify_reset_vote_otp():
                     flash('Could not find vote record to delete.', 'error')
             
             session.pop('reset_vote_elector_id', None)
-            session.pop('reset_vote_otp', None)
+            clear_otp_in_session('reset_vote_otp')
             
             return redirect(url_for('admin.manage_election', election_id=elector.election_id if elector else 1))
         else:
-            flash('Invalid OTP', 'error')
+            flash(msg, 'error')
             
     return render_template('admin/verify_otp_generic.html', title="Confirm Vote Reset")
 
@@ -707,6 +854,7 @@ def initiate_release_results(election_id):
     store_otp_in_session('release_otp', otp)
     
     send_otp(current_user.email, otp, purpose="Result Release")
+    db.session.commit()
     flash(f'OTP sent to {current_user.email} to confirm result release.', 'info')
     return redirect(url_for('admin.verify_release_results_otp'))
 
@@ -726,14 +874,18 @@ def verify_release_results_otp():
             
             if election:
                 # DUPLICATE CHECK
+                # Votes are cast with a compare-and-set on has_voted and uq_vote_election_elector
+                # rejects a second row, so only legacy databases without the constraint need the scan.
                 from sqlalchemy import func
-                from models import Vote, Elector
+                from models import Vote, Elector, vote_uniqueness_enforced
                 
-                duplicates = db.session.query(Vote.elector_id, func.count(Vote.id))\
-                    .filter(Vote.election_id == election_id)\
-                    .group_by(Vote.elector_id)\
-                    .having(func.count(Vote.id) > 1)\
-                    .all()
+                duplicates = []
+                if not vote_uniqueness_enforced():
+                    duplicates = db.session.query(Vote.elector_id, func.count(Vote.id))\
+                        .filter(Vote.election_id == election_id)\
+                        .group_by(Vote.elector_id)\
+                        .having(func.count(Vote.id) > 1)\
+                        .all()
 
                 if duplicates:
                     # Found duplicates!
@@ -753,7 +905,7 @@ def verify_release_results_otp():
                     # Store session verify so we don't need OTP again for resolution
                     session['release_verified_election_id'] = election_id
                     session.pop('release_election_id', None) # Switch to verified session
-                    session.pop('release_otp', None)
+                    clear_otp_in_session('release_otp')
 
                     return render_template('admin/duplicate_resolution.html', election=election, voters=duplicate_voters)
 
@@ -779,97 +931,18 @@ def perform_release_results(election):
         # If it was on hold, now it is completed
         if election.status == 'hold':
             election.status = 'completed'
-            
+
+        import snapshots, static_export
+        snapshot = snapshots.freeze(election)
         db.session.commit()
+        try:
+            static_export.export(election, snapshot)
+        except OSError as e:
+            print(f"Static export of results for election {election.id} failed: {e}")
         
-        from models import Candidate, Admin, Vote, Elector
-        from utils import send_notification_email
-        
-        candidates = Candidate.query.filter_by(election_id=election.id).all()
-        
-        results = []
-        for cand in candidates:
-            count = Vote.query.filter_by(candidate_id=cand.id).count()
-            results.append({'name': cand.name, 'votes': count})
-        
-        results.sort(key=lambda x: x['votes'], reverse=True)
-        
-        electors = Elector.query.filter_by(election_id=election.id).all()
-        voted_list = [e for e in electors if e.has_voted]
-        not_voted_list = [e for e in electors if not e.has_voted]
-        
-        def build_elector_rows(elector_list, show_phone):
-            rows = ""
-            for e in elector_list:
-                phone_cell = f"<td style='padding:8px; border:1px solid #ddd;'>{e.phone or '-'}</td>" if show_phone else ""
-                rows += f"<tr><td style='padding:8px; border:1px solid #ddd;'>{e.name}</td><td style='padding:8px; border:1px solid #ddd;'>{e.email or '-'}</td>{phone_cell}</tr>"
-            return rows
-
-        show_phone = election.allow_phone_voting
-        phone_header = "<th style='padding:8px; border:1px solid #ddd; background-color:#f2f2f2;'>Phone</th>" if show_phone else ""
-        
-        html_body = f"""
-        <h2 style="color: #333;">Election Results: {election.title}</h2>
-        <p>Results have been officially released.</p>
-        
-        <h3 style="border-bottom: 2px solid #5a5a5a; padding-bottom: 5px;">Rank List</h3>
-        <table style="width:100%; border-collapse: collapse; margin-bottom: 20px;">
-            <thead>
-                <tr style="background-color: #f2f2f2;">
-                    <th style="padding:12px; border:1px solid #ddd; text-align:left;">Rank</th>
-                    <th style="padding:12px; border:1px solid #ddd; text-align:left;">Candidate</th>
-                    <th style="padding:12px; border:1px solid #ddd; text-align:left;">Votes</th>
-                </tr>
-            </thead>
-            <tbody>
-        """
-        
-        for idx, res in enumerate(results, 1):
-            is_winner = "font-weight:bold; background-color:#e8f5e9;" if idx == 1 else ""
-            html_body += f"<tr style='{is_winner}'><td style='padding:8px; border:1px solid #ddd;'>{idx}</td><td style='padding:8px; border:1px solid #ddd;'>{res['name']}</td><td style='padding:8px; border:1px solid #ddd;'>{res['votes']}</td></tr>"
-        
-        html_body += """
-            </tbody>
-        </table>
-        
-        <h3 style="border-bottom: 2px solid #28a745; padding-bottom: 5px; color: #28a745;">Voted Electors</h3>
-        <table style="width:100%; border-collapse: collapse; margin-bottom: 20px;">
-            <thead>
-                <tr>
-                    <th style="padding:8px; border:1px solid #ddd; background-color:#f2f2f2;'>Name</th>
-                    <th style="padding:8px; border:1px solid #ddd; background-color:#f2f2f2;'>Email</th>
-                    {phone_header}
-                </tr>
-            </thead>
-            <tbody>
-                {voted_rows}
-            </tbody>
-        </table>
-        
-        <h3 style="border-bottom: 2px solid #dc3545; padding-bottom: 5px; color: #dc3545;">Not Voted Electors</h3>
-        <table style="width:100%; border-collapse: collapse; margin-bottom: 20px;">
-            <thead>
-                <tr>
-                    <th style="padding:8px; border:1px solid #ddd; background-color:#f2f2f2;'>Name</th>
-                    <th style="padding:8px; border:1px solid #ddd; background-color:#f2f2f2;'>Email</th>
-                    {phone_header}
-                </tr>
-            </thead>
-            <tbody>
-                {not_voted_rows}
-            </tbody>
-        </table>
-        """
-        
-        html_body = html_body.format(
-            phone_header=phone_header,
-            voted_rows=build_elector_rows(voted_list, show_phone) or "<tr><td colspan='3'>None</td></tr>",
-            not_voted_rows=build_elector_rows(not_voted_list, show_phone) or "<tr><td colspan='3'>None</td></tr>"
-        )
-
-        admins = Admin.query.all()
-        for admin in admins:
-            send_notification_email(admin.email, f"Official Results: {election.title}", html_body)
+        import release_report
+        release_report.send(election)
+        db.session.commit()
             
         flash('Results released. Detailed report sent to all admins.', 'success')
     except Exception as e:
@@ -877,7 +950,7 @@ def perform_release_results(election):
         flash(f'Results released, but failed to send result emails: {e}', 'warning')
     
     session.pop('release_election_id', None)
-    session.pop('release_otp', None)
+    clear_otp_in_session('release_otp')
     session.pop('release_verified_election_id', None)
     
     return redirect(url_for('admin.manage_election', election_id=election.id))
@@ -892,18 +965,20 @@ def resolve_duplicates_remove():
     election = Election.query.get_or_404(election_id)
     voter_ids = request.form.getlist('voter_ids')
     
-    from models import Vote, Elector
+    from models import Elector
+    from tally import delete_votes
+    
+    # Delete ALL votes for these duplicate electors
+    delete_votes(election_id, voter_ids)
     
     for vid in voter_ids:
-        # Delete ALL votes for this duplicate elector
-        Vote.query.filter_by(election_id=election_id, elector_id=vid).delete()
-        
         # Reset voted status so they don't show as voted in admin UI/Stats
         elector = Elector.query.get(vid)
         if elector:
             elector.has_voted = False
         
     db.session.commit()
+    roll_index.invalidate(election_id)
     flash('Duplicate votes removed.', 'success')
     return perform_release_results(election)
 
@@ -917,20 +992,22 @@ def resolve_duplicates_revote():
     election = Election.query.get_or_404(election_id)
     voter_ids = request.form.getlist('voter_ids')
     
-    from models import Vote, Elector, RevoteLink
-    from utils import send_notification_email
+    from models import Elector, RevoteLink
+    from utils import send_bulk_emails
+    from tally import delete_votes
     import secrets
     
     election.status = 'hold'
     db.session.commit()
     
-    count = 0
+    # 1. Delete existing votes
+    delete_votes(election_id, voter_ids)
+    
+    messages = []
     for vid in voter_ids:
         elector = Elector.query.get(vid)
         if not elector: continue
         
-        # 1. Delete existing votes
-        Vote.query.filter_by(election_id=election_id, elector_id=vid).delete()
         elector.has_voted = False
         
         # 2. Generate Private Link
@@ -946,11 +1023,12 @@ def resolve_duplicates_revote():
             # Render template returns string, we can pass it directly.
             # I need to create the template properly.
             
-            send_notification_email(elector.email, subject, body)
-            count += 1
+            messages.append({'to_email': elector.email, 'subject': subject, 'body': body, 'is_html': True, 'key': f"revote:{token}"})
             
+    send_bulk_emails(messages)
     db.session.commit()
-    flash(f'Election put on HOLD. {count} revote links sent.', 'warning')
+    roll_index.invalidate(election_id)
+    flash(f'Election put on HOLD. {len(messages)} revote links sent.', 'warning')
     
     session.pop('release_verified_election_id', None)
     return redirect(url_for('admin.manage_election', election_id=election_id))
@@ -964,29 +1042,21 @@ def export_revote_links(election_id):
 
     election = Election.query.get_or_404(election_id)
     
-    link_ids = request.form.getlist('link_ids')
-    if not link_ids:
+    link_ids = _selected_ids('link_ids')
+    if link_ids == []:
         flash('No revote links selected for export.', 'warning')
         return redirect(url_for('admin.manage_election', election_id=election_id))
 
     from models import RevoteLink
     
-    si = io.StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['Name', 'Email', 'Phone', 'Link Status', 'Private Link', 'Sent At'])
-    
-    # Filter links
-    selected_links = [l for l in election.revote_links if str(l.id) in link_ids]
-    
-    for link in selected_links:
-        status = "Used" if link.is_used else "Pending"
-        url = url_for('public.revote_access', token=link.token, _external=True)
-        cw.writerow([link.elector.name, link.elector.email or '', link.elector.phone or '', status, url, link.created_at])
-        
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = f"attachment; filename=revote_links_{election_id}.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+    query = db.session.query(Elector.name, Elector.email, Elector.phone, RevoteLink.is_used, RevoteLink.token, RevoteLink.created_at)\
+        .join(Elector, Elector.id == RevoteLink.elector_id)\
+        .filter(RevoteLink.election_id == election.id)
+    rows = (
+        [name, email or '', phone or '', "Used" if is_used else "Pending", url_for('public.revote_access', token=token, _external=True), created_at]
+        for name, email, phone, is_used, token, created_at in _iter_selected(query, RevoteLink.id, link_ids)
+    )
+    return _csv_response(f"revote_links_{election_id}.csv", ['Name', 'Email', 'Phone', 'Link Status', 'Private Link', 'Sent At'], rows)
 
 @admin_bp.route('/election/<int:election_id>/force_release', methods=['POST'])
 @login_required
@@ -1012,25 +1082,27 @@ def resend_hold_links(election_id):
         return redirect(url_for('admin.manage_election', election_id=election_id))
         
     from models import RevoteLink
-    from utils import send_notification_email
+    from utils import send_bulk_emails
     
     pending_links = RevoteLink.query.filter_by(election_id=election_id, is_used=False).all()
-    count = 0
+    messages = []
     for link in pending_links:
         if link.elector.email:
              revote_url = url_for('public.revote_access', token=link.token, _external=True)
              subject = f"REMINDER: Re-vote for {election.title}"
              body = render_template('email/revote_link.html', elector=link.elector, election=election, link=revote_url)
-             send_notification_email(link.elector.email, subject, body)
-             count += 1
+             messages.append({'to_email': link.elector.email, 'subject': subject, 'body': body, 'is_html': True})
              
-    flash(f'Resent {count} emails.', 'success')
+    send_bulk_emails(messages)
+    db.session.commit()
+    flash(f'Resent {len(messages)} emails.', 'success')
     return redirect(url_for('admin.initiate_release_results', election_id=election_id))
 
 @admin_bp.route('/admins', methods=['GET', 'POST'])
 @login_required
 def manage_admins():
-    from utils import get_current_thread_limit
+    from utils import get_current_thread_limit, get_gmail_cache_stats
+    from outbox import outbox_stats
     
     if not current_user.can_manage_admins:
         flash('Access denied.', 'error')
@@ -1061,6 +1133,7 @@ def manage_admins():
             
             # Send Email
             if send_password_email(form.email.data, form.username.data, password):
+                db.session.commit()
                 flash(f'Admin created. Credentials sent to {form.email.data}', 'success')
             else:
                  flash(f'Admin created but failed to send email.', 'warning')
@@ -1070,7 +1143,8 @@ def manage_admins():
     admins = Admin.query.all()
     current_limit = get_current_thread_limit()
     
-    return render_template('admin/manage_admins.html', form=form, admins=admins, current_thread_limit=current_limit)
+    return render_template('admin/manage_admins.html', form=form, admins=admins, current_thread_limit=current_limit,
+                           gmail_stats=get_gmail_cache_stats(), outbox=outbox_stats())
 
 @admin_bp.route('/admin/<int:admin_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -1119,6 +1193,7 @@ def edit_admin(admin_id):
             }
             # Send to CURRENT email for security check
             send_otp(admin.email, otp, purpose="Email Change Verification")
+            db.session.commit()
             flash(f'OTP sent to your current email ({admin.email}) to verify change.', 'info')
             return redirect(url_for('admin.verify_update_otp'))
 
@@ -1172,7 +1247,7 @@ def verify_update_otp():
                     flash('Admin updated successfully.', 'success')
             
             session.pop('update_admin_data', None)
-            session.pop('update_admin_otp', None)
+            clear_otp_in_session('update_admin_otp')
             return redirect(url_for('admin.manage_admins'))
         else:
             flash(msg, 'error')
@@ -1221,6 +1296,7 @@ def initiate_self_password_change():
     session['pwd_change_user_id'] = current_user.id
     
     send_otp(current_user.email, otp, purpose="Password Change")
+    db.session.commit()
     flash(f'OTP sent to {current_user.email} to verify safe password change.', 'info')
     return redirect(url_for('admin.verify_password_change_otp'))
 
@@ -1236,7 +1312,7 @@ def verify_password_change_otp():
         
         if is_valid:
             session['pwd_change_verified'] = True
-            session.pop('password_change_otp', None)
+            clear_otp_in_session('password_change_otp')
             return redirect(url_for('admin.self_set_password'))
         else:
             flash(msg, 'error')
@@ -1282,6 +1358,7 @@ def forgot_password():
             session['reset_pwd_user_id'] = user.id
             
             send_otp(user.email, otp, purpose="Password Reset")
+            db.session.commit()
 
             flash(f'If an account exists for {user_input}, an OTP has been sent.', 'info')
             return redirect(url_for('admin.verify_reset_password_otp'))
@@ -1293,7 +1370,7 @@ def forgot_password():
 
 @admin_bp.route('/login/forgot/verify', methods=['GET', 'POST'])
 def verify_reset_password_otp():
-    if 'reset_pwd_otp' not in session:
+    if not otp_pending_in_session('reset_pwd_otp'):
         return render_template('admin/verify_otp_generic.html', title="Enter OTP")
         
     if request.method == 'POST':
@@ -1323,7 +1400,7 @@ def reset_password_set():
             
             session.pop('reset_pwd_verified', None)
             session.pop('reset_pwd_user_id', None)
-            session.pop('reset_pwd_otp', None)
+            clear_otp_in_session('reset_pwd_otp')
             
             flash('Password reset successfully. Please login.', 'success')
             return redirect(url_for('admin.login'))
@@ -1347,6 +1424,7 @@ def login():
                 store_otp_in_session('login_otp', otp)
                 
                 send_otp(user.email, otp, purpose="Admin Login")
+                db.session.commit()
                 flash('Login OTP sent to your email.', 'info')
                 return redirect(url_for('admin.verify_login_otp'))
         else:
@@ -1369,7 +1447,7 @@ def verify_login_otp():
              if user:
                  login_user(user)
                  session.pop('pending_login_user_id', None)
-                 session.pop('login_otp', None)
+                 clear_otp_in_session('login_otp')
                  
 
                  return redirect(url_for('admin.dashboard'))
@@ -1387,8 +1465,18 @@ def logout():
 @admin_bp.route('/dashboard')
 @login_required
 def dashboard():
+    from stats import election_stats
     elections = Election.query.order_by(Election.start_time.desc()).all()
-    return render_template('admin/dashboard.html', elections=elections)
+    return render_template('admin/dashboard.html', elections=elections, stats=election_stats())
+
+@admin_bp.route('/dashboard/stats')
+@login_required
+def dashboard_stats():
+    from stats import election_stats
+    stats = election_stats()
+    elections = db.session.query(Election.id, Election.title, Election.status)\
+        .order_by(Election.start_time.desc()).all()
+    return {'elections': [dict(stats[e.id], id=e.id, title=e.title, status=e.status) for e in elections]}
 
 @admin_bp.route('/elector/<int:elector_id>/approve')
 @login_required
@@ -1398,8 +1486,12 @@ def approve_elector_request(elector_id):
         return redirect(url_for('admin.dashboard'))
         
     elector = Elector.query.get_or_404(elector_id)
+    was_pending = elector.status == 'pending'
     elector.status = 'approved'
     db.session.commit()
+    roll_index.refresh(elector)
+    if was_pending:
+        feed.publish(elector.election_id, pending_requests=-1, approved=1)
     
 
     if elector.email:
@@ -1411,7 +1503,8 @@ def approve_elector_request(elector_id):
         <p>You can now log in and cast your vote.</p>
         <a href="{url_for('public.vote_login', election_id=elector.election.id, _external=True)}">Login to Vote</a>
         """
-        send_notification_email(elector.email, subject, body)
+        send_notification_email(elector.email, subject, body, is_html=True)
+        db.session.commit()
         
     flash(f'Request for {elector.name} approved.', 'success')
     return redirect(url_for('admin.manage_election', election_id=elector.election.id))
@@ -1431,8 +1524,13 @@ def reject_elector_request(elector_id):
     name = elector.name
     title = elector.election.title
     
+    elector_id = elector.id
+    was_pending = elector.status == 'pending'
     db.session.delete(elector)
     db.session.commit()
+    roll_index.remove(election_id, [elector_id])
+    if was_pending:
+        feed.publish(election_id, pending_requests=-1, electors=-1)
     
 
     if email:
@@ -1443,7 +1541,8 @@ def reject_elector_request(elector_id):
         <p>Your request to be added to the voter roll for <strong>{title}</strong> has been <strong>REJECTED</strong>.</p>
         <p>You have been removed from the request list. You may apply again if there was an error in your details.</p>
         """
-        send_notification_email(email, subject, body)
+        send_notification_email(email, subject, body, is_html=True)
+        db.session.commit()
         
     flash(f'Request for {name} rejected and removed.', 'success')
     return redirect(url_for('admin.manage_election', election_id=election_id))
@@ -1457,26 +1556,14 @@ def export_electors(election_id):
 
     election = Election.query.get_or_404(election_id)
     
-    elector_ids = request.form.getlist('elector_ids')
-    if not elector_ids:
+    elector_ids = _selected_ids('elector_ids')
+    if elector_ids == []:
         flash('No electors selected for export.', 'warning')
         return redirect(url_for('admin.manage_election', election_id=election_id))
 
-    si = io.StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['Name', 'Email', 'Phone'])
-    
-    # Filter electors
-    selected_electors = [e for e in election.electors if str(e.id) in elector_ids]
-    
-    for elector in selected_electors:
-        cw.writerow([elector.name, elector.email or '', elector.phone or ''])
-        
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = f"attachment; filename=electors_{election_id}.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
-    return output
+    query = db.session.query(Elector.name, Elector.email, Elector.phone).filter(Elector.election_id == election.id)
+    rows = ([name, email or '', phone or ''] for name, email, phone in _iter_selected(query, Elector.id, elector_ids))
+    return _csv_response(f"electors_{election_id}.csv", ['Name', 'Email', 'Phone'], rows)
 
 @admin_bp.route('/election/<int:election_id>/export_nominations', methods=['POST'])
 @login_required
@@ -1487,25 +1574,15 @@ def export_nominations(election_id):
 
     election = Election.query.get_or_404(election_id)
     
-    candidate_ids = request.form.getlist('candidate_ids')
-    if not candidate_ids:
+    candidate_ids = _selected_ids('candidate_ids')
+    if candidate_ids == []:
         flash('No candidates selected for export.', 'warning')
         return redirect(url_for('admin.manage_election', election_id=election_id))
-    
-    si = io.StringIO()
-    cw = csv.writer(si)
-    cw.writerow(['Name', 'Email', 'Age', 'Status'])
-    
-    # Filter candidates
-    selected_candidates = [c for c in election.candidates if str(c.id) in candidate_ids]
-    
-    for candidate in selected_candidates:
-        cw.writerow([candidate.name, candidate.email or '', candidate.age or '', candidate.status])
-        
-    output = make_response(si.getvalue())
-    output.headers["Content-Disposition"] = f"attachment; filename=nominations_{election_id}.csv"
-    output.headers["Content-type"] = "text/csv"
-    return output
+
+    query = db.session.query(Candidate.name, Candidate.email, Candidate.age, Candidate.status)\
+        .filter(Candidate.election_id == election.id)
+    rows = ([name, email or '', age or '', status] for name, email, age, status in _iter_selected(query, Candidate.id, candidate_ids))
+    return _csv_response(f"nominations_{election_id}.csv", ['Name', 'Email', 'Age', 'Status'], rows)
 
 @admin_bp.route('/election/<int:election_id>/export_secret_codes/initiate', methods=['POST'])
 @login_required
@@ -1522,6 +1599,7 @@ def initiate_export_secret_codes(election_id):
     store_otp_in_session('export_codes_otp', otp)
     
     send_otp(current_user.email, otp, purpose=f"SECRET CODE EXPORT for '{election.title}'")
+    db.session.commit()
     flash(f'CRITICAL: OTP sent to {current_user.email}. required for exporting sensitive data.', 'warning')
     return redirect(url_for('admin.verify_export_secret_codes_otp'))
 
@@ -1541,17 +1619,10 @@ def verify_export_secret_codes_otp():
             
             if election:
                 # GENERATE CSV
-                si = io.StringIO()
-                cw = csv.writer(si)
-                cw.writerow(['Name', 'Phone', 'Email', 'Secret Code'])
-                
-                electors = Elector.query.filter_by(election_id=election.id).all()
-                for elector in electors:
-                    cw.writerow([elector.name, elector.phone or '', elector.email or '', elector.secret_code])
-                    
-                output = make_response(si.getvalue())
-                output.headers["Content-Disposition"] = f"attachment; filename=secret_codes_{election.id}.csv"
-                output.headers["Content-type"] = "text/csv"
+                query = db.session.query(Elector.name, Elector.phone, Elector.email, Elector.secret_code)\
+                    .filter(Elector.election_id == election.id)
+                rows = ([name, phone or '', email or '', code] for name, phone, email, code in _iter_selected(query, Elector.id, None))
+                output = _csv_response(f"secret_codes_{election.id}.csv", ['Name', 'Phone', 'Email', 'Secret Code'], rows)
                 # Ensure no caching so admins always get the latest codes
                 output.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
                 output.headers["Pragma"] = "no-cache"
@@ -1559,7 +1630,7 @@ def verify_export_secret_codes_otp():
                 
 
                 session.pop('export_codes_election_id', None)
-                session.pop('export_codes_otp', None)
+                clear_otp_in_session('export_codes_otp')
                 
                 return output
                 
@@ -1567,7 +1638,7 @@ def verify_export_secret_codes_otp():
                  flash('Election not found.', 'error')
             
             session.pop('export_codes_election_id', None)
-            session.pop('export_codes_otp', None)
+            clear_otp_in_session('export_codes_otp')
             return redirect(url_for('admin.dashboard'))
         else:
             flash(msg, 'error')
@@ -1593,6 +1664,7 @@ def initiate_reset_all_codes(election_id):
     store_otp_in_session('reset_all_codes_otp', otp)
     
     send_otp(current_user.email, otp, purpose=f"RESET ALL CODES for '{election.title}'")
+    db.session.commit()
     flash(f'CRITICAL: OTP sent to {current_user.email}. required for bulk reset.', 'warning')
     return redirect(url_for('admin.verify_reset_all_codes_otp'))
 
@@ -1612,14 +1684,10 @@ def verify_reset_all_codes_otp():
             election = Election.query.get(election_id)
             
             if election:
-                import random
-                electors = Elector.query.filter_by(election_id=election.id).all()
-                count = 0
-                for elector in electors:
-                    elector.secret_code = str(random.randint(100000, 999999))
-                    count += 1
-                
+                from secret_codes import regenerate_codes
+                count = regenerate_codes(election.id)
                 db.session.commit()
+                roll_index.invalidate(election.id)
                 flash(f'SUCCESS: Regenerated secret codes for {count} electors.', 'success')
             else:
                  flash('Election not found.', 'error')
@@ -1634,7 +1702,7 @@ def verify_reset_all_codes_otp():
 @admin_bp.route('/admin/update_thread_limit', methods=['POST'])
 @login_required
 def update_email_limit():
-    from utils import update_email_thread_limit
+    from utils import update_email_thread_limit, update_email_rate_limits
     
     if not current_user.can_manage_admins:
         flash('Access denied.', 'error')
@@ -1643,14 +1711,20 @@ def update_email_limit():
     limit = request.form.get('thread_limit')
     try:
         limit = int(limit)
-        if limit < 1:
-            flash('Limit must be at least 1.', 'error')
+        per_minute = request.form.get('per_minute', type=int)
+        per_day = request.form.get('per_day', type=int)
+        # An empty or zero daily budget means no daily cap.
+        if limit < 1 or (per_minute is not None and per_minute < 1) or (per_day is not None and per_day < 0):
+            flash('Limits must be at least 1.', 'error')
         else:
-            if update_email_thread_limit(limit):
-                flash(f'Email thread limit updated to {limit}.', 'success')
+            ok = update_email_thread_limit(limit)
+            if per_minute:
+                ok = update_email_rate_limits(per_minute, per_day) and ok
+            if ok:
+                flash(f'Email limits updated: up to {limit} concurrent sends.', 'success')
             else:
                 flash('Failed to update thread limit check server logs.', 'error')
-    except ValueError:
+    except (TypeError, ValueError):
        flash('Invalid limit value.', 'error')
        
     return redirect(url_for('admin.manage_admins'))
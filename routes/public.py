@@ -1,12 +1,26 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app, abort, send_file, send_from_directory
 from models import db, Election, Candidate
 from werkzeug.utils import secure_filename
 import os
 from datetime import datetime
-from utils import send_otp, store_otp_in_session, verify_otp_in_session, get_ist_now
+from utils import send_otp, get_ist_now
+from rate_limit import rate_limited, client_ip
+from roll_index import roll_index
+from realtime import feed
+import static_export
 
 public_bp = Blueprint('public', __name__)
 
+def _form_value(field):
+    def key(**view_args):
+        value = (request.form.get(field) or '').strip().lower()
+        return f"{view_args.get('election_id')}:{value}" if value else None
+    return key
+
+def _secret_login_limited(retry_after, election_id):
+    flash(f'Too many login attempts. Please try again in {retry_after} seconds.', 'error')
+    return render_template('public/secret_login.html', election=Election.query.get_or_404(election_id))
+
 @public_bp.route('/')
 def index():
 
@@ -15,6 +29,10 @@ def index():
 
 @public_bp.route('/election/<int:election_id>')
 def election_details(election_id):
+    exported = _exported_page(election_id, 'details')
+    if exported is not None:
+        return exported
+
     election = Election.query.get_or_404(election_id)
     if election.status == 'draft':
         flash('This election is not public.', 'error')
@@ -90,10 +108,9 @@ def nominate(election_id):
 
 @public_bp.route('/vote/<int:election_id>/login', methods=['GET', 'POST'])
 def vote_login(election_id):
-    from models import Elector
     from flask import session
-    from firebase_admin import auth
-    from utils import verify_otp_in_session
+    from firebase_setup import verify_id_token
+    import otp_store
     
     election = Election.query.get_or_404(election_id)
     now = get_ist_now()
@@ -111,14 +128,15 @@ def vote_login(election_id):
                 return redirect(url_for('public.vote_login', election_id=election_id))
 
             try:
-                decoded_token = auth.verify_id_token(id_token)
+                decoded_token = verify_id_token(id_token)
                 phone_number = decoded_token.get('phone_number')
                 
                 if not phone_number:
                     flash('Could not retrieve phone number from authentication.', 'error')
                     return redirect(url_for('public.vote_login', election_id=election_id))
                     
-                elector = Elector.query.filter_by(election_id=election_id, phone=phone_number).first()
+                # Confirmed against the database: the index may be behind another worker's changes.
+                elector = roll_index.confirm(election_id, roll_index.by_phone(election_id, phone_number))
                 
                 if not elector:
                     flash(f'Phone {phone_number} is not registered for this election.', 'error')
@@ -146,12 +164,11 @@ def vote_login(election_id):
         otp = request.form.get('otp')
         
         if email and otp:
-            # First verify OTP using session helper
-            key = f"elector_otp_{email}"
-            is_valid, msg = verify_otp_in_session(key, otp)
+            # OTPs are keyed by election and email, so any worker can verify them
+            is_valid, msg = otp_store.verify(otp_store.elector_identity(election_id, email), otp)
             
             if is_valid:
-                elector = Elector.query.filter_by(election_id=election_id, email=email).first()
+                elector = roll_index.confirm(election_id, roll_index.by_email(election_id, email))
                 if not elector:
                      flash('Email not found in voter list.', 'error')
                      return redirect(url_for('public.vote_login', election_id=election_id))
@@ -176,32 +193,33 @@ def vote_login(election_id):
     return render_template('public/login.html', election=election)
 
 @public_bp.route('/vote/<int:election_id>/send_otp', methods=['POST'])
+@rate_limited(('otp_per_email', _form_value('email')), ('otp_per_ip', lambda **_: client_ip()))
 def send_login_otp(election_id):
-    from models import Elector
-    from utils import send_otp, store_otp_in_session
+    from utils import send_otp
+    import otp_store
     import random
     
     email = request.form.get('email')
     if not email:
         return {'success': False, 'message': 'Email is required'}, 400
         
-    elector = Elector.query.filter_by(election_id=election_id, email=email).first()
-    if not elector:
+    if not roll_index.by_email(election_id, email):
         return {'success': False, 'message': 'Email not registered for this election'}, 404
         
     otp = str(random.randint(100000, 999999))
 
-    key = f"elector_otp_{email}"
-    store_otp_in_session(key, otp)
+    otp_store.issue(otp_store.elector_identity(election_id, email), otp)
     
-    if send_otp(email, otp, purpose=f"Login for {elector.election.title}"):
+    election = Election.query.get_or_404(election_id)
+    if send_otp(email, otp, purpose=f"Login for {election.title}"):
+        db.session.commit()
         return {'success': True, 'message': 'OTP sent successfully'}
     else:
         return {'success': False, 'message': 'Failed to send OTP'}, 500
 
 @public_bp.route('/vote/<int:election_id>/check_phone', methods=['POST'])
+@rate_limited(('check_phone_per_ip', lambda **_: client_ip()))
 def check_phone(election_id):
-    from models import Elector
     
     phone = request.json.get('phone')
     if not phone:
@@ -209,7 +227,7 @@ def check_phone(election_id):
         
 
     
-    elector = Elector.query.filter_by(election_id=election_id, phone=phone).first()
+    elector = roll_index.by_phone(election_id, phone)
     
     if elector:
         if elector.status != 'approved':
@@ -222,8 +240,10 @@ def check_phone(election_id):
         return {'exists': False, 'message': 'Phone number not found in voter list.'}
 
 @public_bp.route('/vote/<int:election_id>/secret_login', methods=['GET', 'POST'])
+@rate_limited(('secret_login_per_ip', lambda **_: client_ip()),
+              ('secret_login_per_identifier', _form_value('identifier')),
+              on_limited=_secret_login_limited)
 def secret_vote_login(election_id):
-    from models import Elector
     from flask import session
     
     election = Election.query.get_or_404(election_id)
@@ -244,16 +264,9 @@ def secret_vote_login(election_id):
             return render_template('public/secret_login.html', election=election)
             
 
-        elector = None
-        elector_phone = Elector.query.filter_by(election_id=election_id, phone=identifier, name=name, secret_code=code).first()
-        if elector_phone and (election.allow_phone_voting or elector_phone.phone): 
-            elector = elector_phone
-        else:
-            elector_email = Elector.query.filter_by(election_id=election_id, email=identifier, name=name, secret_code=code).first()
-            if elector_email:
-                elector = elector_email
+        elector = roll_index.match_secret(election_id, identifier, name, code)
         
-        if elector:
+        if elector and elector.status == 'approved':
              if elector.has_voted:
                     flash('You have already voted.', 'warning')
                     return redirect(url_for('public.index'))
@@ -278,7 +291,7 @@ def ballot(election_id):
         return redirect(url_for('public.vote_login', election_id=election_id))
     
     elector = Elector.query.get(elector_id)
-    if not elector or elector.election_id != election_id:
+    if not elector or elector.election_id != election_id or elector.status != 'approved':
         session.pop('voter_elector_id', None)
         return redirect(url_for('public.vote_login', election_id=election_id))
         
@@ -287,22 +300,51 @@ def ballot(election_id):
         return redirect(url_for('public.index'))
         
     if request.method == 'POST':
-        candidate_id = request.form.get('candidate_id')
+        candidate_id = request.form.get('candidate_id', type=int)
         if candidate_id:
+            from sqlalchemy import update
+            from sqlalchemy.exc import IntegrityError
+            from tally import record_vote
+
+            # Only an approved (or NOTA) candidate of this election can receive the vote.
+            on_ballot = db.session.query(Candidate.id).filter(
+                Candidate.id == candidate_id, Candidate.election_id == election_id,
+                Candidate.status.in_(('approved', 'nota'))).first()
+            if on_ballot is None:
+                flash('Please select a candidate from the ballot.', 'error')
+                return redirect(url_for('public.ballot', election_id=election_id))
 
-            vote = Vote(election_id=election_id, candidate_id=candidate_id, elector_id=elector_id)
-            elector.has_voted = True
-            elector.has_voted = True
+            # Claim the ballot atomically: only one request can flip has_voted for this elector.
+            claimed = db.session.execute(
+                update(Elector)
+                .where(Elector.id == elector_id, Elector.has_voted == False)
+                .values(has_voted=True)
+            ).rowcount
+            if claimed != 1:
+                db.session.rollback()
+                flash('You have already voted.', 'warning')
+                return redirect(url_for('public.index'))
 
-            
+            vote = Vote(election_id=election_id, candidate_id=candidate_id, elector_id=elector_id)
             db.session.add(vote)
+            try:
+                db.session.flush()
+            except IntegrityError:
+                # uq_vote_election_elector: a vote for this elector already exists
+                db.session.rollback()
+                flash('You have already voted.', 'warning')
+                return redirect(url_for('public.index'))
+            record_vote(election_id, candidate_id)
             
             # Check for revote link usage
+            revote_completed = False
+            closed_election = None
             if 'revote_link_id' in session:
                 from models import RevoteLink
                 link = RevoteLink.query.get(session['revote_link_id'])
                 if link:
                     link.is_used = True
+                    revote_completed = True
                     # Auto-Complete Election if this was the last pending revote
                     pending_count = RevoteLink.query.filter_by(election_id=link.election_id, is_used=False).count()
                     if pending_count == 0:
@@ -310,14 +352,26 @@ def ballot(election_id):
                         if election.status == 'hold':
                             election.status = 'completed'
                             election.show_results = False # Revert to 'Results Pending' for final Admin verification
-                            
-                            # Send report and cleanup (Super Admin only since no specific admin triggered this)
-                            from utils import send_revote_report_and_cleanup
-                            send_revote_report_and_cleanup(election)
+                            import snapshots
+                            snapshots.discard(election.id)
+                            static_export.remove(election.id)
+                            closed_election = election
                 
                 session.pop('revote_link_id', None)
 
             db.session.commit()
+            if closed_election is not None:
+                # The vote is committed first: nothing in the report can undo it.
+                # Report and cleanup go to Super Admins only, since no specific admin triggered this.
+                from utils import send_revote_report_and_cleanup
+                try:
+                    send_revote_report_and_cleanup(closed_election)
+                    db.session.commit()
+                except Exception as e:
+                    print(f"Revote report for election {closed_election.id} failed: {e}")
+                    db.session.rollback()
+            roll_index.mark_voted(election_id, elector_id)
+            feed.publish(election_id, voted=1, revotes_used=int(revote_completed))
             
             session.pop('voter_elector_id', None)
             
@@ -336,44 +390,87 @@ def ballot(election_id):
     election = Election.query.get(election_id)
     return render_template('public/ballot.html', election=election, candidates=candidates, nota=nota_candidate)
 
+def _can_serve_export():
+    """Pre-rendered pages are anonymous and flash-free, so only serve them when that is what would be rendered."""
+    from flask import session
+    from flask_login import current_user
+    return not current_user.is_authenticated and '_flashes' not in session
+
+
+def _exported_page(election_id, page):
+    """Returns the exported copy of page if results are released and exported, else None."""
+    from models import ResultSnapshot
+    if not _can_serve_export():
+        return None
+    snapshot = db.session.get(ResultSnapshot, election_id)
+    path = static_export.exported_path(election_id, snapshot.etag, page) if snapshot else None
+    if path is None:
+        return None
+    return send_file(path, max_age=0)
+
+
+@public_bp.route('/released/<int:election_id>/<tag>/<page>.html')
+def released_page(election_id, tag, page):
+    """Serves an exported page under its content-addressed path; these never change, so cache them for a year."""
+    if page not in static_export.PAGES:
+        abort(404)
+    response = send_from_directory(static_export.export_root(), f"{election_id}/{tag}/{page}.html",
+                                   max_age=static_export.MAX_AGE)
+    response.cache_control.immutable = True
+    response.cache_control.public = True
+    return response
+
+
 @public_bp.route('/results/<int:election_id>')
 def results(election_id):
-    from models import Vote
-    from sqlalchemy import func
-    
-    election = Election.query.get_or_404(election_id)
-    
-    if not election.show_results or election.end_time > get_ist_now():
-        flash('Results for this election have not been released yet.', 'info')
-        return redirect(url_for('public.index'))
-    
-    results = db.session.query(Candidate, func.count(Vote.id))\
-        .outerjoin(Vote, Candidate.id == Vote.candidate_id)\
-        .filter(Candidate.election_id == election_id, Candidate.status.in_(['approved', 'nota']))\
-        .group_by(Candidate.id).all()
-    
-    results = sorted(results, key=lambda x: x[1], reverse=True)
-    
-    final_results = []
-    current_rank = 0
-    last_count = -1
-    
-    for i, (candidate, count) in enumerate(results):
-        if count != last_count:
-            current_rank = i + 1
-            last_count = count
-        final_results.append((candidate, count, current_rank))
-    results = final_results
-    
-    total_votes = Vote.query.filter_by(election_id=election_id).count()
-    
-    return render_template('public/results.html', election=election, results=results, total_votes=total_votes)
+    from flask import session, make_response
+    from flask_login import current_user
+    from models import ResultSnapshot
+    from sqlalchemy.exc import IntegrityError
+    import snapshots
+
+    snapshot = db.session.get(ResultSnapshot, election_id)
+    if snapshot is None:
+        election = Election.query.get_or_404(election_id)
+        if not election.show_results or election.end_time > get_ist_now():
+            flash('Results for this election have not been released yet.', 'info')
+            return redirect(url_for('public.index'))
+        # Released before snapshots existed (and missed by the startup backfill): freeze and export it now.
+        try:
+            snapshot = snapshots.freeze(election)
+            db.session.commit()
+        except IntegrityError:
+            # Another request froze it first; use theirs.
+            db.session.rollback()
+            snapshot = db.session.get(ResultSnapshot, election_id)
+        else:
+            try:
+                static_export.export(election, snapshot)
+            except OSError as e:
+                print(f"Static export of results for election {election_id} failed: {e}")
+
+    # The page chrome differs for logged-in admins, so they get their own tag.
+    etag = f"{snapshot.etag}-{'admin' if current_user.is_authenticated else 'public'}"
+    exported = static_export.exported_path(election_id, snapshot.etag, 'results') if _can_serve_export() else None
+    if '_flashes' not in session and request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    elif exported:
+        response = send_file(exported, etag=False)
+    else:
+        data = snapshots.data(snapshot)
+        response = make_response(render_template('public/results.html', title=data['title'], results=data['results'],
+                                                 total_votes=data['total_votes']))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Cookie')
+    return response
     
 @public_bp.route('/election/<int:election_id>/request_access', methods=['GET', 'POST'])
 def request_access(election_id):
     from models import Elector, Admin
-    from utils import send_notification_email
-    import secrets
+    from utils import send_shared_email
+    from secret_codes import assign_code
+    from access_digest import digest
 
     election = Election.query.get_or_404(election_id)
     
@@ -413,24 +510,27 @@ def request_access(election_id):
             email=email if email else None,
             phone=phone if phone else None,
             status='pending',
-            secret_code=secrets.token_hex(3).upper()
+            # In digest mode admins hear about the request in the next digest instead of right away.
+            notified_at=None if digest.enabled else get_ist_now()
         )
-        db.session.add(new_elector)
+        assign_code(new_elector)
         db.session.commit()
+        roll_index.refresh(new_elector)
+        feed.publish(election_id, pending_requests=1, electors=1)
         
 
-        admins = Admin.query.all()
-        for admin in admins:
-            if admin.email:
-                subject = f"New Access Request: {election.title}"
-                body = f"""
-                <p>A new user has requested access to the election: <strong>{election.title}</strong>.</p>
-                <p><strong>Name:</strong> {name}<br>
-                <strong>Email:</strong> {email}<br>
-                <strong>Phone:</strong> {phone}</p>
-                <p>Please log in to the admin dashboard to approve or reject this request.</p>
-                """
-                send_notification_email(admin.email, subject, body)
+        if not digest.enabled:
+            subject = f"New Access Request: {election.title}"
+            body = f"""
+            <p>A new user has requested access to the election: <strong>{election.title}</strong>.</p>
+            <p><strong>Name:</strong> {name}<br>
+            <strong>Email:</strong> {email}<br>
+            <strong>Phone:</strong> {phone}</p>
+            <p>Please log in to the admin dashboard to approve or reject this request.</p>
+            """
+            recipients = [email for (email,) in db.session.query(Admin.email)]
+            send_shared_email(recipients, subject, body, is_html=True, key=f"access-request:{new_elector.id}")
+            db.session.commit()
         
         flash('Your request has been submitted successfully. You will be notified via email once approved.', 'success')
         return redirect(url_for('public.election_details', election_id=election_id))
@@ -0,0 +1,146 @@
+"""Secret voting codes: 6-digit codes drawn with `secrets`, unique per election.
+
+The uq_elector_election_code index enforces uniqueness; the helpers here only
+try to avoid hitting it. CodeAllocator keeps a one-byte-per-code map of the
+900,000 possible codes (under 1 MB whatever the roll size) and hands out
+unused ones, so bulk callers never need a database round trip per code.
+regenerate_codes() walks the roll by id in chunks and writes the new codes
+with executemany UPDATEs, keeping memory bounded for very large rolls; codes
+still held by electors not yet updated stay reserved, so no UPDATE collides.
+
+new_code() is for single electors (manual add, access requests, one-off
+resets): it checks candidates against the unique index. Two requests can
+still draw the same code at once, so assign_code() writes it in a savepoint
+and draws again if the insert loses that race.
+"""
+import secrets
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, Elector
+
+CODE_MIN = 100000
+CODE_SPACE = 900000
+UPDATE_CHUNK = 5000
+MAX_ATTEMPTS = 20
+# Times a write is retried with fresh codes after losing a race for one.
+CONFLICT_RETRIES = 3
+
+
+def _index(code):
+    try:
+        value = int(code) - CODE_MIN
+    except (TypeError, ValueError):
+        return None
+    return value if 0 <= value < CODE_SPACE else None
+
+
+class CodeAllocator:
+    """Hands out codes not yet used in one election."""
+
+    def __init__(self, taken=()):
+        self._used = bytearray(CODE_SPACE)
+        self.available = CODE_SPACE
+        for code in taken:
+            self.reserve(code)
+
+    @classmethod
+    def for_election(cls, election_id):
+        """An allocator that avoids every code already on the election's roll."""
+        query = db.session.query(Elector.secret_code)\
+            .filter(Elector.election_id == election_id)\
+            .execution_options(yield_per=5000)
+        return cls(code for (code,) in query)
+
+    def reserve(self, code):
+        i = _index(code)
+        if i is not None and not self._used[i]:
+            self._used[i] = 1
+            self.available -= 1
+
+    def release(self, code):
+        i = _index(code)
+        if i is not None and self._used[i]:
+            self._used[i] = 0
+            self.available += 1
+
+    def next(self):
+        if not self.available:
+            raise ValueError('All secret codes for this election are in use.')
+        for _ in range(MAX_ATTEMPTS):
+            i = secrets.randbelow(CODE_SPACE)
+            if not self._used[i]:
+                break
+        else:
+            # Nearly saturated: take the first free code after a random point.
+            start = secrets.randbelow(CODE_SPACE)
+            i = self._used.find(0, start)
+            if i == -1:
+                i = self._used.find(0)
+        self._used[i] = 1
+        self.available -= 1
+        return str(CODE_MIN + i)
+
+    def take(self, count):
+        return [self.next() for _ in range(count)]
+
+
+def new_code(election_id):
+    """Returns a code not used by any elector of the election."""
+    for _ in range(MAX_ATTEMPTS):
+        code = str(CODE_MIN + secrets.randbelow(CODE_SPACE))
+        exists = db.session.query(Elector.id)\
+            .filter(Elector.election_id == election_id, Elector.secret_code == code).first()
+        if exists is None:
+            return code
+    # The roll is nearly saturated; fall back to an exhaustive pick.
+    return CodeAllocator.for_election(election_id).next()
+
+
+def taken_codes(election_id, codes):
+    """The subset of codes already held by an elector of the election."""
+    return set(db.session.execute(
+        select(Elector.secret_code).where(Elector.election_id == election_id, Elector.secret_code.in_(list(codes)))
+    ).scalars())
+
+
+def assign_code(elector):
+    """Gives the elector a new code and flushes it (adding the elector if new); the caller commits.
+
+    Retries with another code if a concurrent request committed the same one first.
+    """
+    for attempt in range(CONFLICT_RETRIES):
+        code = new_code(elector.election_id)
+        try:
+            with db.session.begin_nested():
+                elector.secret_code = code
+                db.session.add(elector)
+        except IntegrityError:
+            # Only a lost race for the code is retried; duplicate phones or emails are the caller's to report.
+            if attempt == CONFLICT_RETRIES - 1 or not taken_codes(elector.election_id, [code]):
+                raise
+        else:
+            return elector
+
+
+def regenerate_codes(election_id, chunk_size=UPDATE_CHUNK):
+    """Gives every elector of the election a fresh unique code. Returns the number updated; the caller commits."""
+    # Every current code starts reserved and is released once its elector has been updated.
+    allocator = CodeAllocator.for_election(election_id)
+    table = Elector.__table__
+    stmt = update(table).where(table.c.id == bindparam('elector_id')).values(secret_code=bindparam('code'))
+    updated = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Elector.id, Elector.secret_code).where(Elector.election_id == election_id, Elector.id > last_id)
+            .order_by(Elector.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return updated
+        codes = allocator.take(len(rows))
+        # Core executemany on the session's connection; skips per-row ORM bookkeeping.
+        db.session.connection().execute(stmt, [{'elector_id': row.id, 'code': c} for row, c in zip(rows, codes)])
+        for row in rows:
+            allocator.release(row.secret_code)
+        updated += len(rows)
+        last_id = rows[-1].id
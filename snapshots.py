@@ -0,0 +1,53 @@
+"""Result snapshots frozen at release time.
+
+Released results never change, so perform_release_results() serializes the
+ranked rows, totals and turnout into one ResultSnapshot row keyed by
+election_id. public.results then serves every request from a single
+primary-key read, with a strong ETag derived from the payload so repeat
+visits are answered with 304 Not Modified. Anything that unpublishes results
+calls discard() so the next release freezes a fresh snapshot.
+"""
+import hashlib
+import json
+from models import db, Elector, ResultSnapshot
+
+
+def build_payload(election):
+    from tally import ranked_results, total_votes
+    total = total_votes(election.id)
+    approved = Elector.query.filter_by(election_id=election.id, status='approved').count()
+    return {
+        'title': election.title,
+        'total_votes': total,
+        'approved_electors': approved,
+        'turnout': round(total / approved * 100, 1) if approved else 0,
+        'results': [
+            {'name': candidate.name, 'votes': votes, 'rank': rank,
+             'percent': round(votes / total * 100, 2) if total else 0}
+            for candidate, votes, rank in ranked_results(election.id)
+        ],
+    }
+
+
+def freeze(election):
+    """Stores (or replaces) the election's snapshot from the current tallies. The caller commits."""
+    payload = json.dumps(build_payload(election), separators=(',', ':'), sort_keys=True)
+    etag = hashlib.sha256(payload.encode()).hexdigest()[:32]
+    snapshot = db.session.get(ResultSnapshot, election.id)
+    if snapshot is None:
+        snapshot = ResultSnapshot(election_id=election.id, version=1)
+        db.session.add(snapshot)
+    elif snapshot.etag != etag:
+        snapshot.version += 1
+    snapshot.etag = etag
+    snapshot.payload = payload
+    return snapshot
+
+
+def discard(election_id):
+    """Drops the snapshot when results are unpublished. The caller commits."""
+    ResultSnapshot.query.filter_by(election_id=election_id).delete(synchronize_session=False)
+
+
+def data(snapshot):
+    return json.loads(snapshot.payload)
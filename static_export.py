@@ -0,0 +1,114 @@
+"""Static HTML export of released results.
+
+Once results are released the public results and election details pages are
+the same for every anonymous visitor, so they are rendered once into
+static/released/<election_id>/<page hash>/<page>.html and served from disk
+from then on. Each page is named after the hash of its own rendered HTML, so
+a path never changes content: /released/... is served by Flask with a
+one-year immutable Cache-Control, and a reverse proxy or CDN can serve
+static/released/ directly without Python. manifest.json records the current
+hash of each page and the result snapshot they were rendered from.
+
+The details page can still change after release (candidates approved or
+rejected, visibility toggled); those routes call reexport(), which writes
+the new page under its new hash. Unpublishing results (edit_election,
+revote completion, deletion) removes the export; releasing again writes a
+new one.
+"""
+import hashlib
+import json
+import os
+import shutil
+from flask import current_app, render_template
+
+EXPORT_DIR = 'released'
+PAGES = ('results', 'details')
+MAX_AGE = 365 * 24 * 3600
+
+
+def export_root():
+    return os.path.join(current_app.static_folder, EXPORT_DIR)
+
+
+def page_path(election_id, tag, page):
+    return os.path.join(export_root(), str(election_id), tag, f"{page}.html")
+
+
+def manifest_path(election_id):
+    return os.path.join(export_root(), str(election_id), 'manifest.json')
+
+
+def _manifest(election_id):
+    try:
+        with open(manifest_path(election_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def exported_path(election_id, snapshot_etag, page):
+    """Path of the exported page if it was rendered from this snapshot, else None."""
+    manifest = _manifest(election_id)
+    if not manifest or manifest.get('snapshot') != snapshot_etag or page not in manifest.get('pages', {}):
+        return None
+    path = page_path(election_id, manifest['pages'][page], page)
+    return path if os.path.exists(path) else None
+
+
+def is_exported(election_id, snapshot_etag):
+    return exported_path(election_id, snapshot_etag, 'results') is not None
+
+
+def export(election, snapshot):
+    """Renders the public pages for the snapshot and drops older exports of this election."""
+    from flask_login import AnonymousUserMixin
+    from models import Candidate
+    import snapshots
+
+    data = snapshots.data(snapshot)
+    candidates = Candidate.query.filter_by(election_id=election.id, status='approved').all()
+    # A fresh request context: no admin session or pending flashes may leak into the public pages.
+    with current_app.test_request_context('/'):
+        anonymous = AnonymousUserMixin()
+        pages = {
+            'results': render_template('public/results.html', title=data['title'], results=data['results'],
+                                       total_votes=data['total_votes'], current_user=anonymous),
+            'details': render_template('public/election_details.html', election=election, candidates=candidates,
+                                       current_user=anonymous),
+        }
+
+    tags = {}
+    for page, html in pages.items():
+        tag = tags[page] = hashlib.sha256(html.encode('utf-8')).hexdigest()[:32]
+        path = page_path(election.id, tag, page)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(path + '.tmp', path)
+
+    manifest = manifest_path(election.id)
+    with open(manifest + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'snapshot': snapshot.etag, 'pages': tags}, f)
+    os.replace(manifest + '.tmp', manifest)
+
+    election_dir = os.path.dirname(manifest)
+    for name in os.listdir(election_dir):
+        if name not in tags.values() and os.path.isdir(os.path.join(election_dir, name)):
+            shutil.rmtree(os.path.join(election_dir, name), ignore_errors=True)
+
+
+def reexport(election):
+    """Re-renders a released election's pages after something they show changed (candidates, visibility)."""
+    from models import db, ResultSnapshot
+
+    snapshot = db.session.get(ResultSnapshot, election.id)
+    if snapshot is None:
+        return
+    try:
+        export(election, snapshot)
+    except OSError as e:
+        print(f"Static export of results for election {election.id} failed: {e}")
+
+
+def remove(election_id):
+    shutil.rmtree(os.path.join(export_root(), str(election_id)), ignore_errors=True)
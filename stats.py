@@ -0,0 +1,56 @@
+"""Per-election aggregate counts for the admin dashboard and manage page.
+
+election_stats() answers turnout, pending access requests, pending
+nominations and revote progress for any number of elections in one
+statement: electors, candidates and revote links are each grouped by
+election_id once (served from their election_id/status indexes) and
+outer-joined to Election, so the cost does not grow with the number of
+elections shown.
+"""
+from sqlalchemy import case, func
+from models import db, Election, Elector, Candidate, RevoteLink
+
+
+def _count_if(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def _grouped(model, election_ids, **counts):
+    columns = [expr.label(name) for name, expr in counts.items()]
+    query = db.session.query(model.election_id.label('election_id'), *columns)
+    if election_ids is not None:
+        query = query.filter(model.election_id.in_(election_ids))
+    return query.group_by(model.election_id).subquery()
+
+
+def election_stats(election_ids=None):
+    """Returns {election_id: {electors, approved, pending_requests, rejected, voted, turnout, nominations,
+    pending_nominations, revote_links, revotes_used}} for the given elections (default: all)."""
+    electors = _grouped(Elector, election_ids,
+                        electors=func.count(),
+                        approved=_count_if(Elector.status == 'approved'),
+                        pending_requests=_count_if(Elector.status == 'pending'),
+                        rejected=_count_if(Elector.status == 'rejected'),
+                        voted=_count_if(Elector.has_voted.is_(True)))
+    candidates = _grouped(Candidate, election_ids,
+                          nominations=_count_if(Candidate.status != 'nota'),
+                          pending_nominations=_count_if(Candidate.status == 'pending'))
+    links = _grouped(RevoteLink, election_ids,
+                     revote_links=func.count(),
+                     revotes_used=_count_if(RevoteLink.is_used.is_(True)))
+
+    columns = [func.coalesce(column, 0).label(column.key)
+               for subquery in (electors, candidates, links) for column in subquery.c if column.key != 'election_id']
+    query = db.session.query(Election.id, *columns)\
+        .outerjoin(electors, electors.c.election_id == Election.id)\
+        .outerjoin(candidates, candidates.c.election_id == Election.id)\
+        .outerjoin(links, links.c.election_id == Election.id)
+    if election_ids is not None:
+        query = query.filter(Election.id.in_(election_ids))
+
+    stats = {}
+    for row in query:
+        item = {column.key: int(getattr(row, column.key)) for column in columns}
+        item['turnout'] = round(item['voted'] / item['approved'] * 100, 1) if item['approved'] else 0
+        stats[row.id] = item
+    return stats
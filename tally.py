@@ -0,0 +1,130 @@
+"""Materialized vote counters.
+
+CandidateTally and ElectionTally hold running totals that are changed in the
+same transaction as the Vote rows they describe, so results pages and release
+reports read O(candidates) rows instead of aggregating the vote table.
+reconcile() rebuilds them from Vote and reports any drift.
+"""
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from models import db, Candidate, Vote, CandidateTally, ElectionTally
+
+
+def _bump(model, key, column, delta):
+    """Adds delta to model.column for the row matching every value in key, creating the row if needed."""
+    col = getattr(model, column)
+    # Match on all of key, not just the primary key, so a candidate id from another election never moves its tally.
+    conditions = [getattr(model, name) == value for name, value in key.items()]
+    if db.session.execute(update(model).where(*conditions).values({column: col + delta})).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **{column: delta}))
+    except IntegrityError:
+        # Another transaction created the row first, or the key belongs to a row of another election.
+        if not db.session.execute(update(model).where(*conditions).values({column: col + delta})).rowcount:
+            raise ValueError(f"No {model.__name__} row matches {key}")
+
+
+def record_vote(election_id, candidate_id):
+    """Counts one new vote. Call inside the transaction that inserts the Vote."""
+    if candidate_id is not None:
+        _bump(CandidateTally, {'candidate_id': int(candidate_id), 'election_id': election_id}, 'votes', 1)
+    _bump(ElectionTally, {'election_id': election_id}, 'votes_cast', 1)
+
+
+def delete_votes(election_id, elector_ids):
+    """Deletes the votes of the given electors and takes them off the counters. Returns the number deleted.
+
+    elector_ids is a list of ids or a SELECT of elector ids (for set-based purges).
+    """
+    if isinstance(elector_ids, (list, tuple, set)) and not elector_ids:
+        return 0
+    scope = Vote.query.filter(Vote.election_id == election_id, Vote.elector_id.in_(elector_ids))
+    per_candidate = db.session.query(Vote.candidate_id, func.count(Vote.id))\
+        .filter(Vote.election_id == election_id, Vote.elector_id.in_(elector_ids))\
+        .group_by(Vote.candidate_id).all()
+
+    removed = 0
+    for candidate_id, count in per_candidate:
+        if candidate_id is not None:
+            _bump(CandidateTally, {'candidate_id': candidate_id, 'election_id': election_id}, 'votes', -count)
+        removed += count
+
+    if removed:
+        _bump(ElectionTally, {'election_id': election_id}, 'votes_cast', -removed)
+        scope.delete(synchronize_session=False)
+    return removed
+
+
+def total_votes(election_id):
+    tally = db.session.get(ElectionTally, election_id)
+    return tally.votes_cast if tally else 0
+
+
+def ranked_results(election_id, statuses=('approved', 'nota')):
+    """Returns [(candidate, votes, rank)] ordered by votes, with tied candidates sharing a rank."""
+    votes = func.coalesce(CandidateTally.votes, 0)
+    query = db.session.query(Candidate, votes)\
+        .outerjoin(CandidateTally, CandidateTally.candidate_id == Candidate.id)\
+        .filter(Candidate.election_id == election_id)
+    if statuses:
+        query = query.filter(Candidate.status.in_(statuses))
+    rows = query.order_by(votes.desc(), Candidate.id).all()
+
+    results = []
+    current_rank = 0
+    last_count = -1
+    for i, (candidate, count) in enumerate(rows):
+        if count != last_count:
+            current_rank = i + 1
+            last_count = count
+        results.append((candidate, count, current_rank))
+    return results
+
+
+def reconcile(election_id=None):
+    """Rebuilds the counters from Vote. Returns a list of drift entries (what was stored vs. actual)."""
+    candidate_query = db.session.query(Candidate.id, Candidate.election_id, func.count(Vote.id))\
+        .outerjoin(Vote, Vote.candidate_id == Candidate.id)
+    total_query = db.session.query(Vote.election_id, func.count(Vote.id))
+    if election_id is not None:
+        candidate_query = candidate_query.filter(Candidate.election_id == election_id)
+        total_query = total_query.filter(Vote.election_id == election_id)
+
+    drift = []
+
+    stored = {t.candidate_id: t for t in _scoped(CandidateTally, election_id)}
+    for candidate_id, cand_election_id, actual in candidate_query.group_by(Candidate.id).all():
+        tally = stored.get(candidate_id)
+        if tally is None:
+            tally = CandidateTally(candidate_id=candidate_id, election_id=cand_election_id, votes=0)
+            db.session.add(tally)
+        if tally.votes != actual:
+            drift.append({'election_id': cand_election_id, 'candidate_id': candidate_id, 'stored': tally.votes, 'actual': actual})
+            tally.votes = actual
+
+    actual_totals = dict(total_query.group_by(Vote.election_id).all())
+    stored_totals = {t.election_id: t for t in _scoped(ElectionTally, election_id)}
+    election_ids = set(actual_totals) | set(stored_totals)
+    if election_id is not None:
+        election_ids.add(election_id)
+    for eid in election_ids:
+        actual = actual_totals.get(eid, 0)
+        tally = stored_totals.get(eid)
+        if tally is None:
+            tally = ElectionTally(election_id=eid, votes_cast=0)
+            db.session.add(tally)
+        if tally.votes_cast != actual:
+            drift.append({'election_id': eid, 'candidate_id': None, 'stored': tally.votes_cast, 'actual': actual})
+            tally.votes_cast = actual
+
+    db.session.commit()
+    return drift
+
+
+def _scoped(model, election_id):
+    query = model.query
+    if election_id is not None:
+        query = query.filter(model.election_id == election_id)
+    return query.all()
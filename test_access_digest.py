@@ -0,0 +1,113 @@
+from datetime import timedelta
+from unittest import mock
+import pytest
+from models import db, Admin, Elector, OutboxEmail
+from access_digest import digest
+import access_digest
+from email_limiter import limiter
+import outbox
+import utils
+
+def request_access(client, election_id, i):
+    return client.post(f'/election/{election_id}/request_access',
+                       data={'name': f'Requester {i}', 'email': f'req{i}@example.com', 'phone': ''})
+
+def test_access_request_digest(app, client, running_election):
+    election, candidate, elector = running_election
+    admins = Admin.query.count()
+
+    print("1. Access requests queue no email while digests are on")
+    assert digest.enabled
+    for i in range(3):
+        assert request_access(client, election.id, i).status_code == 302
+    assert OutboxEmail.query.count() == 0
+
+    print("2. One digest per window goes to every admin, encoded once")
+    assert digest.run_once() == 3
+    rows = OutboxEmail.query.all()
+    assert len(rows) == admins and len({r.payload_id for r in rows}) == 1
+    assert rows[0].subject == '3 new access requests pending approval'
+    assert digest.run_once() == 0
+
+    print("3. Requests handled before the window closes are not reported")
+    request_access(client, election.id, 3)
+    Elector.query.filter_by(email='req3@example.com').update({'status': 'approved'})
+    db.session.commit()
+    assert digest.run_once() == 0
+
+    print("4. A request claimed by another worker is not reported twice")
+    request_access(client, election.id, 4)
+    now = utils.get_ist_now()
+    assert len(digest.claim(now)) == 1
+    assert digest.claim(now) == []
+    db.session.rollback()
+
+    print("5. With digests off, each request is announced right away")
+    digest.window_seconds = 0
+    try:
+        request_access(client, election.id, 5)
+    finally:
+        digest.window_seconds = 300
+    assert OutboxEmail.query.count() == 2 * admins
+    assert Elector.query.filter_by(email='req5@example.com').one().notified_at is not None
+    assert digest.run_once() == 1  # only req4, whose claim above was rolled back
+
+    print("6. OTPs go through the priority lane, ahead of bulk mail")
+    limiter.configure(max_concurrency=4, per_minute=6)
+    outbox.dispatcher.reserve = 5
+    utils.send_bulk_emails([{'to_email': f'bulk{i}@example.com', 'subject': 'S', 'body': 'B'} for i in range(10)])
+    utils.send_otp('admin@example.com', '123456', purpose='Login')
+    with mock.patch.object(utils, 'deliver_email') as deliver:
+        assert outbox.priority_dispatcher.dispatch_once() == 1
+    assert deliver.call_args.args[0] == 'admin@example.com'
+    otp = OutboxEmail.query.filter_by(to_email='admin@example.com').one()
+    assert otp.priority == outbox.PRIORITY_HIGH and otp.status == 'sent'
+
+    print("7. Bulk mail leaves the per-minute reserve for the priority lane")
+    with mock.patch.object(utils, 'deliver_email'), \
+            mock.patch.object(utils, 'deliver_email_batch',
+                              side_effect=lambda messages, token_path: {m[0]: None for m in messages}):
+        # The budget is counted from the outbox table, so it is shared by every worker.
+        assert outbox.sent_in_last_minute() == 1
+        assert outbox.dispatcher.dispatch_once() == 0  # the OTP used one of the six sends
+        otp.sent_at -= timedelta(minutes=2)
+        db.session.commit()
+        assert outbox.dispatcher.dispatch_once() == 1
+    outbox.dispatcher.reserve = 0
+
+    print("8. Bulk mail never uses the daily share kept for OTPs")
+    assert outbox.sent_in_last_day() == 2
+    limiter.configure(max_concurrency=4, per_minute=100, per_day=10)
+    outbox.dispatcher.daily_share = 0.8  # 2 sent + 8 kept back: nothing left for bulk
+    try:
+        with mock.patch.object(utils, 'deliver_email'), \
+                mock.patch.object(utils, 'deliver_email_batch',
+                                  side_effect=lambda messages, token_path: {m[0]: None for m in messages}):
+            assert outbox.dispatcher.dispatch_once() == 0
+            utils.send_otp('admin@example.com', '654321', purpose='Login')
+            assert outbox.priority_dispatcher.dispatch_once() == 1
+    finally:
+        outbox.dispatcher.daily_share = app.config['OUTBOX_PRIORITY_DAILY_SHARE']
+        limiter.configure()
+
+    print("9. Large backlogs are claimed a chunk at a time, skipping rows claimed meanwhile")
+    db.session.add_all([Elector(election_id=election.id, name=f'Bulk {i}', email=f'bulk{i}@example.com',
+                                status='pending', secret_code=str(400000 + i)) for i in range(5)])
+    db.session.commit()
+    bulk_ids = sorted(e.id for e in Elector.query.filter(Elector.email.like('bulk%')))
+    original_update = access_digest.update
+    def claimed_elsewhere(*args):
+        # Another worker reports the third request between this worker's SELECT and its UPDATEs.
+        Elector.query.filter_by(id=bulk_ids[2]).update({'notified_at': utils.get_ist_now() - timedelta(seconds=1)})
+        return original_update(*args)
+    with mock.patch.object(access_digest, 'CLAIM_CHUNK', 2), \
+            mock.patch.object(access_digest, 'update', side_effect=claimed_elsewhere) as update:
+        won = digest.claim(utils.get_ist_now())
+    assert update.call_count == 3
+    assert won == [i for i in bulk_ids if i != bulk_ids[2]]
+    db.session.rollback()
+
+    print("\nSUCCESS: Access request digest tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy import event
+from models import db, Candidate, Elector, Election, RevoteLink
+
+def test_paginated_admin_tables(client, running_election, login):
+    election, candidate, elector = running_election
+    db.session.add_all([Elector(election_id=election.id, name=f'Roll {i}', email=f'roll{i}@example.com', secret_code=str(300000 + i))
+                        for i in range(25)])
+    db.session.add(Elector(election_id=election.id, name='Asking', email='ask@example.com', status='pending', secret_code='222222'))
+    db.session.add(Candidate(election_id=election.id, name='None of the Above', status='nota'))
+    db.session.commit()
+    login(client)
+    url = f'/admin/election/{election.id}/api/electors'
+
+    print("1. Electors are paged by id with a total on the first page")
+    page = client.get(url, query_string={'status': 'approved', 'limit': 10}).json
+    assert page['total'] == 26 and len(page['items']) == 10
+    seen = [item['id'] for item in page['items']]
+    while page['next_after']:
+        page = client.get(url, query_string={'status': 'approved', 'limit': 10, 'after': page['next_after']}).json
+        assert 'total' not in page
+        seen += [item['id'] for item in page['items']]
+    assert seen == sorted(seen) and len(set(seen)) == 26
+
+    print("2. Status filter and search run server-side")
+    pending = client.get(url, query_string={'status': 'pending'}).json
+    assert [item['name'] for item in pending['items']] == ['Asking'] and 'approve_url' in pending['items'][0]
+    found = client.get(url, query_string={'q': 'roll1'}).json
+    assert found['total'] == 11 and found['next_after'] is None
+    assert client.get(url, query_string={'q': '%'}).json['total'] == 0
+
+    print("3. Candidates skip NOTA unless asked for")
+    names = [item['name'] for item in client.get(f'/admin/election/{election.id}/api/candidates').json['items']]
+    assert names == ['Alice']
+
+    print("4. The manage page no longer renders the roll inline")
+    html = client.get(f'/admin/election/{election.id}').get_data(as_text=True)
+    assert 'roll7@example.com' not in html and f'/admin/election/{election.id}/api/electors' in html
+
+    print("\nSUCCESS: Admin table API tests passed.")
+
+def test_dashboard_stats_in_one_query(client, running_election, login):
+    election, candidate, elector = running_election
+    other = Election(title='Other', start_time=election.start_time, end_time=election.end_time,
+                     nomination_start=election.nomination_start, nomination_end=election.nomination_end)
+    db.session.add(other)
+    db.session.commit()
+    elector.has_voted = True
+    db.session.add_all([
+        Elector(election_id=election.id, name='Second', email='second@example.com', secret_code='111111'),
+        Elector(election_id=election.id, name='Asking', email='ask@example.com', status='pending', secret_code='222222'),
+        Candidate(election_id=election.id, name='Bob', status='pending'),
+        Candidate(election_id=election.id, name='None of the Above', status='nota'),
+        RevoteLink(election_id=election.id, elector_id=elector.id, token='tok', is_used=True),
+    ])
+    db.session.commit()
+    login(client)
+
+    print("1. All elections are aggregated by a single statement")
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        page = client.get('/admin/dashboard/stats').json
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    aggregates = [sql for sql in statements if 'GROUP BY' in sql]
+    assert len(aggregates) == 1, statements
+
+    print("2. Counts cover turnout, requests, nominations and revotes")
+    by_id = {e['id']: e for e in page['elections']}
+    assert by_id[election.id]['approved'] == 2 and by_id[election.id]['voted'] == 1
+    assert by_id[election.id]['turnout'] == 50.0
+    assert by_id[election.id]['pending_requests'] == 1 and by_id[election.id]['pending_nominations'] == 1
+    assert by_id[election.id]['nominations'] == 2
+    assert by_id[election.id]['revote_links'] == 1 and by_id[election.id]['revotes_used'] == 1
+    assert by_id[other.id]['electors'] == 0 and by_id[other.id]['turnout'] == 0
+
+    print("3. The dashboard page renders the same figures")
+    html = client.get('/admin/dashboard').get_data(as_text=True)
+    assert '50.0%' in html and 'Access requests: 1' in html
+
+    print("\nSUCCESS: Dashboard stats tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,69 @@
+import time
+from email.utils import formatdate
+from unittest import mock
+import firebase_admin
+import firebase_setup
+
+def test_firebase_token_cache_and_cert_refresh():
+    print("1. Certificate freshness is max-age minus the response's age")
+    now = int(time.time())  # Date headers have whole-second resolution
+    assert firebase_setup._freshness({'cache-control': 'public, max-age=20000'}, now=now) == 20000
+    assert firebase_setup._freshness({'cache-control': 'max-age=20000', 'age': '300'}, now=now) == 19700
+    headers = {'cache-control': 'max-age=20000', 'date': formatdate(now - 1000, usegmt=True)}
+    assert firebase_setup._freshness(headers, now=now) == 19000
+    assert firebase_setup._freshness({'cache-control': 'max-age=100', 'age': '500'}, now=now) == 0
+    assert firebase_setup._freshness({'cache-control': 'no-store'}, now=now) is None
+
+    print("2. Verified tokens are reused until the cache TTL or the token expires")
+    firebase_setup._verified_tokens.clear()
+    claims = {'phone_number': '+911234567890', 'exp': time.time() + 3600}
+    with mock.patch.object(firebase_setup.auth, 'verify_id_token', return_value=claims) as verify:
+        assert firebase_setup.verify_id_token('token-a') == claims
+        assert firebase_setup.verify_id_token('token-a') == claims
+        assert verify.call_count == 1
+        with mock.patch.object(firebase_setup.time, 'time', return_value=time.time() + 301):
+            firebase_setup.verify_id_token('token-a')
+        assert verify.call_count == 2
+
+    expired = {'phone_number': '+911234567890', 'exp': time.time() - 1}
+    with mock.patch.object(firebase_setup.auth, 'verify_id_token', return_value=expired) as verify:
+        firebase_setup.verify_id_token('token-b')
+        firebase_setup.verify_id_token('token-b')
+        assert verify.call_count == 2
+
+    print("3. The cache is bounded")
+    size = firebase_setup._token_cache_size
+    firebase_setup._token_cache_size = 2
+    try:
+        with mock.patch.object(firebase_setup.auth, 'verify_id_token', return_value=claims):
+            for token in ('t1', 't2', 't3'):
+                firebase_setup.verify_id_token(token)
+        assert len(firebase_setup._verified_tokens) == 2
+    finally:
+        firebase_setup._token_cache_size = size
+        firebase_setup._verified_tokens.clear()
+
+    print("4. The refresh chain starts once per process")
+    started = firebase_setup._refresh_started
+    firebase_setup._refresh_started = False
+    try:
+        with mock.patch.object(firebase_setup, '_refresh_certs') as refresh:
+            assert firebase_setup.start_cert_refresh() is True
+            assert firebase_setup.start_cert_refresh() is False
+            time.sleep(0.1)
+        assert refresh.call_count == 1
+    finally:
+        firebase_setup._refresh_started = started
+
+    print("5. Unsupported SDK versions skip the prefetch instead of touching its internals")
+    with mock.patch.object(firebase_admin, '__version__', '99.0.0'), \
+            mock.patch.object(firebase_setup.auth, '_get_client', side_effect=AssertionError('internals used')):
+        assert firebase_setup._cert_fetcher() is None
+        with mock.patch.object(firebase_setup.threading, 'Timer') as timer:
+            firebase_setup._refresh_certs()
+        assert not timer.called
+
+    print("\nSUCCESS: Firebase setup tests passed.")
+
+if __name__ == "__main__":
+    test_firebase_token_cache_and_cert_refresh()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import threading
+from unittest import mock
+import utils
+
+class FakeCredentials:
+    def __init__(self):
+        self.valid = True
+        self.expired = False
+        self.refresh_token = 'refresh'
+        self.refreshed = 0
+
+    def refresh(self, request):
+        self.refreshed += 1
+        self.valid, self.expired = True, False
+
+def test_gmail_service_cache():
+    fd, token_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    saved_stats = dict(utils._gmail_stats)
+    utils._gmail_stats.update(hits=0, misses=0, refreshes=0)
+    utils._gmail_local.__dict__.pop('entry', None)
+    creds = FakeCredentials()
+    try:
+        with mock.patch.object(utils.Credentials, 'from_authorized_user_file', return_value=creds) as load, \
+                mock.patch.object(utils, 'build', side_effect=lambda *args, **kwargs: object()) as build:
+            print("1. A worker thread reuses its service")
+            service = utils.get_gmail_service(token_path)
+            assert utils.get_gmail_service(token_path) is service
+            assert utils.get_gmail_service(token_path) is service
+            assert load.call_count == 1 and build.call_count == 1
+
+            print("2. Each thread builds its own service")
+            others = []
+            worker = threading.Thread(target=lambda: others.append(utils.get_gmail_service(token_path)))
+            worker.start()
+            worker.join()
+            assert others[0] is not None and others[0] is not service
+            assert build.call_count == 2
+
+            print("3. Expired credentials are refreshed in place, keeping the service")
+            creds.valid, creds.expired = False, True
+            assert utils.get_gmail_service(token_path) is service
+            assert creds.refreshed == 1 and build.call_count == 2
+
+            print("4. A new token.json replaces the cached service")
+            os.utime(token_path, (0, 0))
+            assert utils.get_gmail_service(token_path) is not service
+            assert build.call_count == 3
+
+        print("5. The counters shown on the admin page add up")
+        stats = utils.get_gmail_cache_stats()
+        assert (stats['hits'], stats['misses'], stats['refreshes']) == (3, 3, 1)
+        assert stats['hit_rate'] == 50.0
+    finally:
+        utils._gmail_stats.update(saved_stats)
+        utils._gmail_local.__dict__.pop('entry', None)
+        os.remove(token_path)
+
+    print("\nSUCCESS: Gmail service cache tests passed.")
+
+if __name__ == "__main__":
+    test_gmail_service_cache()
@@ -0,0 +1,77 @@
+import io
+import os
+import tempfile
+from datetime import timedelta
+import pytest
+from models import db, Admin, Elector, ImportJob
+from importer import import_electors_csv
+import importer
+from utils import get_ist_now
+
+def test_streaming_import(app, running_election):
+    election, _, existing = running_election
+
+    print("1. Header row is detected and columns mapped by name")
+    csv_bytes = (
+        "\ufeffName,Email,Mobile\r\n"
+        "Asha,asha@example.com,+911111111111\r\n"
+        "Ravi,,+912222222222\r\n"
+        "Dup In File,asha@example.com,\r\n"
+        "On Roll,voter@example.com,\r\n"
+        ",nobody@example.com,\r\n"
+    ).encode('utf-8')
+    stats = import_electors_csv(election.id, io.BytesIO(csv_bytes), batch_size=1)
+    print(f"   Inserted: {stats.inserted}, Skipped: {dict(stats.reasons)}")
+    assert stats.parsed == 5
+    assert stats.inserted == 2
+    assert stats.reasons == {'duplicate': 2, 'missing data': 1}
+    ravi = Elector.query.filter_by(election_id=election.id, phone='+912222222222').one()
+    assert ravi.name == 'Ravi' and ravi.email is None and ravi.status == 'approved'
+
+    print("2. Headerless files use phone, email, name order")
+    stats = import_electors_csv(election.id, io.BytesIO(b"+913333333333,meera@example.com,Meera\n"))
+    assert stats.inserted == 1
+    assert Elector.query.filter_by(election_id=election.id, email='meera@example.com').one().name == 'Meera'
+
+    print("3. Empty upload")
+    assert import_electors_csv(election.id, io.BytesIO(b"")) is None
+
+    assert Elector.query.filter_by(election_id=election.id).count() == 4
+
+    print("5. Jobs left unfinished by a restarted worker are marked failed when polled")
+    stale = ImportJob(id='stale', election_id=election.id, status='running',
+                      updated_at=get_ist_now() - timedelta(hours=1))
+    fresh = ImportJob(id='fresh', election_id=election.id, status='queued')
+    db.session.add_all([stale, fresh])
+    db.session.commit()
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(Admin.query.filter_by(username='javabool').first().id)
+        data = client.get('/admin/import_jobs/stale').json
+    assert data['status'] == 'failed' and data['finished'] and 'restarted' in data['error']
+    assert db.session.get(ImportJob, 'fresh').status == 'queued'
+
+    print("6. Jobs queued behind a running import are kept alive by its progress")
+    waiting = ImportJob(id='waiting', election_id=election.id, status='queued', owner=importer.BOOT_ID,
+                        updated_at=get_ist_now() - timedelta(hours=1))
+    db.session.add(waiting)
+    db.session.commit()
+    importer._touch_queued(get_ist_now())
+    db.session.commit()
+    assert importer.expire_stale_jobs(900, election_id=election.id) == 0
+
+    print("7. A job failed while it was queued does not start")
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(b"Name,Email\nLate,late@example.com\n")
+    ImportJob.query.filter_by(id='waiting').update({'status': 'failed'})
+    db.session.commit()
+    importer._run_import_job(app, 'waiting', path)
+    db.session.expire_all()
+    assert db.session.get(ImportJob, 'waiting').status == 'failed'
+    assert Elector.query.filter_by(email='late@example.com').count() == 0
+    assert not os.path.exists(path)
+    print("\nSUCCESS: Import tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,49 @@
+from datetime import timedelta
+import pytest
+from models import db, Election
+from lifecycle import scheduler
+from utils import get_ist_now
+
+def make_election(start_offset, end_offset, status='active'):
+    now = get_ist_now()
+    election = Election(
+        title='Lifecycle Test',
+        nomination_start=now + timedelta(minutes=start_offset - 20),
+        nomination_end=now + timedelta(minutes=start_offset - 10),
+        start_time=now + timedelta(minutes=start_offset),
+        end_time=now + timedelta(minutes=end_offset),
+        status=status
+    )
+    db.session.add(election)
+    db.session.commit()
+    return election
+
+def test_lifecycle_transitions(app):
+    print("1. Expired active election is completed on first check")
+    expired = make_election(-60, -1)
+    upcoming = make_election(21, 90)
+    scheduler.invalidate()
+    assert scheduler.run_due() == [expired.id]
+    assert db.session.get(Election, expired.id).status == 'completed'
+    assert db.session.get(Election, upcoming.id).status == 'active'
+
+    print("2. Next due time is the nearest voting end")
+    scheduler.resync_seconds = 0
+    scheduler.run_due()
+    assert scheduler.next_due == upcoming.end_time, scheduler.next_due
+
+    print("3. No work is done before the boundary")
+    due_at = scheduler.next_due
+    with app.test_request_context('/'):
+        scheduler.check_due()
+    assert scheduler.next_due == due_at
+
+    print("4. Crossing the boundary completes the election")
+    assert scheduler.run_due(upcoming.end_time + timedelta(seconds=1)) == [upcoming.id]
+    assert db.session.get(Election, upcoming.id).status == 'completed'
+    scheduler.resync_seconds = app.config['LIFECYCLE_RESYNC_SECONDS']
+
+    print("\nSUCCESS: Lifecycle scheduler tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -23,14 +23,25 @@ def test_otp_flow():
         # Store OTP
         print("\n3. Testing Expiration (Mocked Time)")
         
-        store_otp_in_session('test_otp_expiry', '111222')
-        
-        session['test_otp_expiry_time'] = int(time.time()) - 601
+        store_otp_in_session('test_otp_expiry', '111222', issued_at=time.time() - 601)
         
         is_valid, msg = verify_otp_in_session('test_otp_expiry', '111222')
         print(f"   Result: {is_valid}, Msg: {msg}")
         assert is_valid == False and "expired" in msg.lower(), "Expiration failed"
         
+        print("\n4. Testing Attempt Limit")
+        store_otp_in_session('test_otp_attempts', '333444')
+        for _ in range(5):
+            is_valid, msg = verify_otp_in_session('test_otp_attempts', '000000')
+        print(f"   Result: {is_valid}, Msg: {msg}")
+        assert "too many" in msg.lower(), "Attempt limit not enforced"
+        is_valid, msg = verify_otp_in_session('test_otp_attempts', '333444')
+        assert is_valid == False, "OTP should be discarded after too many attempts"
+        
+        print("\n5. Only a session id is kept in the cookie")
+        assert 'test_otp' not in session and 'test_otp_time' not in session
+        assert set(session.keys()) == {'otp_sid'}
+        
         print("\nSUCCESS: All OTP logic tests passed.")
 
 if __name__ == "__main__":
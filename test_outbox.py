@@ -0,0 +1,143 @@
+from datetime import timedelta
+from unittest import mock
+import pytest
+from models import db, OutboxEmail, OutboxPayload
+from email_limiter import limiter
+import outbox
+import utils
+
+def test_outbox_retries_and_dead_letters(app):
+    outbox.dispatcher.max_attempts = 2
+    limiter.configure(max_concurrency=4, per_minute=100)
+
+    print("1. Idempotency key queues a message only once")
+    first = outbox.enqueue('a@example.com', 'Hello', 'Body', key='revote:abc')
+    again = outbox.enqueue('a@example.com', 'Hello', 'Body', key='revote:abc')
+    db.session.commit()  # enqueue leaves committing to the caller
+    assert first.id == again.id
+    assert OutboxEmail.query.count() == 1
+
+    print("2. A failed send is retried with backoff")
+    with mock.patch.object(utils, 'deliver_email', side_effect=RuntimeError('quota')):
+        assert outbox.dispatcher.dispatch_once() == 1
+    db.session.expire_all()
+    row = db.session.get(OutboxEmail, first.id)
+    assert row.status == 'pending' and row.attempts == 1 and row.last_error == 'quota'
+    assert row.next_attempt_at > utils.get_ist_now()
+    assert outbox.dispatcher.dispatch_once() == 0
+
+    print("3. Exhausted retries are dead-lettered")
+    row.next_attempt_at = utils.get_ist_now() - timedelta(seconds=1)
+    db.session.commit()
+    with mock.patch.object(utils, 'deliver_email', side_effect=RuntimeError('quota')):
+        outbox.dispatcher.dispatch_once()
+    db.session.expire_all()
+    row = db.session.get(OutboxEmail, first.id)
+    assert row.status == 'dead' and row.body == ''
+    assert outbox.outbox_stats()['dead'] == 1
+
+    print("4. Delivered mail keeps no content")
+    secret = utils.send_otp('c@example.com', '654321')
+    assert secret
+    with mock.patch.object(utils, 'deliver_email') as deliver:
+        outbox.priority_dispatcher.dispatch_once()
+        assert '654321' in deliver.call_args.args[1].decode()
+    db.session.expire_all()
+    row = OutboxEmail.query.filter_by(to_email='c@example.com').one()
+    assert row.status == 'sent' and row.sent_at is not None and row.body == ''
+
+    print("5. Rows left 'sending' past the lease are re-queued")
+    stuck = OutboxEmail(to_email='b@example.com', subject='S', body='B', status='sending',
+                        locked_at=utils.get_ist_now() - timedelta(hours=1))
+    db.session.add(stuck)
+    db.session.commit()
+    assert outbox.dispatcher.reclaim_stale() == 1
+    assert db.session.get(OutboxEmail, stuck.id).status == 'pending'
+
+    print("6. Bulk sends go out as one batch with per-message results")
+    rows = utils.send_bulk_emails([{'to_email': f'{i}@example.com', 'subject': 'S', 'body': '<p>B</p>'} for i in range(3)])
+    assert all(r.is_html for r in rows)
+    failing = rows[1].id
+    def fake_batch(messages, token_path):
+        return {ref: (RuntimeError('rateLimitExceeded') if ref == failing else None) for ref, *_ in messages}
+    with mock.patch.object(utils, 'deliver_email_batch', side_effect=fake_batch) as batch:
+        outbox.dispatcher.dispatch_once()
+        assert batch.call_count == 1
+    db.session.expire_all()
+    statuses = [db.session.get(OutboxEmail, r.id).status for r in rows]
+    assert statuses == ['sent', 'pending', 'sent'], statuses
+    assert db.session.get(OutboxEmail, failing).attempts == 0
+
+    print("7. Throttling pauses dispatch until the cool-down ends")
+    assert limiter.snapshot()['cooldown_seconds'] > 0
+    db.session.get(OutboxEmail, failing).next_attempt_at = utils.get_ist_now()
+    db.session.commit()
+    assert outbox.dispatcher.dispatch_once() == 0
+
+    print("8. Shared sends encode the message once for all recipients")
+    limiter.configure(max_concurrency=4, per_minute=100)
+    with mock.patch.object(utils, 'encode_message', wraps=utils.encode_message) as encode:
+        rows = utils.send_shared_email(['x@example.com', 'y@example.com', 'x@example.com'], 'Report',
+                                       '<p>Big</p>', is_html=True, key='report:1')
+        again = utils.send_shared_email(['x@example.com', 'y@example.com'], 'Report', '<p>Big</p>',
+                                        is_html=True, key='report:1')
+        assert [r.id for r in again] == [r.id for r in rows] and len(rows) == 2
+        with mock.patch.object(utils, 'deliver_email_batch',
+                               side_effect=lambda messages, token_path: {m[0]: None for m in messages}) as batch:
+            outbox.dispatcher.dispatch_once()
+    # Once per send_shared_email call, never per recipient or at dispatch.
+    assert [call.args[0] for call in encode.call_args_list].count('Report') == 2
+    sent = {m[1]: m[2] for call in batch.call_args_list for m in call.args[0]}
+    assert sent['x@example.com'] == sent['y@example.com']
+    db.session.expire_all()
+    assert all(db.session.get(OutboxEmail, r.id).status == 'sent' for r in rows)
+    assert all(db.session.get(OutboxEmail, r.id).payload_id is None for r in rows)
+    assert OutboxPayload.query.count() == 0
+
+    print("9. The retention sweep deletes old finished mail")
+    queued = outbox.enqueue('later@example.com', 'Later', 'Body')
+    db.session.commit()
+    finished = OutboxEmail.query.filter(OutboxEmail.status.in_(('sent', 'dead'))).count()
+    assert outbox.sweep(7) == 0
+    assert outbox.sweep(7, now=utils.get_ist_now() + timedelta(days=8)) == finished
+    assert OutboxEmail.query.filter(OutboxEmail.status.in_(('sent', 'dead'))).count() == 0
+    assert db.session.get(OutboxEmail, queued.id).body == 'Body'  # queued mail is kept
+
+    print("10. A failure to queue leaves the caller's own changes for it to commit")
+    kept = OutboxEmail(to_email='kept@example.com', subject='Caller', body='row')
+    db.session.add(kept)
+    with mock.patch.object(outbox, 'enqueue_many', side_effect=RuntimeError('disk full')):
+        assert utils.send_bulk_emails([{'to_email': 'z@example.com', 'subject': 'S', 'body': 'B'}]) == []
+    assert utils.send_email_async('z@example.com', 'S', 'B')  # queued, not committed
+    db.session.rollback()
+    assert OutboxEmail.query.filter_by(to_email='z@example.com').count() == 0
+    db.session.add(kept)
+    with mock.patch.object(outbox, 'enqueue', side_effect=RuntimeError('disk full')):
+        assert utils.send_email_async('z@example.com', 'S', 'B') is False
+    db.session.commit()
+    assert OutboxEmail.query.filter_by(to_email='kept@example.com').count() == 1
+
+    print("11. No daily cap unless configured; latency is judged per message")
+    limiter.configure(max_concurrency=4, per_minute=100)
+    assert limiter.per_day is None
+    assert limiter.acquire(50, sent_today=10 ** 6, sent_last_minute=0) == 50
+    limiter.concurrency = 2
+    limiter.record(20.0, throttled=False, messages=100)  # 0.2s per message
+    assert limiter.concurrency == 2
+    limiter.record(6.0, throttled=False)
+    assert limiter.concurrency == 1
+
+    print("12. A dispatch round never runs more batches than the email workers")
+    outbox.enqueue_many([{'to_email': f'w{i}@example.com', 'subject': 'S', 'body': 'B'} for i in range(120)])
+    db.session.commit()
+    limiter.concurrency = 4
+    with mock.patch.object(utils, 'email_workers', 1), \
+            mock.patch.object(utils, 'deliver_email_batch',
+                              side_effect=lambda messages, token_path: {m[0]: None for m in messages}):
+        assert outbox.dispatcher.dispatch_once() == outbox.dispatcher.batch_size
+    limiter.configure()
+
+    print("\nSUCCESS: Outbox tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
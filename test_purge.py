@@ -0,0 +1,57 @@
+import pytest
+from models import db, Election, Candidate, Elector, Vote, RevoteLink, CandidateTally, ElectionTally
+from tally import total_votes
+import purge
+
+def test_set_based_deletes(client, running_election, cast, login):
+    election, candidate, elector = running_election
+    db.session.bulk_insert_mappings(Elector, [
+        {'election_id': election.id, 'name': f'Roll {i}', 'email': f'roll{i}@example.com', 'secret_code': str(300000 + i),
+         'status': 'pending' if i % 3 == 0 else 'approved', 'has_voted': False}
+        for i in range(1200)
+    ])
+    db.session.commit()
+    cast(client, election.id, elector.id, candidate.id)
+    db.session.add(RevoteLink(election_id=election.id, elector_id=elector.id, token='tok'))
+    db.session.commit()
+    login(client)
+
+    print("1. Selected electors are deleted in chunks with their votes and revote links")
+    approved_ids = sorted(row.id for row in db.session.query(Elector.id).filter_by(election_id=election.id, status='approved'))
+    r = client.post(f'/admin/election/{election.id}/delete_electors', data={'elector_ids': approved_ids[:700]})
+    assert r.status_code == 302
+    assert Elector.query.filter_by(election_id=election.id, status='approved').count() == len(approved_ids) - 700
+    assert Vote.query.count() == 0 and RevoteLink.query.count() == 0
+    assert total_votes(election.id) == 0
+
+    print("2. 'Delete all pending' clears the requests in one pass")
+    client.post(f'/admin/election/{election.id}/delete_electors', data={'status': 'pending'})
+    assert Elector.query.filter_by(election_id=election.id, status='pending').count() == 0
+    assert Elector.query.filter_by(election_id=election.id).count() == len(approved_ids) - 700
+
+    print("3. Ids from another election are ignored")
+    other = Election(title='Other', start_time=election.start_time, end_time=election.end_time,
+                     nomination_start=election.nomination_start, nomination_end=election.nomination_end)
+    db.session.add(other)
+    db.session.commit()
+    outsider = Elector(election_id=other.id, name='Outsider', email='out@example.com', secret_code='222222')
+    db.session.add(outsider)
+    db.session.commit()
+    assert purge.delete_electors(election.id, [outsider.id]) == 0
+    db.session.commit()
+
+    print("4. Purging an election removes every dependent row")
+    election_id = election.id
+    purge.purge_election(election_id)
+    db.session.commit()
+    db.session.expire_all()
+    assert db.session.get(Election, election_id) is None
+    assert Elector.query.filter_by(election_id=election_id).count() == 0
+    assert Candidate.query.filter_by(election_id=election_id).count() == 0
+    assert CandidateTally.query.count() == 0 and db.session.get(ElectionTally, election_id) is None
+    assert Elector.query.filter_by(election_id=other.id).count() == 1
+
+    print("\nSUCCESS: Purge tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,52 @@
+import pytest
+from config import Config
+import rate_limit
+
+@pytest.fixture
+def app(make_app, request):
+    rate_limit._stores.clear()
+    return make_app(RATE_LIMITS=dict(Config.RATE_LIMITS, check_phone_per_ip=(5, 60)), **getattr(request, 'param', {}))
+
+def test_login_endpoints_are_rate_limited(client, running_election):
+    election, _, _ = running_election
+
+    print("1. OTP requests are limited per email address")
+    for _ in range(3):
+        r = client.post(f'/vote/{election.id}/send_otp', data={'email': 'voter@example.com'})
+        assert r.status_code == 200, r.data
+    r = client.post(f'/vote/{election.id}/send_otp', data={'email': 'Voter@example.com '})
+    print(f"   4th request: {r.status_code}, Retry-After {r.headers.get('Retry-After')}")
+    assert r.status_code == 429
+    assert int(r.headers['Retry-After']) > 0
+    assert r.json['success'] is False
+
+    print("2. Phone lookups are limited per IP")
+    codes = [client.post(f'/vote/{election.id}/check_phone', json={'phone': '+910000000000'}).status_code
+             for _ in range(6)]
+    assert codes == [200] * 5 + [429], codes
+
+    print("3. Sliding window lets requests back in as the previous window ages")
+    store = rate_limit.get_store()
+    for _ in range(5):
+        store.incr('check_phone_per_ip:10.0.0.1', 0, 60)
+    assert rate_limit.check('check_phone_per_ip', '10.0.0.1', now=61)[0] is False
+    assert rate_limit.check('check_phone_per_ip', '10.0.0.1', now=100)[0] is True
+
+    print("\nSUCCESS: Rate limit tests passed.")
+
+@pytest.mark.parametrize('app', [{'TRUSTED_PROXY_HOPS': 1}], indirect=True)
+def test_forwarded_clients_are_limited_separately(client, running_election):
+    election, _, _ = running_election
+
+    print("1. Behind a trusted proxy, clients are keyed by their forwarded address")
+    def lookup(ip):
+        return client.post(f'/vote/{election.id}/check_phone', json={'phone': '+910000000000'},
+                           headers={'X-Forwarded-For': ip}, environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code
+    codes = [lookup('203.0.113.1') for _ in range(6)]
+    assert codes == [200] * 5 + [429], codes
+    assert lookup('203.0.113.2') == 200
+
+    print("\nSUCCESS: Forwarded-address rate limit tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,71 @@
+import pytest
+from flask_login import AnonymousUserMixin
+from models import db, Admin, Elector
+from realtime import feed, room_for, watched_election
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, data, to=None):
+        self.events.append((event, data, to))
+
+def test_turnout_deltas_are_coalesced(client, running_election, cast):
+    election, candidate, elector = running_election
+    previous = feed.socketio
+    feed.socketio = recorder = Recorder()
+    try:
+        second = Elector(election_id=election.id, name='Second', email='second@example.com', secret_code='111111')
+        db.session.add(second)
+        db.session.commit()
+
+        print("1. Several votes become one broadcast to the election's room")
+        cast(client, election.id, elector.id, candidate.id)
+        cast(client, election.id, second.id, candidate.id)
+        client.post(f'/election/{election.id}/request_access',
+                    data={'name': 'Asking', 'email': 'ask@example.com'})
+        assert feed.flush() == 1
+        event, data, room = recorder.events[0]
+        print(f"   {event} -> {room}: {data['deltas']}")
+        assert event == 'turnout' and room == room_for(election.id)
+        assert data['deltas']['voted'] == 2 and data['deltas']['pending_requests'] == 1
+        assert 'revotes_used' not in data['deltas']
+
+        print("2. Nothing is sent when nothing changed")
+        assert feed.flush() == 0 and len(recorder.events) == 1
+
+        print("3. Deltas that cancel out are dropped")
+        feed.publish(election.id, pending_requests=1)
+        feed.publish(election.id, pending_requests=-1)
+        assert feed.flush() == 0
+
+        print("4. A resync replaces pending deltas with a fresh snapshot")
+        feed.publish(election.id, voted=-1)
+        feed.resync(election.id)
+        assert feed.flush() == 1
+        event, data, room = recorder.events[-1]
+        assert event == 'turnout_snapshot' and data['voted'] == 2 and data['pending_requests'] == 1
+
+        print("5. Only admins who may manage it can watch an existing election")
+        manager = Admin.query.filter_by(username='javabool').first()
+        assert watched_election(manager, {'election_id': election.id}) == election.id
+        assert watched_election(manager, {'election_id': str(election.id)}) == election.id
+        for payload in (None, 'x', {}, {'election_id': None}, {'election_id': 'abc'}, {'election_id': [1]},
+                        {'election_id': 0}, {'election_id': election.id + 1000}):
+            assert watched_election(manager, payload) is None
+        viewer = Admin(username='viewer', email='viewer@example.com', password_hash='x', is_force_change_password=False)
+        db.session.add(viewer)
+        db.session.commit()
+        assert watched_election(viewer, {'election_id': election.id}) is None
+        viewer.perm_manage_electors = True
+        assert watched_election(viewer, {'election_id': election.id}) == election.id
+        viewer.is_force_change_password = True
+        assert watched_election(viewer, {'election_id': election.id}) is None
+        assert watched_election(AnonymousUserMixin(), {'election_id': election.id}) is None
+
+        print("\nSUCCESS: Realtime feed tests passed.")
+    finally:
+        feed.socketio = previous
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,63 @@
+import base64
+import email
+import email.policy
+from unittest import mock
+import pytest
+from models import db, Admin, Elector, OutboxEmail
+from email_limiter import limiter
+import outbox
+import release_report
+import utils
+
+def test_release_report(app, client, running_election, cast):
+    election, candidate, elector = running_election
+    db.session.add_all([Elector(election_id=election.id, name=f"Late <{i}>", email=f"late{i}@example.com",
+                                secret_code=str(200000 + i), status='approved') for i in range(5)])
+    db.session.commit()
+    cast(client, election.id, elector.id, candidate.id)
+
+    print("1. Small rolls are listed inline, rendered from the template")
+    html, attachments = release_report.build(election)
+    assert attachments == []
+    assert 'Election Results: Ballot Test' in html and 'class="winner"' in html
+    assert 'voter@example.com' in html and 'late4@example.com' in html
+    assert 'Late &lt;0&gt;' in html
+    assert html.index('voter@example.com') < html.index('Not Voted Electors') < html.index('late0@example.com')
+
+    print("2. Electors are read in chunks")
+    assert [e.id for e in release_report.iter_electors(election.id, False, chunk_size=2)] == \
+        [e.id for e in Elector.query.filter_by(election_id=election.id, has_voted=False).order_by(Elector.id)]
+
+    print("3. Large rolls go out as a CSV attachment")
+    app.config['RELEASE_REPORT_INLINE_ROWS'] = 3
+    html, attachments = release_report.build(election)
+    assert 'late0@example.com' not in html and f"election_{election.id}_electors.csv" in html
+    (filename, content_type, data), = attachments
+    lines = data.decode('utf-8-sig').splitlines()
+    assert content_type == 'text/csv' and lines[0] == 'Name,Email,Phone,Voted'
+    assert lines[1] == 'Voter,voter@example.com,,Yes' and len(lines) == 7
+
+    print("4. The report is encoded once, attachment included, and delivered to every admin")
+    limiter.configure(max_concurrency=4, per_minute=100)
+    rows = release_report.send(election)
+    assert len(rows) == Admin.query.count() and len({r.payload_id for r in rows}) == 1
+    with mock.patch.object(utils, 'deliver_email_batch',
+                           side_effect=lambda messages, token_path: {m[0]: None for m in messages}) as batch:
+        outbox.dispatcher.dispatch_once()
+    sent = [m for call in batch.call_args_list for m in call.args[0]]
+    assert sorted(m[1] for m in sent) == sorted(r.to_email for r in rows)
+    db.session.expire_all()
+    assert all(db.session.get(OutboxEmail, r.id).status == 'sent' for r in rows)
+
+    print("5. Attachments are part of the MIME message")
+    raw = utils.address_message('a@example.com', sent[0][2])['raw']
+    message = email.message_from_bytes(base64.urlsafe_b64decode(raw), policy=email.policy.default)
+    assert message['To'] == 'a@example.com' and message['Subject'] == 'Official Results: Ballot Test'
+    (part,) = list(message.iter_attachments())
+    assert part.get_filename() == filename and part.get_content_type() == 'text/csv'
+    assert part.get_payload(decode=True) == data
+
+    print("\nSUCCESS: Release report tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
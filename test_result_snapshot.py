@@ -0,0 +1,123 @@
+import os
+from datetime import timedelta
+from unittest import mock
+import pytest
+from flask import g
+from flask_login import login_user, logout_user
+from sqlalchemy import event
+from models import db, Admin, Candidate, ResultSnapshot
+from routes.admin import perform_release_results
+import migrations
+import snapshots
+import static_export
+
+def test_results_served_from_snapshot(app, client, running_election, cast):
+    election, candidate, elector = running_election
+    cast(client, election.id, elector.id, candidate.id)
+    election.end_time = election.start_time + timedelta(minutes=30)
+    election.status = 'completed'
+    db.session.commit()
+
+    print("1. Releasing results freezes a snapshot")
+    with app.test_request_context():
+        login_user(Admin.query.filter_by(username='javabool').first())
+        perform_release_results(election)
+        logout_user()
+    snapshot = db.session.get(ResultSnapshot, election.id)
+    data = snapshots.data(snapshot)
+    assert data['total_votes'] == 1 and data['turnout'] == 100.0
+    assert data['results'][0] == {'name': 'Alice', 'votes': 1, 'rank': 1, 'percent': 100.0}
+
+    print("2. The results page carries a strong ETag and revalidates with one read")
+    r = client.get(f'/results/{election.id}')
+    assert r.status_code == 200 and b'Rank #1: Alice' in r.data
+    etag = r.headers['ETag']
+    assert not etag.startswith('W/')
+    db.session.expunge_all()
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        r = client.get(f'/results/{election.id}', headers={'If-None-Match': etag})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert r.status_code == 304
+    assert len(statements) == 1 and 'result_snapshot' in statements[0]
+
+    print("3. Anonymous visitors get the pages exported at release")
+    tag = snapshot.etag
+    assert static_export.is_exported(election.id, tag)
+    page_tag = os.path.basename(os.path.dirname(static_export.exported_path(election.id, tag, 'results')))
+    r = client.get(f'/released/{election.id}/{page_tag}/results.html')
+    assert r.status_code == 200 and b'Rank #1: Alice' in r.data
+    assert r.cache_control.max_age == static_export.MAX_AGE and r.cache_control.immutable
+    r.close()
+    with mock.patch('routes.public.render_template', side_effect=AssertionError('rendered')):
+        r = client.get(f'/election/{election.id}')
+        assert r.status_code == 200 and b'View Results' in r.data
+        r.close()
+        r = client.get(f'/results/{election.id}')
+        assert r.status_code == 200 and r.headers['ETag'].endswith('-public"')
+        r.close()
+
+    print("4. Approving a candidate after release re-exports only the details page")
+    details = static_export.exported_path(election.id, tag, 'details')
+    late = Candidate(election_id=election.id, name='Bob', status='pending')
+    db.session.add(late)
+    db.session.commit()
+    # Requests share this app context, so drop the user flask-login cached in g around the admin request.
+    g.pop('_login_user', None)
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(Admin.query.filter_by(username='javabool').first().id)
+    assert client.get(f'/admin/candidate/{late.id}/approve').status_code == 302
+    with client.session_transaction() as sess:
+        sess.clear()
+    g.pop('_login_user', None)
+    assert static_export.exported_path(election.id, tag, 'results').endswith(f'{page_tag}/results.html')
+    assert static_export.exported_path(election.id, tag, 'details') != details and not os.path.exists(details)
+    r = client.get(f'/election/{election.id}')
+    assert r.status_code == 200 and b'Bob' in r.data
+    r.close()
+
+    print("5. Unpublishing drops the snapshot and the export")
+    election = db.session.merge(election)
+    election.show_results = False
+    snapshots.discard(election.id)
+    static_export.remove(election.id)
+    db.session.commit()
+    assert client.get(f'/results/{election.id}').status_code == 302
+    assert not static_export.is_exported(election.id, tag)
+
+    print("6. Results released before snapshots existed are frozen on first view")
+    election.show_results = True
+    db.session.commit()
+    assert client.get(f'/results/{election.id}').status_code == 200
+    tag = db.session.get(ResultSnapshot, election.id).etag  # Bob, approved above, now has a row
+    assert static_export.is_exported(election.id, tag)
+    static_export.remove(election.id)
+
+    print("7. A snapshot frozen concurrently by another request is reused, not a 500")
+    snapshots.discard(election.id)
+    db.session.commit()
+    freeze = snapshots.freeze
+    def frozen_elsewhere(election):
+        theirs = freeze(election)
+        mine = ResultSnapshot(election_id=election.id, version=1, etag=theirs.etag, payload=theirs.payload)
+        db.session.commit()
+        db.session.expunge(theirs)
+        db.session.add(mine)
+        return mine
+    with mock.patch.object(snapshots, 'freeze', side_effect=frozen_elsewhere):
+        r = client.get(f'/results/{election.id}')
+    assert r.status_code == 200 and b'Rank #1: Alice' in r.data
+
+    print("8. Schema upgrades freeze snapshots for already released elections")
+    snapshots.discard(election.id)
+    db.session.commit()
+    migrations.upgrade_schema()
+    assert db.session.get(ResultSnapshot, election.id).etag == tag
+
+    print("\nSUCCESS: Result snapshot tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,69 @@
+from unittest import mock
+import pytest
+from models import db, Elector
+from sqlalchemy import text
+from roll_index import roll_index
+import roll_index as roll_index_module
+
+def test_roll_index_lookups(client, running_election, cast):
+    election, candidate, elector = running_election
+    elector.phone = '+911234567890'
+    db.session.commit()
+    roll_index.invalidate()
+
+    print("1. Lookups are served from memory after the first build")
+    assert roll_index.by_email(election.id, ' Voter@Example.com').id == elector.id
+    with mock.patch.object(db.session, 'query', side_effect=AssertionError('hit the database')):
+        assert roll_index.by_phone(election.id, '+911234567890').id == elector.id
+        assert roll_index.match_secret(election.id, '+911234567890', elector.name, 'wrong') is None
+    # A matching code is confirmed against the database before it is accepted.
+    assert roll_index.match_secret(election.id, '+911234567890', elector.name, elector.secret_code).id == elector.id
+
+    print("2. Electors added elsewhere are found through the fallback query")
+    late = Elector(election_id=election.id, name='Late', email='late@example.com', secret_code='111111')
+    db.session.add(late)
+    db.session.commit()
+    assert roll_index.by_email(election.id, 'late@example.com').id == late.id
+
+    print("3. Casting a vote updates the index")
+    cast(client, election.id, elector.id, candidate.id)
+    assert roll_index.by_email(election.id, 'voter@example.com').has_voted is True
+    r = client.post(f'/vote/{election.id}/check_phone', json={'phone': '+911234567890'})
+    assert r.json['voted'] is True
+
+    print("4. Removed electors disappear")
+    db.session.delete(late)
+    db.session.commit()
+    roll_index.remove(election.id, [late.id])
+    assert roll_index.by_email(election.id, 'late@example.com') is None
+
+    print("5. A code reset on another worker is honoured at once")
+    other = Elector(election_id=election.id, name='Other', email='other@example.com', secret_code='222222')
+    db.session.add(other)
+    db.session.commit()
+    assert roll_index.match_secret(election.id, 'other@example.com', 'Other', '222222').id == other.id
+    Elector.query.filter_by(id=other.id).update({'secret_code': '333333'})  # no refresh(): another worker
+    db.session.commit()
+    assert roll_index.match_secret(election.id, 'other@example.com', 'Other', '222222') is None
+    assert roll_index.match_secret(election.id, 'other@example.com', 'Other', '333333').id == other.id
+
+    print("6. Changes made while a roll is rebuilding survive the rebuild")
+    roll = roll_index._roll(election.id)
+    roll.building = True
+    roll_index.mark_voted(election.id, other.id)
+    roll_index._build(roll)  # read before the vote was committed
+    assert not roll.building and not roll.changes
+    with mock.patch.object(db.session, 'query', side_effect=AssertionError('hit the database')):
+        assert roll.by_email['other@example.com'].has_voted is True
+
+    print("7. Email fallbacks use the lower(email) index instead of scanning the roll")
+    query = roll_index_module._elector_columns()\
+        .filter(Elector.election_id == election.id, db.func.lower(Elector.email) == 'late@example.com')
+    sql = str(query.statement.compile(compile_kwargs={'literal_binds': True}))
+    plan = ' '.join(row[-1] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)))
+    assert 'ix_elector_election_email_lower' in plan, plan
+
+    print("\nSUCCESS: Roll index tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
@@ -0,0 +1,68 @@
+import io
+from unittest import mock
+import pytest
+from sqlalchemy.exc import IntegrityError
+from models import db, Elector
+from importer import import_electors_csv, _insert_batch
+import secret_codes
+
+def test_codes_are_unique_per_election(running_election):
+    election, _, existing = running_election
+
+    print("1. The allocator never hands out a taken code")
+    allocator = secret_codes.CodeAllocator(str(code) for code in range(100000, 999990))
+    assert sorted(allocator.take(10)) == [str(code) for code in range(999990, 1000000)]
+    try:
+        allocator.next()
+        assert False, 'expected the code space to be exhausted'
+    except ValueError:
+        pass
+
+    print("2. Imported electors get numeric codes distinct from the roll")
+    csv_bytes = "".join(f"Person {i},p{i}@example.com\n" for i in range(300)).encode()
+    import_electors_csv(election.id, io.BytesIO(b"name,email\n" + csv_bytes), batch_size=50)
+    codes = [code for (code,) in db.session.query(Elector.secret_code).filter_by(election_id=election.id)]
+    assert len(codes) == 301 and len(set(codes)) == 301
+    assert all(code.isdigit() and len(code) == 6 for code in codes)
+
+    print("3. Regenerating replaces every code in chunks, still unique")
+    before = dict(db.session.query(Elector.id, Elector.secret_code).filter_by(election_id=election.id).all())
+    assert secret_codes.regenerate_codes(election.id, chunk_size=64) == 301
+    db.session.commit()
+    db.session.expire_all()
+    after = dict(db.session.query(Elector.id, Elector.secret_code).filter_by(election_id=election.id).all())
+    assert len(set(after.values())) == 301
+    assert sum(before[i] != after[i] for i in before) > 290
+
+    print("4. Single codes avoid the ones already issued")
+    taken = set(after.values())
+    assert all(secret_codes.new_code(election.id) not in taken for _ in range(50))
+
+    print("5. The database rejects a code already used in the election")
+    code = after[existing.id]
+    db.session.add(Elector(election_id=election.id, name='Copy', email='copy@example.com', secret_code=code))
+    try:
+        db.session.commit()
+        assert False, 'expected the duplicate code to be rejected'
+    except IntegrityError:
+        db.session.rollback()
+
+    print("6. A code lost to a concurrent insert is drawn again")
+    free = next(str(c) for c in range(100000, 999999) if str(c) not in taken)
+    with mock.patch.object(secret_codes, 'new_code', side_effect=[code, free]):
+        elector = secret_codes.assign_code(Elector(election_id=election.id, name='Late', email='late@example.com'))
+    db.session.commit()
+    assert elector.id and elector.secret_code == free
+
+    print("7. Imported rows whose code was taken meanwhile get new ones")
+    allocator = secret_codes.CodeAllocator.for_election(election.id)
+    row = {'election_id': election.id, 'name': 'Batch', 'email': 'batch@example.com', 'phone': None,
+           'secret_code': code, 'status': 'approved', 'has_voted': False}
+    _insert_batch(election.id, [row], allocator)
+    assert row['secret_code'] not in (code, free)
+    assert Elector.query.filter_by(email='batch@example.com').one().secret_code == row['secret_code']
+
+    print("\nSUCCESS: Secret code tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
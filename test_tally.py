@@ -0,0 +1,54 @@
+import pytest
+from models import db, Candidate, Elector, Vote, CandidateTally
+import tally
+
+def test_tally_counters(client, running_election, cast):
+    election, alice, first = running_election
+    bob = Candidate(election_id=election.id, name='Bob', status='approved')
+    second = Elector(election_id=election.id, name='Second', email='second@example.com', secret_code='654321')
+    db.session.add_all([bob, second])
+    db.session.commit()
+
+    print("1. Votes are counted as they are cast")
+    cast(client, election.id, first.id, alice.id)
+    cast(client, election.id, second.id, bob.id)
+    cast(client, election.id, second.id, bob.id)
+    assert tally.total_votes(election.id) == 2
+    ranked = [(c.name, votes) for c, votes, _ in tally.ranked_results(election.id)]
+    assert sorted(ranked) == [('Alice', 1), ('Bob', 1)], ranked
+    assert [rank for _, _, rank in tally.ranked_results(election.id)] == [1, 1]
+
+    print("2. Deleting votes takes them off the counters")
+    assert tally.delete_votes(election.id, [second.id]) == 1
+    db.session.commit()
+    assert tally.total_votes(election.id) == 1
+    assert db.session.get(CandidateTally, bob.id).votes == 0
+
+    print("3. Reconcile reports and repairs drift")
+    db.session.get(CandidateTally, alice.id).votes = 7
+    db.session.commit()
+    drift = tally.reconcile(election.id)
+    assert drift == [{'election_id': election.id, 'candidate_id': alice.id, 'stored': 7, 'actual': 1}], drift
+    assert db.session.get(CandidateTally, alice.id).votes == Vote.query.filter_by(candidate_id=alice.id).count()
+    assert tally.reconcile(election.id) == []
+
+    print("4. Votes for a candidate of another election are refused")
+    other = Candidate(election_id=election.id + 1, name='Mallory', status='approved')
+    third = Elector(election_id=election.id, name='Third', email='third@example.com', secret_code='111222')
+    db.session.add_all([other, third])
+    db.session.commit()
+    r = cast(client, election.id, third.id, other.id)
+    assert r.status_code == 302 and r.headers['Location'].endswith(f'/vote/{election.id}/ballot')
+    assert db.session.get(CandidateTally, other.id) is None and tally.total_votes(election.id) == 1
+    assert not db.session.get(Elector, third.id).has_voted
+    try:
+        tally._bump(CandidateTally, {'candidate_id': alice.id, 'election_id': election.id + 1}, 'votes', 1)
+        assert False, 'tally of another election was bumped'
+    except ValueError:
+        db.session.rollback()
+    assert db.session.get(CandidateTally, alice.id).votes == 1
+
+    print("\nSUCCESS: Tally tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
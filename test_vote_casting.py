@@ -0,0 +1,25 @@
+import pytest
+from models import db, Elector, Vote
+
+def test_single_vote_per_elector(client, running_election, cast):
+    election, candidate, elector = running_election
+
+    print("1. First ballot is recorded")
+    cast(client, election.id, elector.id, candidate.id)
+    assert Vote.query.filter_by(elector_id=elector.id).count() == 1
+    assert db.session.get(Elector, elector.id).has_voted
+
+    print("2. Second ballot is rejected by the has_voted compare-and-set")
+    cast(client, election.id, elector.id, candidate.id)
+    assert Vote.query.filter_by(elector_id=elector.id).count() == 1
+
+    print("3. Stale has_voted flag is still caught by the unique vote constraint")
+    db.session.get(Elector, elector.id).has_voted = False
+    db.session.commit()
+    cast(client, election.id, elector.id, candidate.id)
+    assert Vote.query.filter_by(elector_id=elector.id).count() == 1
+
+    print("\nSUCCESS: Vote casting tests passed.")
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, "-s"]))
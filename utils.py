@@ -1,11 +1,13 @@
 import base64
 import os.path
+from email import policy as email_policy
 from email.message import EmailMessage
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from flask import current_app, session
 from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 
 import json
@@ -20,32 +22,32 @@ def get_ist_now():
     ist = pytz.timezone('Asia/Kolkata')
     return datetime.now(ist).replace(tzinfo=None)
 
-def store_otp_in_session(key, otp):
-    """Stores OTP and timestamp in session."""
-    session[key] = otp
-    session[key + '_time'] = int(time.time())
+def _session_otp_identity(key):
+    """OTP store identity for a purpose-specific OTP tied to this browser session."""
+    import secrets
+    if 'otp_sid' not in session:
+        session['otp_sid'] = secrets.token_hex(16)
+    return f"session:{session['otp_sid']}:{key}"
+
+def store_otp_in_session(key, otp, issued_at=None):
+    """Stores OTP server-side for this session; only a random session id goes into the cookie."""
+    import otp_store
+    otp_store.issue(_session_otp_identity(key), otp, issued_at=issued_at)
 
 def verify_otp_in_session(key, input_otp, max_age=600):
     """Verifies OTP and expiration (default 10 mins). Returns (bool, message)."""
+    import otp_store
+    return otp_store.verify(_session_otp_identity(key), input_otp, max_age=max_age)
 
-    if key not in session: 
-        return False, "OTP not found or expired."
-    
-
-    stored_time = session.get(key + '_time', 0)
-    if time.time() - stored_time > max_age:
-        session.pop(key, None)
-        session.pop(key + '_time', None)
-        return False, "OTP has expired."
-        
+def otp_pending_in_session(key):
+    """True if an unexpired OTP for key was issued in this session."""
+    import otp_store
+    return 'otp_sid' in session and otp_store.is_pending(_session_otp_identity(key))
 
-    if str(session.get(key)) == str(input_otp):
-
-        session.pop(key, None)
-        session.pop(key + '_time', None)
-        return True, "Success"
-        
-    return False, "Invalid OTP."
+def clear_otp_in_session(key):
+    import otp_store
+    if 'otp_sid' in session:
+        otp_store.discard(_session_otp_identity(key))
 
 def load_email_config():
     """Loads email configuration from file."""
@@ -58,10 +60,12 @@ def load_email_config():
     return {'max_workers': DEFAULT_LIMIT}
 
 def save_email_config(config):
-    """Saves email configuration to file."""
+    """Saves email configuration to file (merged into the existing settings)."""
     try:
+        merged = load_email_config()
+        merged.update(config)
         with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f)
+            json.dump(merged, f)
     except Exception as e:
         print(f"Error saving email config: {e}")
 
@@ -70,11 +74,24 @@ def get_current_thread_limit():
 
 
 _current_config = load_email_config()
-email_executor = ThreadPoolExecutor(max_workers=_current_config.get('max_workers', DEFAULT_LIMIT))
+# Thread count of email_executor; the outbox sizes its rounds by it.
+email_workers = _current_config.get('max_workers', DEFAULT_LIMIT)
+email_executor = ThreadPoolExecutor(max_workers=email_workers)
+
+def _configure_limiter(config):
+    from email_limiter import limiter, DEFAULT_PER_MINUTE, DEFAULT_PER_DAY, DEFAULT_TARGET_LATENCY
+    limiter.configure(
+        max_concurrency=config.get('max_workers', DEFAULT_LIMIT),
+        per_minute=config.get('per_minute', DEFAULT_PER_MINUTE),
+        per_day=config.get('per_day', DEFAULT_PER_DAY),
+        target_latency=config.get('target_latency', DEFAULT_TARGET_LATENCY),
+    )
+
+_configure_limiter(_current_config)
 
 def update_email_thread_limit(new_limit):
     """Updates the thread limit and re-initializes the executor."""
-    global email_executor
+    global email_executor, email_workers
     try:
         new_limit = int(new_limit)
         if new_limit < 1: raise ValueError("Limit must be positive")
@@ -85,91 +102,236 @@ def update_email_thread_limit(new_limit):
 
         old_executor = email_executor
         email_executor = ThreadPoolExecutor(max_workers=new_limit)
+        email_workers = new_limit
         
 
         old_executor.shutdown(wait=False)
+        _configure_limiter(load_email_config())
         
         return True
     except Exception as e:
         print(f"Failed to update thread limit: {e}")
         return False
 
+def update_email_rate_limits(per_minute, per_day):
+    """Updates the per-minute and per-day sending budgets. A per_day of None or 0 means no daily cap."""
+    try:
+        per_minute, per_day = int(per_minute), int(per_day) if per_day else None
+        if per_minute < 1 or (per_day is not None and per_day < 1): raise ValueError("Budgets must be positive")
+        save_email_config({'per_minute': per_minute, 'per_day': per_day})
+        _configure_limiter(load_email_config())
+        return True
+    except Exception as e:
+        print(f"Failed to update email rate limits: {e}")
+        return False
+
+GMAIL_SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+
+# httplib2 connections are not thread-safe, so each email worker thread keeps its own service.
+_gmail_local = threading.local()
+_gmail_stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
+_gmail_stats_lock = threading.Lock()
+
+def _count_gmail(key):
+    with _gmail_stats_lock:
+        _gmail_stats[key] += 1
+
+def get_gmail_cache_stats():
+    """Returns Gmail service cache counters and hit rate (percent)."""
+    with _gmail_stats_lock:
+        stats = dict(_gmail_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups * 100, 1) if lookups else 0.0
+    return stats
+
 def get_gmail_service(token_path):
-    """Gets the Gmail API service using explicit path."""
+    """Gets the Gmail API service using explicit path.
+
+    The service (and its HTTP connection) is cached per worker thread and reused until token.json
+    changes; credentials are only refreshed once they expire.
+    """
+    token_mtime = os.path.getmtime(token_path) if os.path.exists(token_path) else None
+    cached = getattr(_gmail_local, 'entry', None)
+
+    if cached and cached['token_path'] == token_path and cached['token_mtime'] == token_mtime:
+        creds = cached['creds']
+        if not creds.valid and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+            _count_gmail('refreshes')
+        if creds.valid:
+            _count_gmail('hits')
+            return cached['service']
+
+    _count_gmail('misses')
     creds = None
     
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, ['https://www.googleapis.com/auth/gmail.send'])
+    if token_mtime is not None:
+        creds = Credentials.from_authorized_user_file(token_path, GMAIL_SCOPES)
     
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
+            _count_gmail('refreshes')
         else:
             print("Error: Valid token.json not found for Gmail API.")
             return None
             
-    return build('gmail', 'v1', credentials=creds)
+    service = build('gmail', 'v1', credentials=creds, cache_discovery=False)
+    _gmail_local.entry = {'token_path': token_path, 'token_mtime': token_mtime, 'creds': creds, 'service': service}
+    return service
 
-def _send_email_task(to_email, subject, body, is_html, token_path):
-    """Worker function to send email via Gmail API inside a thread."""
-    try:
-        service = get_gmail_service(token_path)
-        if not service:
+GMAIL_BATCH_LIMIT = 100  # Gmail API maximum number of calls in one batch HTTP request
 
-             print(f"FAILED (No Service): Email to {to_email}")
-             return
+def encode_message(subject, body, is_html, attachments=()):
+    """MIME-encodes a message without its To header, so one encoding can be sent to many recipients.
 
-        message = EmailMessage()
-        message['To'] = to_email
-        message['From'] = 'me'
-        message['Subject'] = subject
-        
-        if is_html:
-            message.set_content("Please enable HTML to view this message.")
-            message.add_alternative(body, subtype='html')
-        else:
-            message.set_content(body)
+    attachments: [(filename, content_type, bytes)]
+    """
+    message = EmailMessage()
+    message['From'] = 'me'
+    message['Subject'] = subject
+    
+    if is_html:
+        message.set_content("Please enable HTML to view this message.")
+        message.add_alternative(body, subtype='html')
+    else:
+        message.set_content(body)
 
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-        create_message = {'raw': encoded_message}
+    for filename, content_type, data in attachments:
+        maintype, _, subtype = content_type.partition('/')
+        message.add_attachment(data, maintype=maintype, subtype=subtype or 'octet-stream', filename=filename)
 
-        service.users().messages().send(userId="me", body=create_message).execute()
-        print(f"SUCCESS: Email sent to {to_email} (Threaded)")
-    except Exception as e:
-        print(f"ERROR: Failed sending email to {to_email}: {e}")
+    return message.as_bytes()
+
+def address_message(to_email, encoded):
+    """Returns the Gmail API body for an encode_message() result addressed to to_email."""
+    to_header = email_policy.default.fold_binary('To', to_email)
+    return {'raw': base64.urlsafe_b64encode(to_header + encoded).decode()}
+
+def _build_raw_message(to_email, subject, body, is_html, attachments=()):
+    return address_message(to_email, encode_message(subject, body, is_html, attachments))
+
+def deliver_email(to_email, encoded, token_path):
+    """Sends one encode_message() result via the Gmail API. Raises on failure so the outbox can retry."""
+    service = get_gmail_service(token_path)
+    if not service:
+        raise RuntimeError("Gmail service unavailable (no valid token.json)")
+
+    service.users().messages().send(userId="me", body=address_message(to_email, encoded)).execute()
+
+def deliver_email_batch(messages, token_path):
+    """Sends [(ref, to_email, encoded)] in a single Gmail batch HTTP request (encoded from encode_message()).
+
+    Returns {ref: None if sent, else the exception for that message}. Raises if the batch as a whole fails.
+    """
+    if len(messages) > GMAIL_BATCH_LIMIT:
+        raise ValueError(f"At most {GMAIL_BATCH_LIMIT} messages per batch")
+    service = get_gmail_service(token_path)
+    if not service:
+        raise RuntimeError("Gmail service unavailable (no valid token.json)")
+
+    errors = {}
+    def on_response(request_id, response, exception):
+        errors[request_id] = exception
+
+    batch = service.new_batch_http_request(callback=on_response)
+    for ref, to_email, encoded in messages:
+        request = service.users().messages().send(userId="me", body=address_message(to_email, encoded))
+        batch.add(request, request_id=str(ref))
+    batch.execute()
+
+    missing = RuntimeError("No response for message in batch")
+    return {ref: errors[str(ref)] if str(ref) in errors else missing for ref, *_ in messages}
+
+def send_email_async(to_email, subject, body, is_html=False, key=None, priority=0):
+    """Queues the email in the outbox; the dispatcher sends it on the email thread pool.
 
-def send_email_async(to_email, subject, body, is_html=False):
-    """Submits email task to the thread pool."""
+    key is an optional idempotency key: a second message with the same key is not queued again.
+    priority=1 (outbox.PRIORITY_HIGH) is for time-critical mail such as OTPs.
+    The email is part of the caller's transaction and goes out once the caller commits. A failure to queue
+    is rolled back to a savepoint, so the caller's own pending changes are kept.
+    """
+    from models import db
     try:
-        token_path = os.path.join(current_app.root_path, 'token.json')
-        email_executor.submit(_send_email_task, to_email, subject, body, is_html, token_path)
+        from outbox import enqueue
+        with db.session.begin_nested():
+            enqueue(to_email, subject, body, is_html=is_html, key=key, priority=priority)
         return True
     except Exception as e:
-        print(f"Error submitting email task: {e}")
+        print(f"Error queueing email: {e}")
         return False
 
-def send_notification_email(to_email, subject, body):
-    """Sends a generic notification email (Assumes HTML if body contains HTML tags, else Text)."""
+def looks_like_html(body):
+    return '<br>' in body or '</p>' in body or '</table>' in body or 'html' in body.lower()
+
+def send_notification_email(to_email, subject, body, key=None, is_html=None):
+    """Sends a generic notification email. Callers should say whether body is HTML; if they don't,
+    it is guessed from the tags in the body."""
+    if is_html is None:
+        is_html = looks_like_html(body)
+    return send_email_async(to_email, subject, body, is_html=is_html, key=key)
+
+def send_shared_email(recipients, subject, body, is_html, attachments=(), key=None):
+    """Queues one message to many recipients. Returns the queued OutboxEmail rows.
+
+    The message (with any attachments) is MIME-encoded once and stored once; every recipient's outbox
+    row points at that payload. key, if given, makes the send idempotent per recipient.
+    Like send_email_async(), the rows are queued in the caller's transaction; the caller commits.
+    """
+    from models import db
+    from outbox import enqueue_shared
+    recipients = [r for r in dict.fromkeys(recipients) if r]
+    if not recipients:
+        return []
+    try:
+        with db.session.begin_nested():
+            return enqueue_shared(recipients, subject, body, is_html, attachments=attachments, key=key)
+    except Exception as e:
+        print(f"Error queueing shared email: {e}")
+        return []
 
-    is_html = '<br>' in body or '</p>' in body or '</table>' in body or 'html' in body.lower()
-    return send_email_async(to_email, subject, body, is_html=is_html)
+def send_bulk_emails(messages):
+    """Queues many notification emails in one transaction. Returns the queued OutboxEmail rows.
+
+    messages: dicts with to_email, subject, body and optional is_html (detected from the body if omitted)
+    and key (idempotency key). The dispatcher sends them in Gmail batch requests; each row records its
+    own outcome (status, attempts, last_error). For the same body to many recipients use send_shared_email().
+    The rows are queued in the caller's transaction; the caller commits.
+    """
+    from models import db
+    from outbox import enqueue_many
+    prepared = []
+    for m in messages:
+        if not m.get('to_email'):
+            continue
+        m = dict(m)
+        if m.get('is_html') is None:
+            m['is_html'] = looks_like_html(m['body'])
+        prepared.append(m)
+    try:
+        with db.session.begin_nested():
+            return enqueue_many(prepared)
+    except Exception as e:
+        print(f"Error queueing bulk emails: {e}")
+        return []
 
 def send_otp(email, otp, purpose="Verification"):
     """Sends OTP via Email."""
     subject = f'OnlyElection OTP: {purpose}'
     body = f'Hello,\n\nYour One-Time Password (OTP) for {purpose} is:\n\n{otp}\n\nThis OTP is valid for 10 minutes.\n\nIf you did not request this, please ignore this email.'
-    return send_email_async(email, subject, body, is_html=False)
+    return send_email_async(email, subject, body, is_html=False, priority=1)
 
 def send_password_email(email, username, password):
     """Sends Generated Credentials via Email."""
     subject = 'Election Admin Credentials'
     body = f'Hello,\n\nYou have been added as an admin.\nUsername: {username}\nPassword: {password}\n\nPlease login and change your password immediately.'
-    return send_email_async(email, subject, body, is_html=False)
+    return send_email_async(email, subject, body, is_html=False, priority=1)
 
 def send_revote_report_and_cleanup(election, triggering_admin_email=None):
     """
     Compiles a report of revote activity, sends it to Super Admin (and triggering admin), 
-    and then deletes all RevoteLinks for the election.
+    and then deletes all RevoteLinks for the election. The report and the deletion are part of
+    the caller's transaction; the caller commits.
     """
     from models import RevoteLink, Admin, db
     
@@ -203,10 +365,11 @@ def send_revote_report_and_cleanup(election, triggering_admin_email=None):
         <tbody>
     """
     
+    rows = []
     for link in links:
         status_color = "green" if link.is_used else "red"
         status_text = "Voted" if link.is_used else "Expired/Unused"
-        report_html += f"""
+        rows.append(f"""
             <tr>
                 <td>{link.elector.name}</td>
                 <td>{link.elector.email or '-'}</td>
@@ -214,9 +377,9 @@ def send_revote_report_and_cleanup(election, triggering_admin_email=None):
                 <td style="color:{status_color}">{status_text}</td>
                 <td>{link.created_at.strftime('%Y-%m-%d %H:%M:%S')}</td>
             </tr>
-        """
+        """)
         
-    report_html += "</tbody></table>"
+    report_html += "".join(rows) + "</tbody></table>"
     report_html += "<p><strong>System Action:</strong> All above revote links have been permanently deleted from the database.</p>"
     
     # 2. Get Recipients (Super Admins + Triggering Admin)
@@ -226,14 +389,9 @@ def send_revote_report_and_cleanup(election, triggering_admin_email=None):
     if triggering_admin_email:
         recipients.add(triggering_admin_email)
         
-    # 3. Send Emails
+    # 3. Send Emails (one encoded message shared by all recipients)
     subject = f"Revote Closure Report: {election.title}"
-    for email in recipients:
-        send_notification_email(email, subject, report_html)
+    send_shared_email(sorted(recipients), subject, report_html, is_html=True)
         
     # 4. Clean up DB
-    try:
-        RevoteLink.query.filter_by(election_id=election.id).delete()
-        db.session.commit()
-    except Exception as e:
-        print(f"Error cleaning up revote links: {e}")
+    RevoteLink.query.filter_by(election_id=election.id).delete()